@@ -0,0 +1,371 @@
+"""
+    auth.asgi
+    ~~~~~~~~~
+
+    Asynchronous (ASGI) serving mode for the SimpleIdP endpoints.
+
+    The Flask application in :mod:`auth.server` runs under uwsgi, so a login
+    holds a worker process while it mostly waits for the user store. This
+    module exposes the same ``/idp/login`` GET and POST behaviour (and
+    ``/idp/logout`` and ``/idp/metrics`` when sessions and metrics are
+    configured) as an ASGI application: password verification is awaited
+    instead of blocking the event loop, and audit records are emitted off
+    it, so a slow verification doesn't hold up the form or the other routes.
+
+    Verification itself still runs on the bounded verification executor (see
+    :mod:`auth.executor`): at most ``workers`` logins are verified at once
+    and ``queue_size`` more wait (10 in flight with the defaults). Logins
+    beyond that get a 503, as in the Flask application.
+
+    Both applications are built from the same :mod:`auth.components`, so the
+    revocation list, credential verifier, throttle, sessions and metrics are
+    configured the same way. Token revocation, introspection and the
+    access token exchange are only served by the Flask application.
+
+    Needs Python >= 3.5 and an ASGI server, e.g. `uvicorn
+    <https://www.uvicorn.org/>`_:
+
+    ::
+
+        $ pip install .[asgi]
+        $ uvicorn --factory auth.asgi:create_app --port 8109
+"""
+import asyncio
+import hmac
+import logging
+import logging.config
+import os
+import urllib.parse
+
+import werkzeug.exceptions
+import werkzeug.http
+
+from . import audit, callbacks, components, executor, loginpage, metrics as metrics_module
+from .assets import AssetStore
+from .blueprints.simpleidp import BearerUnauthorized, validate_callback_url
+from .config import load as config_load
+from .loginpage import ERROR_BAD_CREDENTIALS, ERROR_NOT_WHITELISTED, TEMPLATES_PATH
+
+_logger = logging.getLogger(__name__)
+
+# Maximum size of a login form body
+MAX_BODY_SIZE = 64 * 1024
+
+
+class _Request:
+    """ The parts of an ASGI HTTP request the IdP needs.
+    """
+
+    def __init__(self, scope, body=b'', proxy_hops=0):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.remote_addr = (scope.get('client') or (None,))[0]
+        self.headers = {
+            k.decode('latin-1').lower(): v.decode('latin-1')
+            for k, v in scope.get('headers', ())
+        }
+        if proxy_hops:
+            # same as werkzeug's ProxyFix: the address the nearest trusted
+            # proxy saw
+            forwarded = [
+                a.strip() for a in self.headers.get('x-forwarded-for', '').split(',')
+                if a.strip()
+            ]
+            if len(forwarded) >= proxy_hops:
+                self.remote_addr = forwarded[-proxy_hops]
+        self.args = urllib.parse.parse_qs(scope.get('query_string', b'').decode('utf-8', 'replace'))
+        self.form = {}
+        if self.headers.get('content-type', '').startswith('application/x-www-form-urlencoded'):
+            self.form = urllib.parse.parse_qs(body.decode('utf-8', 'replace'))
+
+    def arg(self, name, default=None):
+        return self.args.get(name, [default])[0]
+
+    def field(self, name, default=''):
+        return self.form.get(name, [default])[0]
+
+
+class IdPApplication:
+    """ ASGI application with the SimpleIdP login endpoints.
+
+    Takes the same arguments as :func:`auth.blueprints.idpblueprint` (except
+    the keys of the routes it doesn't serve), plus the configured
+    application root and the number of proxies in front of the application
+    that set ``X-Forwarded-For``.
+
+    :param users: user store; if it has a ``submit`` method (like
+        :class:`auth.executor.VerificationExecutor`) verification is awaited
+        on its future, otherwise it runs in the event loop's default executor
+    """
+
+    def __init__(self, tokenbuilder, allowed_callbacks, users, throttle=None,
+                 root='', assets=None, proxy_hops=0, metrics=None, sessions=None,
+                 metrics_key=None):
+        self.tokenbuilder = tokenbuilder
+        if hasattr(allowed_callbacks, 'match'):
+            # already compiled (e.g. an auth.reload.Swappable CallbackIndex)
+            self.callback_index = allowed_callbacks
+        else:
+            self.callback_index = callbacks.CallbackIndex.from_config(allowed_callbacks)
+        self.users = users
+        self.throttle = throttle
+        self.proxy_hops = proxy_hops
+        self.expose_metrics = metrics is not None and metrics_key is not None
+        # still timed without a registry, but only for this process and not
+        # exposed
+        self.metrics = metrics if metrics is not None else metrics_module.Metrics()
+        self.metrics_key = metrics_key
+        self.sessions = sessions
+        self.login_path = '{}/idp/login'.format(root)
+        self.logout_path = '{}/idp/logout'.format(root)
+        self.metrics_path = '{}/idp/metrics'.format(root)
+        self.static_prefix = '{}/idp/static/'.format(root)
+        self.assets = assets or AssetStore()
+        self.page = loginpage.LoginPage(TEMPLATES_PATH, assets=self.assets)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        try:
+            if scope['path'] == self.login_path:
+                if scope['method'] in ('GET', 'HEAD'):
+                    response = await self.show_form(_Request(scope))
+                elif scope['method'] == 'POST':
+                    body = await self._read_body(receive)
+                    response = await self.handle_login(
+                        _Request(scope, body, self.proxy_hops)
+                    )
+                else:
+                    raise werkzeug.exceptions.MethodNotAllowed(('GET', 'POST'))
+            elif scope['path'] == self.logout_path and self.sessions is not None:
+                if scope['method'] != 'POST':
+                    raise werkzeug.exceptions.MethodNotAllowed(('POST',))
+                response = self.logout(_Request(scope))
+            elif scope['path'] == self.metrics_path and self.expose_metrics:
+                if scope['method'] not in ('GET', 'HEAD'):
+                    raise werkzeug.exceptions.MethodNotAllowed(('GET',))
+                response = self.show_metrics(_Request(scope))
+            elif scope['path'].startswith(self.static_prefix):
+                response = self.static(
+                    _Request(scope), scope['path'][len(self.static_prefix):]
+                )
+            else:
+                raise werkzeug.exceptions.NotFound()
+        except werkzeug.exceptions.HTTPException as e:
+            response = (e.code, e.get_headers(), e.get_body().encode('utf-8'))
+        await self._send(send, *response, head=scope['method'] == 'HEAD')
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                users = self.users
+                if hasattr(users, 'peek'):
+                    # a per-process store (see auth.components); don't
+                    # create it just to shut it down
+                    users = users.peek()
+                shutdown = getattr(users, 'shutdown', None)
+                if shutdown is not None:
+                    shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _read_body(receive):
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if len(body) > MAX_BODY_SIZE:
+                raise werkzeug.exceptions.RequestEntityTooLarge()
+        return body
+
+    @staticmethod
+    async def _send(send, status, headers, body, head=False):
+        headers = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+        headers.append((b'content-length', str(len(body)).encode('latin-1')))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b'' if head else body})
+
+    def _validated_callback(self, request):
+        """ Same checks as the ``assert_req_args`` decorator and
+        :func:`auth.blueprints.simpleidp.validate_callback_url` do for the
+        Flask blueprint.
+
+        :return: ``(callback, policy)``
+        """
+        callback = request.arg('callback')
+        if callback is None:
+            raise werkzeug.exceptions.BadRequest(
+                'Resouce requires query parameters: {}'.format(('callback',))
+            )
+        with self.metrics.time('callback'):
+            policy = validate_callback_url(self.callback_index, callback)
+        return callback, policy
+
+    def _render(self, callback, whitelisted, error_html=None):
+        with self.metrics.time('render'):
+            body = self.page.render(
+                urllib.parse.urlencode({'callback': callback}), whitelisted, error_html
+            )
+        return 200, [('Content-Type', 'text/html; charset=utf-8')], body
+
+    @staticmethod
+    def _whitelisted(request):
+        return 'x-auth-whitelist' in request.headers
+
+    def _cookie(self, request):
+        cookies = werkzeug.http.parse_cookie(request.headers.get('cookie'))
+        return cookies.get(self.sessions.cookie_name)
+
+    def _session_cookie(self, value, max_age):
+        """ :return: ``Set-Cookie`` header with the same attributes as the
+            Flask blueprint sets
+        """
+        return 'Set-Cookie', werkzeug.http.dump_cookie(
+            self.sessions.cookie_name, value, max_age=max_age,
+            path=self.login_path.rsplit('/', 1)[0], secure=self.sessions.secure,
+            httponly=True, samesite='Lax'
+        )
+
+    async def _redirect_with_token(self, callback, policy, sub, outcome):
+        with self.metrics.time('token'):
+            jwt = self.tokenbuilder.for_policy(policy).create(sub=sub).encode()
+        with self.metrics.time('audit'):
+            await asyncio.get_event_loop().run_in_executor(
+                None, audit.log_token, jwt, sub
+            )
+        self.metrics.inc(outcome)
+        with self.metrics.time('redirect'):
+            location = callbacks.with_credentials(callback, jwt)
+        return 303, [('Location', location)], b''
+
+    async def show_form(self, request):
+        callback, policy = self._validated_callback(request)
+        if self.sessions is not None:
+            sub = self.sessions.get(self._cookie(request))
+            if sub is not None:
+                # single sign-on: no form, no password
+                status, headers, body = await self._redirect_with_token(
+                    callback, policy, sub, 'session'
+                )
+                return status, headers + [('Cache-Control', 'no-store')], body
+        query_string = urllib.parse.urlencode({'callback': callback})
+        whitelisted = self._whitelisted(request)
+        etag = self.page.etag(query_string, whitelisted)
+        conditional = {
+            'HTTP_' + name.upper().replace('-', '_'): request.headers[name]
+            for name in ('if-none-match', 'if-modified-since') if name in request.headers
+        }
+        if not self.page.is_modified(conditional, etag):
+            return 304, self.page.not_modified_headers(etag), b''
+        with self.metrics.time('render'):
+            body = self.page.render(query_string, whitelisted)
+        return 200, self.page.headers(etag), body
+
+    async def verify_password(self, email, password):
+        """ Await the user store's password verification without blocking the
+        event loop.
+        """
+        submit = getattr(self.users, 'submit', None)
+        if submit is None:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                None, self.users.verify_password, email, password
+            )
+        future = asyncio.wrap_future(submit(email, password))
+        try:
+            return await asyncio.wait_for(future, self.users.timeout)
+        except asyncio.TimeoutError:
+            _logger.warning('Verification for %s timed out', email)
+            raise executor.VerificationUnavailable()
+
+    async def handle_login(self, request):
+        callback, policy = self._validated_callback(request)
+        email = request.field('email')
+        password = request.field('password')
+        as_employee = request.field('type') == 'employee'
+        if as_employee:
+            if self._whitelisted(request):
+                email = 'Medewerker'
+            else:
+                self.metrics.inc('not_whitelisted')
+                return self._render(callback, False, ERROR_NOT_WHITELISTED)
+        else:
+            if self.throttle is not None:
+                self.throttle.check(email, request.remote_addr)
+            with self.metrics.time('verify_password'):
+                verified = await self.verify_password(email, password)
+            if verified and self.throttle is not None:
+                self.throttle.record_success(email, request.remote_addr)
+            if not verified:
+                _logger.info("Failed to verify password for %s", email)
+                self.metrics.inc('bad_credentials')
+                return self._render(
+                    callback, self._whitelisted(request), ERROR_BAD_CREDENTIALS
+                )
+        status, headers, body = await self._redirect_with_token(
+            callback, policy, email, 'success'
+        )
+        if self.sessions is not None and not as_employee:
+            cookie = self.sessions.create(email)
+            headers.append(self._session_cookie(cookie, self.sessions.ttl))
+        return status, headers, body
+
+    def logout(self, request):
+        """ End the single sign-on session of the browser.
+        """
+        self.sessions.delete(self._cookie(request))
+        return 204, [self._session_cookie('', 0)], b''
+
+    def show_metrics(self, request):
+        """ Latency histograms and login counters, in the Prometheus text
+        format, for scrapers with the metrics key as bearer token.
+        """
+        scheme, _, given = request.headers.get('authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(
+                given.encode('utf-8'), self.metrics_key.encode('utf-8')):
+            raise BearerUnauthorized()
+        headers = [('Content-Type', 'text/plain; charset=utf-8'), ('Cache-Control', 'no-store')]
+        return 200, headers, self.metrics.exposition().encode('utf-8')
+
+    def static(self, request, name):
+        """ Serve a static file from the in-memory :class:`auth.assets.AssetStore`.
+        """
+        asset, immutable = self.assets.get(name)
+        if asset is None:
+            raise werkzeug.exceptions.NotFound()
+        encoding, body = asset.negotiate(request.headers.get('accept-encoding'))
+        headers = asset.headers(encoding, immutable)
+        if_none_match = werkzeug.http.parse_etags(request.headers.get('if-none-match'))
+        if if_none_match.contains(asset.entity_tag(encoding)):
+            return 304, headers, b''
+        return 200, headers, body
+
+
+def create_app(configpath=None):
+    """ Create the ASGI application from the configuration, with the same
+    components as :func:`auth.server.create_app` (see
+    :mod:`auth.components`).
+
+    :param configpath: path to the configuration file, defaults to ``$CONFIG``
+    """
+    configpath = configpath or os.getenv('CONFIG')
+    config = config_load(configpath=configpath)
+    logging.config.dictConfig(config['logging'])
+    # checks the configuration before anything runs in the background
+    parts = components.build(config, configpath)
+    components.start_worker(parts)
+    return IdPApplication(
+        parts.tokenbuilder, parts.callback_index, parts.users, throttle=parts.throttle,
+        root=config['app']['root'], assets=parts.assets,
+        proxy_hops=config['app'].get('proxy_hops', 0), metrics=parts.metrics,
+        sessions=parts.sessions, metrics_key=parts.metrics_key
+    )
@@ -0,0 +1,185 @@
+"""
+    auth.assets
+    ~~~~~~~~~~~
+
+    Fingerprinted, precompressed static assets.
+
+    An :class:`AssetStore` reads all files under ``static/`` once, when the
+    application starts, and
+
+    - gives every file a versioned name with a hash of its content, e.g.
+      ``style.3f2a9c0d1e4b.css``; references in stylesheets (``url(...)``) are
+      rewritten to the versioned names as well;
+    - keeps gzip (and, if the optional `brotli
+      <https://pypi.org/project/Brotli/>`_ package is installed, brotli)
+      compressed copies of the text files in memory.
+
+    Versioned names never change content, so they're served with an immutable
+    ``Cache-Control``: returning browsers don't re-fetch them at all. The
+    plain names are still served, with revalidation, for pages that were
+    cached before an upgrade.
+
+    Usage:
+
+    ::
+
+        from auth import assets
+
+        store = assets.AssetStore()
+        store.url('style.css')  # 'static/style.3f2a9c0d1e4b.css'
+        asset, immutable = store.get('style.3f2a9c0d1e4b.css')
+        encoding, body = asset.negotiate(request.headers.get('Accept-Encoding'))
+"""
+import collections
+import gzip
+import hashlib
+import mimetypes
+import os
+import pathlib
+import posixpath
+import re
+
+import werkzeug.http
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+_project_path = pathlib.Path(os.path.dirname(os.path.abspath(__file__))).parent
+
+STATIC_PATH = _project_path / 'static'
+
+# Cache-Control for versioned and plain names
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, no-cache'
+
+# Media types worth compressing
+_COMPRESSIBLE = re.compile(r'^(text/.*|application/(javascript|json)|image/svg\+xml)$')
+
+_CSS_URL = re.compile(r'''url\((['"]?)([^'")]+)\1\)''')
+
+
+class Asset(collections.namedtuple('Asset', ('name', 'mimetype', 'etag', 'bodies'))):
+    """ A static file.
+
+    :param name: plain name, relative to the static directory
+    :param mimetype: media type
+    :param etag: (unquoted) entity tag
+    :param bodies: `dict` of content coding (``identity``, ``gzip``, ``br``)
+        to content
+    """
+
+    def negotiate(self, accept_encoding):
+        """ Pick the smallest content coding the client accepts.
+
+        :param accept_encoding: value of the request's ``Accept-Encoding``
+            header, or `None`
+        :return: ``(encoding, body)``, where ``encoding`` is `None` for the
+            identity coding
+        """
+        accept = werkzeug.http.parse_accept_header(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in self.bodies and accept.quality(encoding) > 0:
+                return encoding, self.bodies[encoding]
+        return None, self.bodies['identity']
+
+    def entity_tag(self, encoding):
+        """ :return: the (unquoted) entity tag of the given content coding
+        """
+        return self.etag if encoding is None else '{}-{}'.format(self.etag, encoding)
+
+    def headers(self, encoding, immutable):
+        """ :return: `list` of response headers for this asset
+        """
+        headers = [
+            ('Content-Type', self.mimetype),
+            ('ETag', werkzeug.http.quote_etag(self.entity_tag(encoding))),
+            ('Cache-Control', IMMUTABLE if immutable else REVALIDATE),
+        ]
+        if len(self.bodies) > 1:
+            headers.append(('Vary', 'Accept-Encoding'))
+        if encoding is not None:
+            headers.append(('Content-Encoding', encoding))
+        return headers
+
+
+def _versioned(name, digest):
+    root, ext = posixpath.splitext(name)
+    return '{}.{}{}'.format(root, digest, ext)
+
+
+def _compress(body, mimetype):
+    bodies = {'identity': body}
+    if not _COMPRESSIBLE.match(mimetype):
+        return bodies
+    compressed = gzip.compress(body, 9)
+    if len(compressed) < len(body):
+        bodies['gzip'] = compressed
+    if brotli is not None:
+        compressed = brotli.compress(body)
+        if len(compressed) < len(body):
+            bodies['br'] = compressed
+    return bodies
+
+
+class AssetStore:
+    """ All files under a static directory, in memory.
+
+    :param path: the static directory
+    :param prefix: URL path of the static directory, relative to the pages
+        that reference the assets
+    """
+
+    def __init__(self, path=STATIC_PATH, prefix='static/'):
+        self.prefix = prefix
+        self._versions = {}  # plain name -> versioned name
+        self._assets = {}    # plain or versioned name -> (asset, immutable)
+        path = pathlib.Path(path)
+        files = sorted(
+            p.relative_to(path).as_posix() for p in path.rglob('*') if p.is_file()
+        )
+        # stylesheets last, so they can refer to the versioned names
+        files.sort(key=lambda name: name.endswith('.css'))
+        for name in files:
+            body = (path / name).read_bytes()
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            if mimetype == 'text/css':
+                body = self._rewrite_css(name, body)
+            if mimetype.startswith('text/'):
+                mimetype += '; charset=utf-8'
+            digest = hashlib.sha256(body).hexdigest()[:12]
+            asset = Asset(name, mimetype, digest, _compress(body, mimetype.split(';')[0]))
+            versioned = _versioned(name, digest)
+            self._versions[name] = versioned
+            self._assets[name] = (asset, False)
+            self._assets[versioned] = (asset, True)
+
+    def _rewrite_css(self, name, body):
+        directory = posixpath.dirname(name)
+
+        def replace(match):
+            ref = match.group(2)
+            target = posixpath.normpath(posixpath.join(directory, ref))
+            versioned = self._versions.get(target)
+            if versioned is None:
+                return match.group(0)
+            return 'url({0}{1}{0})'.format(
+                match.group(1), posixpath.relpath(versioned, directory or '.')
+            )
+        return _CSS_URL.sub(replace, body.decode('utf-8')).encode('utf-8')
+
+    def url(self, name):
+        """ :return: the (relative) URL of the versioned asset, or of the plain
+            name if there is no such asset
+        """
+        return self.prefix + self._versions.get(name, name)
+
+    def get(self, name):
+        """ :return: ``(asset, immutable)``, where ``immutable`` says whether
+            ``name`` is a versioned name, or ``(None, False)``
+        """
+        return self._assets.get(name, (None, False))
+
+    def __iter__(self):
+        return iter(self._versions)
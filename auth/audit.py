@@ -12,10 +12,34 @@
         import auth.audit
         token = ...
         auth.audit.log_token(token, sub)
+
+    By default audit records are written by the handlers of the
+    ``auditlog.authserver`` logger on the request thread. After
+    :func:`start_pipeline` they are put on a bounded queue instead, and a
+    background thread writes them to those handlers in batches, so a slow sink
+    doesn't add latency to token issuance. What happens when the queue is full
+    depends on the overflow policy:
+
+    - ``sync``: the record is written on the request thread (never drops);
+    - ``block``: wait up to ``block_timeout`` seconds for room, then drop;
+    - ``drop``: drop the record immediately.
+
+    Dropped records are always counted (see :func:`pipeline_stats`) and
+    reported through the ``authserver`` logger.
 """
+import atexit
+import collections
 import logging
+import logging.handlers
+import queue
+import threading
 
 _jwtlogger = logging.getLogger('auditlog.authserver')
+_logger = logging.getLogger('authserver.audit')
+
+OVERFLOW_POLICIES = ('sync', 'block', 'drop')
+
+_pipeline = None
 
 
 def _mac_from_jwt(jwt):
@@ -44,4 +68,177 @@ def log_token(token, sub):
     """
     log_msg = 'Refreshtoken created: {} | sub={}'
     token_mac = _mac_from_jwt(token)
-    _jwtlogger.info(log_msg.format(token_mac, sub))
+    _jwtlogger.info(
+        log_msg.format(token_mac, sub),
+        extra={'token_mac': token_mac, 'token_sub': sub}
+    )
+
+
+class _PipelineHandler(logging.handlers.QueueHandler):
+    """ Puts records on the pipeline's queue, applying its overflow policy.
+    """
+
+    def __init__(self, pipeline):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+
+    def enqueue(self, record):
+        self.pipeline.put(record)
+
+
+class AuditPipeline:
+    """ Writes log records to ``handlers`` in batches, from a background
+    thread.
+
+    :param handlers: the sinks, `logging.Handler` instances
+    :param queue_size: maximum number of records waiting to be written
+    :param batch_size: maximum number of records written at once
+    :param flush_interval: seconds the writer waits for a batch to fill up
+    :param overflow: one of ``sync``, ``block`` or ``drop``
+    :param block_timeout: seconds to wait for room with the ``block`` policy
+    """
+
+    def __init__(self, handlers, queue_size=10000, batch_size=100,
+                 flush_interval=1, overflow='sync', block_timeout=1):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy: {}'.format(overflow))
+        self.handlers = list(handlers)
+        self.queue = queue.Queue(queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._counters = collections.Counter()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='audit-pipeline', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the writer after it has written every queued record.
+        """
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            self._counters[counter] += n
+
+    def stats(self):
+        """ :return: `dict` with the number of records ``enqueued``,
+            ``written``, written on the request thread because the queue was
+            full (``overflowed``), ``dropped``, and ``queued`` right now
+        """
+        with self._lock:
+            result = {k: self._counters[k] for k in ('enqueued', 'written', 'overflowed', 'dropped')}
+        result['queued'] = self.queue.qsize()
+        return result
+
+    def put(self, record):
+        try:
+            if self.overflow == 'block':
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow == 'sync':
+                self._count('overflowed')
+                self._write([record])
+                return
+            self._count('dropped')
+            _logger.error(
+                'Audit queue full, dropped record (%d dropped in total): %s',
+                self._counters['dropped'], record.getMessage()
+            )
+        else:
+            self._count('enqueued')
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            self._write(batch)
+
+    def _write(self, batch):
+        for handler in self.handlers:
+            records = [r for r in batch if r.levelno >= handler.level and handler.filter(r)]
+            if not records:
+                continue
+            if type(handler) is logging.StreamHandler:
+                # one write and one flush for the whole batch
+                handler.acquire()
+                try:
+                    handler.stream.write(''.join(
+                        handler.format(r) + handler.terminator for r in records
+                    ))
+                    handler.flush()
+                except Exception:
+                    handler.handleError(records[0])
+                finally:
+                    handler.release()
+            else:
+                for record in records:
+                    handler.handle(record)
+        self._count('written', len(batch))
+
+
+def start_pipeline(**settings):
+    """ Move the handlers of the audit logger to an :class:`AuditPipeline`.
+    The pipeline is stopped, and its queue flushed, when the process exits.
+
+    :param settings: keyword arguments for :class:`AuditPipeline`
+    """
+    global _pipeline
+    stop_pipeline()
+    handlers = list(_jwtlogger.handlers)
+    _pipeline = AuditPipeline(handlers, **settings)
+    for handler in handlers:
+        _jwtlogger.removeHandler(handler)
+    _jwtlogger.addHandler(_PipelineHandler(_pipeline))
+    _pipeline.start()
+    return _pipeline
+
+
+def stop_pipeline():
+    """ Flush and stop the pipeline, and give the handlers back to the audit
+    logger.
+    """
+    global _pipeline
+    if _pipeline is None:
+        return
+    pipeline, _pipeline = _pipeline, None
+    for handler in list(_jwtlogger.handlers):
+        if isinstance(handler, _PipelineHandler):
+            _jwtlogger.removeHandler(handler)
+    pipeline.stop()
+    for handler in pipeline.handlers:
+        _jwtlogger.addHandler(handler)
+    stats = pipeline.stats()
+    if stats['dropped']:
+        _logger.warning('Audit pipeline dropped %d records', stats['dropped'])
+
+
+def pipeline_stats():
+    """ :return: the running pipeline's :meth:`AuditPipeline.stats`, or `None`
+    """
+    return _pipeline.stats() if _pipeline is not None else None
+
+
+atexit.register(stop_pipeline)
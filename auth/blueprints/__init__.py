@@ -3,4 +3,7 @@
     ~~~~~~~~~~~~~~~
 """
 
+from .accesstoken import blueprint as accesstokenblueprint
+from .assets import blueprint as assetsblueprint
+from .jwks import blueprint as jwksblueprint
 from .simpleidp import blueprint as idpblueprint
@@ -0,0 +1,76 @@
+"""
+    auth.blueprints.accesstoken
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Exchanges refresh tokens for short-lived access tokens.
+"""
+import logging
+
+import werkzeug.exceptions
+from flask import Blueprint, Response, request
+from jwt import InvalidTokenError
+
+_logger = logging.getLogger(__name__)
+
+REALM = 'datapunt'
+
+# Claims of the refresh token that are not copied to the access token
+_TIMING_CLAIMS = ('iat', 'exp', 'nbf')
+
+
+class InvalidRefreshToken(werkzeug.exceptions.Unauthorized):
+    """ Raised when the refresh token is missing or invalid (see RFC 6750).
+    """
+    description = 'Missing or invalid refresh token.'
+
+    def __init__(self, error_description=None):
+        super().__init__()
+        self.error_description = error_description
+
+    def get_headers(self, *args, **kwargs):
+        headers = super().get_headers(*args, **kwargs)
+        challenge = 'Bearer realm="{}"'.format(REALM)
+        if self.error_description is not None:
+            challenge += ', error="invalid_token", error_description="{}"'.format(
+                self.error_description.replace('"', "'")
+            )
+        headers.append(('WWW-Authenticate', challenge))
+        return headers
+
+
+def blueprint(refreshtokenbuilder, accesstokenbuilder):
+    """
+    :param refreshtokenbuilder: :class:`auth.token.TokenBuilder` that
+        verifies refresh tokens
+    :param accesstokenbuilder: :class:`auth.token.TokenBuilder` that creates
+        access tokens
+    """
+    blueprint = Blueprint('accesstoken_app', __name__)
+
+    def _refresh_claims():
+        scheme, _, encoded = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not encoded:
+            raise InvalidRefreshToken()
+        try:
+            # verified tokens are cached, so this is usually a dict lookup
+            return refreshtokenbuilder.decode(encoded.strip())
+        except InvalidTokenError as e:
+            _logger.info('Invalid refresh token: %s', e)
+            raise InvalidRefreshToken(str(e))
+
+    @blueprint.route('/accesstoken', methods=('GET',))
+    def accesstoken():
+        """ Route for creating an access token based on a refresh token.
+        """
+        if request.accept_mimetypes and \
+                request.accept_mimetypes.best_match(('text/plain',)) is None:
+            raise werkzeug.exceptions.NotAcceptable()
+        claims = _refresh_claims()
+        data = accesstokenbuilder.create(**{
+            name: value for name, value in claims.items() if name not in _TIMING_CLAIMS
+        })
+        response = Response(data.encode(), mimetype='text/plain')
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    return blueprint
@@ -0,0 +1,26 @@
+"""
+    auth.blueprints.assets
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Serves the static assets from memory (see :mod:`auth.assets`).
+"""
+import werkzeug.exceptions
+from flask import Blueprint, Response, request
+
+
+def blueprint(assets):
+    blueprint = Blueprint('assets_app', __name__)
+
+    @blueprint.route('/static/<path:filename>', methods=('GET',))
+    def static(filename):
+        """ A static asset, in the smallest content coding the client accepts.
+        Versioned names are cached forever.
+        """
+        asset, immutable = assets.get(filename)
+        if asset is None:
+            raise werkzeug.exceptions.NotFound()
+        encoding, body = asset.negotiate(request.headers.get('Accept-Encoding'))
+        response = Response(body, headers=asset.headers(encoding, immutable))
+        return response.make_conditional(request)
+
+    return blueprint
@@ -0,0 +1,42 @@
+"""
+    auth.blueprints.jwks
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Publishes the public token verification keys as a JSON Web Key Set.
+"""
+import hashlib
+import json
+
+from flask import Blueprint, Response, request
+
+# Verification keys change only when keys are rotated, which is announced
+# well in advance by adding the new key to the set
+MAX_AGE = 3600
+
+
+def _serialize(tokenbuilder):
+    body = json.dumps(tokenbuilder.jwks(), sort_keys=True).encode('utf-8')
+    return tokenbuilder, body, hashlib.sha256(body).hexdigest()[:32]
+
+
+def blueprint(tokenbuilder, max_age=MAX_AGE):
+    blueprint = Blueprint('jwks_app', __name__)
+    # the key set only changes with the token builder (see auth.reload), so
+    # serialize it once per builder
+    serialized = [_serialize(getattr(tokenbuilder, 'current', tokenbuilder))]
+
+    @blueprint.route('/.well-known/jwks.json', methods=('GET',))
+    def jwks():
+        """ The JSON Web Key Set, with strong caching headers.
+        """
+        builder, body, etag = serialized[0]
+        current = getattr(tokenbuilder, 'current', tokenbuilder)
+        if current is not builder:
+            builder, body, etag = serialized[0] = _serialize(current)
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        return response.make_conditional(request)
+
+    return blueprint
@@ -4,58 +4,127 @@
 
     Temporary identity provider.
 """
+import hmac
 import logging
 import urllib
 
 import werkzeug
-from flask import Blueprint, redirect, render_template, request
+from flask import Blueprint, Response, jsonify, redirect, request
+from jwt import InvalidTokenError
 
-from auth import audit, decorators
+from auth import audit, callbacks, decorators, loginpage, metrics as metrics_module
+from .accesstoken import REALM
 
 
 _logger = logging.getLogger(__name__)
 
 
-def blueprint(tokenbuilder, allowed_callbacks, users):
-    blueprint = Blueprint('idp_app', __name__)
+class BearerUnauthorized(werkzeug.exceptions.Unauthorized):
+    """ Raised when a route needs an API key as bearer token (see RFC 6750).
+    """
+    description = 'This resource needs an API key as bearer token.'
 
-    def _validate_callback_url(callback_url):
-        """ Takes a string, validates it.
+    def get_headers(self, *args, **kwargs):
+        headers = super().get_headers(*args, **kwargs)
+        headers.append(('WWW-Authenticate', 'Bearer realm="{}"'.format(REALM)))
+        return headers
 
-        :raise werkzeug.exceptions.BadRequest: if the callback is invalid.
-        :return: None
 
-        """
-        if not any(callback_url.startswith(cb) for cb in allowed_callbacks):
-            raise werkzeug.exceptions.BadRequest(
-                'Bad callback URL "{}"'.format(callback_url)
-            )
+def validate_callback_url(callback_index, callback_url):
+    """ Takes a string, validates it.
+
+    :param callback_index: :class:`auth.callbacks.CallbackIndex` of the
+        allowed callbacks
+    :raise werkzeug.exceptions.BadRequest: if the callback is invalid.
+    :return: the token policy of the callback (see
+        :class:`auth.callbacks.Policy`)
+
+    """
+    policy = callback_index.match(callback_url)
+    if policy is None:
+        raise werkzeug.exceptions.BadRequest(
+            'Bad callback URL "{}"'.format(callback_url)
+        )
+    return policy
+
+
+def blueprint(tokenbuilder, allowed_callbacks, users, throttle=None,
+              revocation_key=None, assets=None, metrics=None, sessions=None,
+              introspection_key=None, metrics_key=None):
+    blueprint = Blueprint('idp_app', __name__)
+    expose_metrics = metrics is not None and metrics_key is not None
+    if metrics is None:
+        # still timed, but only for this process and not exposed
+        metrics = metrics_module.Metrics()
+    if hasattr(allowed_callbacks, 'match'):
+        # already compiled (e.g. an auth.reload.Swappable CallbackIndex)
+        callback_index = allowed_callbacks
+    else:
+        callback_index = callbacks.CallbackIndex.from_config(allowed_callbacks)
+    page = loginpage.LoginPage(assets=assets)
 
     def _whitelisted(request):
         return 'X-Auth-Whitelist' in request.headers
 
+    def _redirect_with_token(callback, policy, sub, outcome):
+        with metrics.time('token'):
+            jwt = tokenbuilder.for_policy(policy).create(sub=sub).encode()
+        with metrics.time('audit'):
+            audit.log_token(jwt, sub)
+        metrics.inc(outcome)
+        # Put credential in callback query
+        with metrics.time('redirect'):
+            response = redirect(callbacks.with_credentials(callback, jwt), code=303)
+        return response
+
+    def _set_session_cookie(response, sub):
+        response.set_cookie(
+            sessions.cookie_name, sessions.create(sub), max_age=sessions.ttl,
+            path=request.path.rsplit('/', 1)[0], secure=sessions.secure,
+            httponly=True, samesite='Lax'
+        )
+
+    def _render(callback, whitelisted, error_html=None):
+        with metrics.time('render'):
+            body = page.render(
+                urllib.parse.urlencode({'callback': callback}), whitelisted, error_html
+            )
+        return Response(body, mimetype='text/html')
+
     @blueprint.route('/login', methods=('GET',))
     @decorators.assert_req_args('callback')
     def show_form():
-        """ Route for creating an access token based on a refresh token
+        """ Route for the login form.
         """
         callback = request.args.get('callback')
-        _validate_callback_url(callback)
-        return render_template(
-            'login.html',
-            query_string=urllib.parse.urlencode({'callback': callback}),
-            whitelisted=_whitelisted(request)
-        )
+        with metrics.time('callback'):
+            policy = validate_callback_url(callback_index, callback)
+        if sessions is not None:
+            sub = sessions.get(request.cookies.get(sessions.cookie_name))
+            if sub is not None:
+                # single sign-on: no form, no password
+                response = _redirect_with_token(callback, policy, sub, 'session')
+                response.headers['Cache-Control'] = 'no-store'
+                return response
+        query_string = urllib.parse.urlencode({'callback': callback})
+        whitelisted = _whitelisted(request)
+        etag = page.etag(query_string, whitelisted)
+        if not page.is_modified(request.environ, etag):
+            return Response(status=304, headers=page.not_modified_headers(etag))
+        with metrics.time('render'):
+            body = page.render(query_string, whitelisted)
+        return Response(body, headers=page.headers(etag))
 
     @blueprint.route('/login', methods=('POST',))
     @decorators.assert_req_args('callback')
     def handle_login():
-        """ Route for creating an access token based on a refresh token.
-
-        Is this still an accurate docstring? —PvB
+        """ Route for password and employee logins. Redirects to the callback
+        with a refresh token, which can be exchanged for access tokens (see
+        :mod:`auth.blueprints.accesstoken`).
         """
         callback = request.args.get('callback')
-        _validate_callback_url(callback)
+        with metrics.time('callback'):
+            policy = validate_callback_url(callback_index, callback)
         email = request.form.get('email', '')
         password = request.form.get('password', '')
         as_employee = request.form.get('type', '') == 'employee'
@@ -63,28 +132,117 @@ def blueprint(tokenbuilder, allowed_callbacks, users):
             if _whitelisted(request):
                 email = 'Medewerker'
             else:
-                return render_template(
-                    'login.html',
-                    query_string=urllib.parse.urlencode({'callback': callback}),
-                    error_html='U komt niet meer vanaf een vertrouwd internetadres.',
-                    whitelisted=False
+                metrics.inc('not_whitelisted')
+                return _render(callback, False, loginpage.ERROR_NOT_WHITELISTED)
+        else:
+            if throttle is not None:
+                # cheap check before the expensive password verification
+                throttle.check(email, request.remote_addr)
+            with metrics.time('verify_password'):
+                verified = users.verify_password(email, password)
+            if verified and throttle is not None:
+                throttle.record_success(email, request.remote_addr)
+            if not verified:
+                _logger.info("Failed to verify password for %s", email)
+                metrics.inc('bad_credentials')
+                return _render(
+                    callback, _whitelisted(request), loginpage.ERROR_BAD_CREDENTIALS
                 )
-        elif not users.verify_password(email, password):
-            _logger.info("Failed to verify password for %s", email)
-            return render_template(
-                'login.html',
-                query_string=urllib.parse.urlencode({'callback': callback}),
-                error_html='De combinatie gebruikersnaam en wachtwoord wordt niet herkend.',
-                whitelisted=_whitelisted(request)
+        response = _redirect_with_token(callback, policy, email, 'success')
+        if sessions is not None and not as_employee:
+            _set_session_cookie(response, email)
+        return response
+
+    if sessions is not None:
+        @blueprint.route('/logout', methods=('POST',))
+        def logout():
+            """ Route that ends the single sign-on session of the browser.
+            """
+            sessions.delete(request.cookies.get(sessions.cookie_name))
+            response = Response(status=204)
+            response.delete_cookie(
+                sessions.cookie_name, path=request.path.rsplit('/', 1)[0],
+                secure=sessions.secure, httponly=True, samesite='Lax'
+            )
+            return response
+
+    def _has_key(key):
+        """ Whether the request has ``key`` as bearer token.
+        """
+        scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+        return key is not None and scheme.lower() == 'bearer' and \
+            hmac.compare_digest(given.encode('utf-8'), key.encode('utf-8'))
+
+    def _assert_revocation_key():
+        if not _has_key(revocation_key):
+            raise werkzeug.exceptions.Forbidden()
+
+    if introspection_key is not None:
+        @blueprint.route('/introspect', methods=('POST',))
+        def introspect():
+            """ Token introspection (see RFC 7662) for resource servers, which
+            authenticate with the introspection key as bearer token.
+
+            Takes a ``token`` form parameter and returns a JSON object with
+            ``active`` set to whether the token is valid, plus the token's
+            claims if it is. Verified tokens are cached until they expire, so
+            repeated introspection of a token is a single lookup.
+            """
+            if not _has_key(introspection_key):
+                raise BearerUnauthorized()
+            try:
+                claims = tokenbuilder.decode(request.form.get('token', ''))
+            except InvalidTokenError:
+                result = {'active': False}
+            else:
+                result = dict(claims, active=True)
+            response = jsonify(result)
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+
+    if tokenbuilder.revocations is not None:
+        @blueprint.route('/revoke', methods=('POST',))
+        def revoke():
+            """ Token revocation (see RFC 7009).
+
+            Anyone holding a token can revoke it by posting it as the ``token``
+            form parameter; invalid tokens are ignored. Revoking by ``mac`` or
+            by ``sub`` (all tokens issued to a subject so far) needs the
+            configured revocation key as bearer token.
+            """
+            revocations = tokenbuilder.revocations
+            if 'mac' in request.form or 'sub' in request.form:
+                _assert_revocation_key()
+                if request.form.get('mac'):
+                    revocations.revoke_mac(request.form['mac'])
+                if request.form.get('sub'):
+                    revocations.revoke_sub(request.form['sub'])
+                    if sessions is not None:
+                        sessions.revoke_sub(request.form['sub'])
+            elif 'token' in request.form:
+                encoded = request.form['token']
+                try:
+                    claims = tokenbuilder.decode(encoded)
+                except InvalidTokenError:
+                    pass
+                else:
+                    revocations.revoke_token(encoded, claims)
+            else:
+                raise werkzeug.exceptions.BadRequest('Missing token, mac or sub')
+            return '', 200, {'Cache-Control': 'no-store'}
+
+    if expose_metrics:
+        @blueprint.route('/metrics', methods=('GET',))
+        def show_metrics():
+            """ Latency histograms and login counters of all workers, in the
+            Prometheus text format, for scrapers with the metrics key as
+            bearer token.
+            """
+            if not _has_key(metrics_key):
+                raise BearerUnauthorized()
+            return Response(
+                metrics.exposition(), mimetype='text/plain',
+                headers={'Cache-Control': 'no-store'}
             )
-        jwt = tokenbuilder.create(sub=email).encode()
-        audit.log_token(jwt, email)
-        # Put credential in callback query
-        scheme, netloc, path, query, fragment = urllib.parse.urlsplit(callback)
-        query = {k: v[0] for k, v in urllib.parse.parse_qs(query).items()}
-        query['credentials'] = jwt
-        query = urllib.parse.urlencode(query)
-        result = urllib.parse.urlunsplit((scheme, netloc, path, query, fragment))
-        return redirect(result, code=303)
 
     return blueprint
@@ -0,0 +1,198 @@
+"""
+    auth.callbacks
+    ~~~~~~~~~~~~~~
+
+    Compiled allowlist of callback URLs.
+
+    A callback is allowed if it starts with one of the configured prefixes.
+    Instead of trying every prefix, :class:`CallbackIndex` compiles them into
+    a radix tree once, so a lookup costs time proportional to the length of the
+    callback, regardless of the number of prefixes.
+
+    Entries of the ``callbacks`` configuration section are either a prefix or
+    a :class:`Policy` for the relying parties behind a prefix: a token
+    ``lifetime``, extra ``claims`` and the ``kid`` of the signing key (see
+    :meth:`auth.token.TokenBuilder.for_policy`). :meth:`CallbackIndex.from_config`
+    indexes the policies, so the policy of a callback is found by the same
+    lookup that validates it.
+
+    Usage:
+
+    ::
+
+        from auth import callbacks
+
+        index = callbacks.CallbackIndex.from_config(config['callbacks'])
+        policy = index.match(callback)
+        if policy is None:
+            raise ...
+        jwt = tokenbuilder.for_policy(policy).create(sub=sub).encode()
+        redirect_to = callbacks.with_credentials(callback, jwt)
+"""
+import collections
+import functools
+import urllib.parse
+
+
+class Policy(collections.namedtuple('Policy', ('prefix', 'lifetime', 'claims', 'kid'))):
+    """ Token policy for the callbacks that start with ``prefix``.
+
+    :param prefix: URL prefix
+    :param lifetime: token lifetime in seconds, or `None` for the default
+    :param claims: `dict` of extra claims, or `None`
+    :param kid: id of the key that signs the tokens, or `None` for the
+        default
+    """
+
+    @classmethod
+    def from_config(cls, entry):
+        """ :param entry: an entry of the ``callbacks`` configuration section
+        """
+        if isinstance(entry, str):
+            return cls(entry, None, None, None)
+        return cls(entry['prefix'], entry.get('lifetime'), entry.get('claims'), entry.get('kid'))
+
+    @property
+    def is_default(self):
+        """ Whether tokens are created as without a policy.
+        """
+        return self.lifetime is None and not self.claims and self.kid is None
+
+
+def max_lifetime(entries, default):
+    """ :param entries: the ``callbacks`` configuration section
+    :param default: the default token lifetime
+    :return: the longest lifetime of a token for any callback
+    """
+    lifetimes = [Policy.from_config(entry).lifetime for entry in entries]
+    return max([default] + [lifetime for lifetime in lifetimes if lifetime is not None])
+
+
+class CallbackIndex:
+    """ Radix tree of URL prefixes.
+
+    Every node is a list ``[edges, value]`` where ``edges`` maps the first
+    character of an edge label to a tuple ``(label, child)``, and ``value`` is
+    the prefix that ends at this node (or `None`).
+
+    :param prefixes: iterable of allowed callback prefixes
+    """
+
+    def __init__(self, prefixes=()):
+        self._root = [{}, None]
+        self._size = 0
+        for prefix in prefixes:
+            self.add(prefix)
+
+    @classmethod
+    def from_config(cls, entries):
+        """ Index the entries of the ``callbacks`` configuration section.
+        :meth:`match` returns their :class:`Policy`.
+        """
+        index = cls()
+        for entry in entries:
+            policy = Policy.from_config(entry)
+            index.add(policy.prefix, policy)
+        return index
+
+    def __len__(self):
+        return self._size
+
+    def add(self, prefix, value=None):
+        """ Add a prefix to the index.
+
+        :param prefix: URL prefix
+        :param value: value returned by :meth:`match`, defaults to ``prefix``
+        """
+        node, i = self._root, 0
+        while i < len(prefix):
+            edges = node[0]
+            edge = edges.get(prefix[i])
+            if edge is None:
+                edges[prefix[i]] = (prefix[i:], [{}, None])
+                node, i = edges[prefix[i]][1], len(prefix)
+                break
+            label, child = edge
+            common = 0
+            limit = min(len(label), len(prefix) - i)
+            while common < limit and label[common] == prefix[i + common]:
+                common += 1
+            if common < len(label):
+                # split the edge at the first differing character
+                middle = [{label[common]: (label[common:], child)}, None]
+                edges[prefix[i]] = (label[:common], middle)
+                child = middle
+            node, i = child, i + common
+        if node[1] is None:
+            self._size += 1
+        node[1] = prefix if value is None else value
+
+    def values(self):
+        """ Generate the values of all prefixes.
+        """
+        stack = [self._root]
+        while stack:
+            edges, value = stack.pop()
+            if value is not None:
+                yield value
+            stack.extend(child for _, child in edges.values())
+
+    def match(self, url):
+        """ Find the longest allowed prefix of the given ``url``.
+
+        :return: the value of the longest matching prefix, or `None`
+        """
+        node, i, result = self._root, 0, self._root[1]
+        length = len(url)
+        while i < length:
+            edge = node[0].get(url[i])
+            if edge is None:
+                break
+            label, node = edge
+            if not url.startswith(label, i):
+                break
+            i += len(label)
+            if node[1] is not None:
+                result = node[1]
+        return result
+
+
+@functools.lru_cache(maxsize=4096)
+def _redirect_template(callback):
+    """ Split the callback once into the parts before and after the value of
+    its ``credentials`` query parameter.
+
+    Only call this for validated callbacks. The cache is keyed on the whole
+    URL and any suffix of an allowed prefix is valid, so it can still be
+    churned by many distinct callbacks; it's bounded, so that costs misses,
+    not memory.
+    """
+    scheme, netloc, path, query, fragment = urllib.parse.urlsplit(callback)
+    query = {k: v[0] for k, v in urllib.parse.parse_qs(query).items()}
+    query['credentials'] = None
+    before, after, target = [], [], None
+    for key, value in query.items():
+        if key == 'credentials':
+            target = after
+            continue
+        (target if target is not None else before).append(
+            urllib.parse.urlencode({key: value})
+        )
+    head = urllib.parse.urlunsplit((scheme, netloc, path, '', ''))
+    head += '?' + ''.join(p + '&' for p in before) + 'credentials='
+    tail = ''.join('&' + p for p in after)
+    if fragment:
+        tail += '#' + fragment
+    return head, tail
+
+
+def with_credentials(callback, credentials):
+    """ Put the given credentials in the query of the callback URL, replacing
+    a ``credentials`` parameter if the callback already has one.
+
+    :param callback: a validated callback URL
+    :param credentials: `str` or `bytes`
+    :return: `str`
+    """
+    head, tail = _redirect_template(callback)
+    return head + urllib.parse.quote_plus(credentials) + tail
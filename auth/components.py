@@ -0,0 +1,180 @@
+"""
+    auth.components
+    ~~~~~~~~~~~~~~~
+
+    The parts of the service that are built from the configuration, shared by
+    the Flask application of :mod:`auth.server` and the ASGI application of
+    :mod:`auth.asgi`, so both serving modes are wired the same way.
+
+    :func:`build` does the work that is safe before worker processes are
+    forked: it calibrates the password hash cost, creates the metrics
+    registry, the revocation list, the token builders, the callback index,
+    the throttle, the session store and the static assets, and checks that
+    tokens can be made for every callback policy. Nothing runs in the
+    background yet, so a configuration that fails the checks leaves no
+    threads behind.
+
+    The user store holds database connections and threads, so every process
+    creates its own on first use. :func:`start_worker` starts the background
+    work of a process: the audit pipeline and the configuration reloader.
+
+    Usage:
+
+    ::
+
+        from auth import components
+
+        parts = components.build(config, configpath)
+        components.start_worker(parts)
+        parts.users.verify_password(email, password)
+"""
+import collections
+import functools
+import logging
+import os
+import threading
+
+from . import (
+    assets, audit, callbacks, credentials, executor, metrics, pool, reload,
+    revocation, session, singleflight, throttle, token
+)
+from .config import ConfigError
+
+_logger = logging.getLogger(__name__)
+
+Components = collections.namedtuple('Components', (
+    'config', 'tokenbuilder', 'accesstokenbuilder', 'users', 'throttle', 'assets',
+    'reloader', 'callback_index', 'sessions', 'metrics', 'revocation_key',
+    'introspection_key', 'metrics_key'
+))
+
+
+class _WorkerLocal:
+    """ Proxy for an object that is created once per process, on first use.
+    An object created in the uwsgi master is never used by its workers.
+
+    :param factory: callable that creates the object
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._pid = None
+        self._obj = None
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._obj = self._factory()
+                    self._pid = os.getpid()
+        return self._obj
+
+    def peek(self):
+        """ :return: the object if this process created it, `None` otherwise
+        """
+        return self._obj if self._pid == os.getpid() else None
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def _create_users(config, iterations=None, registry=None):
+    users_factory = pool.users_factory(config['postgres'])
+    if iterations is not None:
+        users_factory = credentials.verifier_factory(users_factory, iterations, registry)
+    return singleflight.CoalescingVerifier(executor.VerificationExecutor(
+        users_factory, **config.get('verification', {})
+    ))
+
+
+def _worker_count():
+    """ The number of uwsgi worker processes, 1 outside uwsgi.
+    """
+    try:
+        import uwsgi
+    except ImportError:
+        return 1
+    return uwsgi.numproc
+
+
+def build(config, configpath=None):
+    """ Create and check the components.
+
+    :param config: the loaded configuration (see :func:`auth.config.load`)
+    :param configpath: path to the configuration file, for the reloader
+    :return: :class:`Components`
+    :raise auth.config.ConfigError: if metrics can't be collected for all
+        workers
+    :raise Exception: if tokens can't be made with the configuration
+    """
+    metrics_settings = dict(config.get('metrics', {}))
+    metrics_key = metrics_settings.pop('api_key', None)
+    registry = None
+    if 'metrics' in config:
+        if 'directory' not in metrics_settings and _worker_count() > 1:
+            # every scrape would get the numbers of a random worker
+            _logger.critical('Cannot startup: metrics need a directory shared by the workers')
+            raise ConfigError('metrics.directory is required with more than one worker')
+        registry = metrics.Metrics(**metrics_settings)
+    # time the password hash once, the workers share the result
+    iterations = None
+    if 'credentials' in config:
+        iterations = credentials.calibrate(**config['credentials'])
+        if 'pool' not in config['postgres']:
+            _logger.warning('Password hashes are only upgraded with postgres.pool')
+    users = _WorkerLocal(functools.partial(_create_users, config, iterations, registry))
+    revocation_settings = dict(config.get('revocation', {}))
+    revocation_key = revocation_settings.pop('api_key', None)
+    revocations = None
+    if 'revocation' in config:
+        revocations = revocation.RevocationList(
+            callbacks.max_lifetime(config['callbacks'], config['jwt']['lifetime']),
+            **revocation_settings
+        )
+    # swapped when the configuration is reloaded
+    tokenbuilder = reload.Swappable(
+        token.TokenBuilder(revocations=revocations, **config['jwt'])
+    )
+    accesstokenbuilder = None
+    if 'accesstoken' in config:
+        accesstokenbuilder = token.TokenBuilder(**config['accesstoken'])
+    callback_index = reload.Swappable(callbacks.CallbackIndex.from_config(config['callbacks']))
+    reloader = reload.Reloader(
+        configpath, config, tokenbuilder, callback_index,
+        **config.get('reload', {})
+    )
+    limiter = None
+    if 'throttle' in config:
+        limiter = throttle.Throttle(**config['throttle'])
+    sessions = None
+    if 'session' in config:
+        sessions = session.SessionStore(**config['session'])
+    # Fingerprint and compress the static files once
+    asset_store = assets.AssetStore()
+
+    # Check whether we can generate refresh and access tokens
+    try:
+        tokenbuilder.decode(tokenbuilder.create().encode())
+        for policy in callback_index.values():
+            tokenbuilder.for_policy(policy)
+        if accesstokenbuilder is not None:
+            accesstokenbuilder.decode(accesstokenbuilder.create().encode())
+    except:
+        _logger.critical('Cannot startup: invalid config')
+        raise
+
+    return Components(
+        config, tokenbuilder, accesstokenbuilder, users, limiter, asset_store,
+        reloader, callback_index, sessions, registry, revocation_key,
+        config.get('introspection', {}).get('api_key'), metrics_key
+    )
+
+
+def start_worker(components):
+    """ Start the background work of this process: the audit pipeline (if
+    configured) and the configuration reloader.
+    """
+    if 'audit' in components.config:
+        audit.start_pipeline(**components.config['audit'])
+    components.reloader.start()
@@ -10,6 +10,26 @@
 
     - Environment interpolation with defaults
     - JSON schema validation
+    - Snapshot cache of validated configurations
+
+    .. _config-cache:
+
+    **Snapshot cache**
+
+    Every uwsgi worker loads the configuration (``UWSGI_LAZY_APPS``). A loaded
+    and validated configuration is cached as a snapshot, keyed on a hash of
+    the configuration file, the schema and the values of the environment
+    variables the file refers to. Loading the same configuration again
+    returns the snapshot without parsing or validating anything.
+
+    Snapshots are kept in memory, and in ``$CONFIG_CACHE_DIR`` if that
+    variable is set, so they're shared between processes. The snapshots
+    contain the interpolated secrets, so the directory is created with mode
+    0700 and snapshot files with mode 0600. The directory is only used if it
+    belongs to the service's user and nobody else can access it, and snapshot
+    files only if they belong to that user and nobody else can access them;
+    a snapshot read from disk is validated again before it's used. Don't put
+    the directory in a world-writable place such as ``/tmp``.
 
     .. _default-config-locations:
 
@@ -27,14 +47,21 @@
         settings = config.load()
 
 """
+import hashlib
 import json
+import logging
 import os
 import pathlib
+import re
+import stat
 import string
 
 import jsonschema
+import jsonschema.validators
 import yaml
 
+_logger = logging.getLogger(__name__)
+
 _module_path = pathlib.Path(os.path.dirname(os.path.abspath(__file__)))
 
 DEFAULT_CONFIG_PATHS = [
@@ -44,6 +71,17 @@ DEFAULT_CONFIG_PATHS = [
 
 CONFIG_SCHEMA_V1_PATH = _module_path.parent / 'config_schema_v1.json'
 
+# Environment variable with the directory for configuration snapshots
+CACHE_DIR_ENV = 'CONFIG_CACHE_DIR'
+
+# Snapshot key -> validated configuration, serialized as JSON
+_snapshots = {}
+# Hash of a schema file -> compiled validator
+_validators = {}
+
+# Names of the environment variables a configuration file may refer to
+_ENV_REFERENCE = re.compile(r'\$\{?([_a-zA-Z][_a-zA-Z0-9]*)')
+
 
 class ConfigError(Exception):
     """ Configuration errors
@@ -54,19 +92,116 @@ def load(configpath=None):
     """ Load, parse and validate a configuration file from the given
     ``configpath`` or one of the :ref:`default locations <default-config-locations>`
 
+    Configurations are cached; see :ref:`the snapshot cache <config-cache>`.
+
     :param configpath: path to the configuration file to load (optional)
     """
-    config = _load_yaml(configpath)
-    config = _interpolate_environment(config)
-    _validate(config, CONFIG_SCHEMA_V1_PATH)
-    return config
+    raw = _find_config(configpath).read_bytes()
+    try:
+        schema_raw = pathlib.Path(CONFIG_SCHEMA_V1_PATH).read_bytes()
+    except FileNotFoundError as e:
+        raise ConfigError() from e
+    key = _snapshot_key(raw, schema_raw)
+    snapshot = _snapshots.get(key) or _read_snapshot(key)
+    if snapshot is None:
+        config = _interpolate_environment(yaml.safe_load(raw))
+        _validate(config, CONFIG_SCHEMA_V1_PATH)
+        snapshot = json.dumps(config)
+        if json.loads(snapshot) != config:
+            # not representable as JSON, so don't cache it
+            return config
+        _write_snapshot(key, snapshot)
+    _snapshots[key] = snapshot
+    return json.loads(snapshot)
+
+
+def _snapshot_key(raw, schema_raw):
+    """ Hash of a configuration file, the schema and the values of the
+    environment variables the file refers to.
+    """
+    key = hashlib.sha256()
+    for part in (raw, schema_raw):
+        key.update(hashlib.sha256(part).digest())
+    names = sorted(set(_ENV_REFERENCE.findall(raw.decode('utf-8', 'replace'))))
+    environment = [(name, os.environ.get(name)) for name in names]
+    key.update(json.dumps(environment).encode('utf-8'))
+    return key.hexdigest()
 
 
-def _load_yaml(configpath=None):
-    """ Read a yaml file from the given ``configpath`` or one of the
-    :ref:`default locations <default-config-locations>`
+def _private(st):
+    """ Whether a file belongs to this user and nobody else can access it.
+    """
+    return st.st_uid == os.getuid() and not st.st_mode & 0o077
 
-    :param configpath: path to the yaml file to load (optional)
+
+def _snapshot_path(key):
+    """ :return: the path of a snapshot, or `None` if there's no (safe)
+        snapshot directory
+    """
+    directory = os.getenv(CACHE_DIR_ENV)
+    if not directory:
+        return None
+    directory = pathlib.Path(directory)
+    try:
+        directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        st = os.lstat(str(directory))
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or not _private(st):
+        _logger.warning(
+            'Not using %s for configuration snapshots: it must be a directory '
+            'owned by this user with mode 0700', directory
+        )
+        return None
+    return directory / 'config-{}.json'.format(key)
+
+
+def _read_snapshot(key):
+    """ Read and validate a snapshot from the cache directory.
+
+    :return: the snapshot, or `None`
+    """
+    path = _snapshot_path(key)
+    if path is None:
+        return None
+    try:
+        fd = os.open(str(path), os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+    with os.fdopen(fd) as f:
+        st = os.fstat(f.fileno())
+        if not stat.S_ISREG(st.st_mode) or not _private(st):
+            _logger.warning('Ignoring configuration snapshot with unsafe ownership or mode: %s', path)
+            return None
+        snapshot = f.read()
+    try:
+        _validate(json.loads(snapshot), CONFIG_SCHEMA_V1_PATH)
+    except (ValueError, ConfigError):
+        _logger.warning('Ignoring invalid configuration snapshot: %s', path)
+        return None
+    return snapshot
+
+
+def _write_snapshot(key, snapshot):
+    """ Write a snapshot to the cache directory, if there is one. Failures
+    only cost the next process a cache miss, so they're ignored.
+    """
+    path = _snapshot_path(key)
+    if path is None:
+        return
+    tmp = path.with_name('{}.{}.tmp'.format(path.name, os.getpid()))
+    try:
+        fd = os.open(str(tmp), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(snapshot)
+        os.rename(str(tmp), str(path))
+    except OSError:
+        pass
+
+
+def _find_config(configpath=None):
+    """ :return: the path of the configuration file at ``configpath`` or at
+        one of the :ref:`default locations <default-config-locations>`
     """
     if not configpath:
         for path in DEFAULT_CONFIG_PATHS:
@@ -83,7 +218,16 @@ def _load_yaml(configpath=None):
             conffile = path
         else:
             raise ConfigError('Cannot read config from {}'.format(configpath))
-    with conffile.open() as f:
+    return conffile
+
+
+def _load_yaml(configpath=None):
+    """ Read a yaml file from the given ``configpath`` or one of the
+    :ref:`default locations <default-config-locations>`
+
+    :param configpath: path to the yaml file to load (optional)
+    """
+    with _find_config(configpath).open() as f:
         parsed = yaml.safe_load(f)
     return parsed
 
@@ -108,7 +252,7 @@ def _interpolate_environment(config):
         except ValueError as e:
             error_msg = 'Invalid substitution: {}'
             raise ConfigError(error_msg.format(value)) from e
-        return (result.isdigit() and int(result)) or result
+        return int(result) if result.isdigit() else result
 
     def interpolate_recursive(obj):
         if isinstance(obj, str):
@@ -130,16 +274,35 @@ def _validate(config, schemafile):
     :param str schemafile: path
     """
     try:
-        with pathlib.Path(schemafile).open() as f:
-            schema = json.load(f)
-    except FileNotFoundError as e:
-        raise ConfigError() from e
-    except json.JSONDecodeError as e:
+        _validator(schemafile).validate(config)
+    except jsonschema.exceptions.ValidationError as e:
         raise ConfigError() from e
+
+
+def _validator(schemafile):
+    """ The validator for the JSON schema in ``schemafile``. The schema is
+    parsed and checked once per version of the file.
+
+    :param str schemafile: path
+    """
     try:
-        jsonschema.validate(config, schema)
-    except jsonschema.exceptions.ValidationError as e:
+        raw = pathlib.Path(schemafile).read_bytes()
+    except FileNotFoundError as e:
         raise ConfigError() from e
+    key = hashlib.sha256(raw).digest()
+    validator = _validators.get(key)
+    if validator is None:
+        try:
+            schema = json.loads(raw.decode('utf-8'))
+        except ValueError as e:
+            raise ConfigError() from e
+        cls = jsonschema.validators.validator_for(schema)
+        try:
+            cls.check_schema(schema)
+        except jsonschema.exceptions.SchemaError as e:
+            raise ConfigError() from e
+        validator = _validators[key] = cls(schema)
+    return validator
 
 
 class TemplateWithDefaults(string.Template):
@@ -0,0 +1,236 @@
+"""
+    auth.credentials
+    ~~~~~~~~~~~~~~~~
+
+    Password verification with a hash cost that fits the latency budget.
+
+    :class:`dpuser.Users` hashes new passwords with a fixed number of PBKDF2
+    iterations and verifies them as a black box. :class:`CredentialVerifier`
+    wraps the user store and does the verification itself, so it can
+
+    - hash with the number of iterations found by :func:`calibrate`, which
+      times PBKDF2 on the current hardware when the service starts, to take
+      about ``target`` seconds per verification (and never fewer than
+      ``min_iterations``);
+    - upgrade a stored hash after a successful login when it was made with
+      another algorithm or fewer iterations. Hashes are never downgraded, so
+      hosts that calibrate to different counts don't rehash back and forth;
+    - hash a dummy password for unknown users, so a login for an unknown
+      address costs about as much as one with a wrong password. The dummy
+      is hashed with the iterations of the most recently read stored hash
+      (dpuser's default before any is read), so it follows the stored
+      hashes while they are upgraded instead of costing the calibrated
+      count right away. While stored hashes have mixed costs, an unknown
+      address costs as much as a recently used stored hash, not exactly as
+      much as any particular user's;
+    - time the database lookup and the hashing of every verification, in
+      :meth:`CredentialVerifier.stats`, the debug log and (given a
+      :class:`auth.metrics.Metrics`) the ``password_lookup`` and
+      ``password_hash`` stages.
+
+    The verifier reads and replaces stored hashes through
+    :meth:`auth.pool.PooledUsers.password_hash` and
+    :meth:`auth.pool.PooledUsers.replace_password_hash`, so it needs a pooled
+    user store (``postgres.pool`` in the configuration). Other stores are
+    verified as a black box and only timed.
+
+    The ``credentials`` configuration section is optional. Without it
+    passwords are verified by the user store with the cost of
+    :mod:`dpuser`, and nothing is rehashed. Several hosts that share a
+    database should use a fixed ``iterations``: with a ``target`` the
+    fastest host sets the cost that every stored hash is upgraded to.
+
+    Usage:
+
+    ::
+
+        from auth import credentials
+
+        iterations = credentials.calibrate(target=0.05)
+        verifier = credentials.CredentialVerifier(users, iterations)
+        verifier.verify_password(email, password)
+        verifier.stats()
+"""
+import collections
+import functools
+import logging
+import threading
+import time
+
+from dpuser import password_hasher
+
+_logger = logging.getLogger(__name__)
+
+# PBKDF2 iterations used to time the hash function
+_SAMPLE_ITERATIONS = 10000
+
+# dummy hashes kept for unknown users (one per number of iterations)
+_MAX_DUMMIES = 16
+
+VerifierStats = collections.namedtuple('VerifierStats', (
+    'verified',         # successful verifications
+    'failed',           # wrong passwords and unknown users
+    'unknown',          # verifications for unknown users
+    'rehashed',         # hashes upgraded after a successful verification
+    'lookup_seconds',   # total time spent reading hashes
+    'hash_seconds',     # total time spent hashing
+))
+
+
+def calibrate(target=None, iterations=None, min_iterations=password_hasher.ITERATIONS,
+              max_iterations=10000000, samples=3):
+    """ Find the number of PBKDF2 iterations that takes ``target`` seconds on
+    this machine.
+
+    :param target: seconds per verification, or `None` to use ``iterations``
+    :param iterations: fixed number of iterations, used if there's no
+        ``target``
+    :param min_iterations: lower bound of the result
+    :param max_iterations: upper bound of the result
+    :param samples: number of timings; the fastest counts
+    :return: `int`, rounded to thousands
+    """
+    if target is None:
+        return max(iterations or min_iterations, min_iterations)
+    fastest = min(
+        _time_hash(_SAMPLE_ITERATIONS) for _ in range(samples)
+    )
+    estimate = int(_SAMPLE_ITERATIONS * target / fastest) // 1000 * 1000
+    result = min(max(estimate, min_iterations), max_iterations)
+    _logger.info(
+        'Calibrated password hashing: %d iterations (%.1f ms per verification)',
+        result, fastest * result / _SAMPLE_ITERATIONS * 1000
+    )
+    return result
+
+
+def _time_hash(iterations):
+    started = time.perf_counter()
+    password_hasher.pbkdf2('calibration', 'calibration', iterations)
+    return time.perf_counter() - started
+
+
+class CredentialVerifier:
+    """ Verifies passwords against the hashes in a user store, and upgrades
+    the hashes to the configured cost.
+
+    :param users: user store; an :class:`auth.pool.PooledUsers` to upgrade
+        hashes
+    :param iterations: PBKDF2 iterations for new hashes (see
+        :func:`calibrate`)
+    :param metrics: :class:`auth.metrics.Metrics` to record the timings in
+        (optional)
+    """
+
+    def __init__(self, users, iterations=password_hasher.ITERATIONS, metrics=None):
+        self.users = users
+        self.iterations = iterations
+        self.metrics = metrics
+        # dummy hashes for unknown users, by number of iterations
+        self._dummies = {}
+        self._dummy_iterations = password_hasher.ITERATIONS
+        self._dummy(password_hasher.ITERATIONS)
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+
+    def _observe(self, stage, seconds):
+        if self.metrics is not None:
+            self.metrics.observe(stage, seconds)
+
+    def _needs_rehash(self, encoded):
+        algorithm, iterations, _ = encoded.split('$', 2)
+        return algorithm != password_hasher.ALGORITHM or int(iterations) < self.iterations
+
+    def _dummy(self, iterations):
+        dummy = self._dummies.get(iterations)
+        if dummy is None:
+            if len(self._dummies) >= _MAX_DUMMIES:
+                self._dummies.clear()
+            dummy = password_hasher.encode('dummy password', iterations=iterations)
+            self._dummies[iterations] = dummy
+        return dummy
+
+    def _observe_hash(self, encoded):
+        """ Use the cost of a stored hash for the next unknown user.
+        """
+        parts = encoded.split('$', 2)
+        if len(parts) == 3 and parts[0] == password_hasher.ALGORITHM and parts[1].isdigit():
+            # create the dummy now, not during a login for an unknown user
+            self._dummy(int(parts[1]))
+            self._dummy_iterations = int(parts[1])
+
+    def _rehash(self, email, password, encoded):
+        new = password_hasher.encode(password, iterations=self.iterations)
+        return self.users.replace_password_hash(email, encoded, new)
+
+    def verify_password(self, email, password):
+        """ Verify a password and upgrade its hash if needed.
+
+        :return: `bool`
+        """
+        if not hasattr(self.users, 'password_hash'):
+            started = time.perf_counter()
+            valid = self.users.verify_password(email, password)
+            self._record(email, valid, False, False, 0.0, time.perf_counter() - started)
+            return valid
+        email = str(email).lower()
+        started = time.perf_counter()
+        encoded = self.users.password_hash(email)
+        looked_up = time.perf_counter()
+        unknown = encoded is None
+        dummy = self._dummy(self._dummy_iterations) if unknown else None
+        try:
+            valid = password_hasher.verify(password, dummy or encoded)
+        except ValueError:
+            _logger.warning('Malformed password hash for %s', email)
+            valid = False
+        valid = valid and not unknown
+        hashed = time.perf_counter()
+        if not unknown:
+            self._observe_hash(encoded)
+        rehashed = False
+        if valid and self._needs_rehash(encoded):
+            try:
+                rehashed = self._rehash(email, password, encoded)
+            except Exception:
+                # the login itself succeeded; try again next time
+                _logger.exception('Could not upgrade the password hash for %s', email)
+        self._record(
+            email, valid, unknown, rehashed, looked_up - started, hashed - looked_up
+        )
+        return valid
+
+    def _record(self, email, valid, unknown, rehashed, lookup_seconds, hash_seconds):
+        with self._lock:
+            self._counters['verified' if valid else 'failed'] += 1
+            self._counters['unknown'] += unknown
+            self._counters['rehashed'] += rehashed
+            self._counters['lookup_seconds'] += lookup_seconds
+            self._counters['hash_seconds'] += hash_seconds
+        self._observe('password_lookup', lookup_seconds)
+        self._observe('password_hash', hash_seconds)
+        _logger.debug(
+            'Verified password for %s in %.1f ms (lookup %.1f ms, hash %.1f ms)%s',
+            email, (lookup_seconds + hash_seconds) * 1000, lookup_seconds * 1000,
+            hash_seconds * 1000, ', upgraded its hash' if rehashed else ''
+        )
+
+    def stats(self):
+        """ :return: :class:`VerifierStats`
+        """
+        with self._lock:
+            return VerifierStats(**{
+                field: self._counters[field] for field in VerifierStats._fields
+            })
+
+
+def verifier_factory(users_factory, iterations, metrics=None):
+    """ Create a (picklable) factory for a :class:`CredentialVerifier` that
+    wraps the store made by ``users_factory`` (see
+    :func:`auth.pool.users_factory`).
+    """
+    return functools.partial(_create_verifier, users_factory, iterations, metrics)
+
+
+def _create_verifier(users_factory, iterations, metrics):
+    return CredentialVerifier(users_factory(), iterations, metrics)
@@ -0,0 +1,138 @@
+"""
+    auth.executor
+    ~~~~~~~~~~~~~
+
+    Runs password verification in a bounded pool of threads or processes.
+
+    Verifying a password means a database round trip plus a deliberately
+    expensive hash computation. Doing that on the request thread pins a worker
+    for the whole duration, so a burst of logins can starve cheap requests
+    such as the login form. The executor caps the number of verifications
+    that run (``workers``) and wait (``queue_size``) at the same time, and
+    rejects everything beyond that with a 503.
+
+    Usage:
+
+    ::
+
+        from auth import executor, pool
+
+        verifier = executor.VerificationExecutor(
+            pool.users_factory(config['postgres']), **config['verification']
+        )
+        # blocks for at most `timeout` seconds, raises a 503 when overloaded
+        verifier.verify_password(email, password)
+"""
+import concurrent.futures
+import functools
+import logging
+import threading
+
+import werkzeug.exceptions
+
+_logger = logging.getLogger(__name__)
+
+EXECUTORS = ('thread', 'process')
+
+# User store of a process pool worker, created on its first verification
+_process_users = None
+
+
+class VerificationUnavailable(werkzeug.exceptions.ServiceUnavailable):
+    """ Raised when a verification is not admitted or doesn't finish in time.
+    """
+    description = 'Too many login attempts are being processed, please retry.'
+
+    def __init__(self, description=None, retry_after=1):
+        super().__init__(description)
+        self.retry_after = retry_after
+
+    def get_headers(self, *args, **kwargs):
+        headers = super().get_headers(*args, **kwargs)
+        headers.append(('Retry-After', str(self.retry_after)))
+        return headers
+
+
+def _verify_in_process(users_factory, email, password):
+    """ Runs in a process pool worker; every worker process gets its own user
+    store (and so its own database connection).
+    """
+    global _process_users
+    if _process_users is None:
+        _process_users = users_factory()
+    return _process_users.verify_password(email, password)
+
+
+class VerificationExecutor:
+    """ Wraps a user store and exposes its ``verify_password`` method, but runs
+    it in a bounded pool.
+
+    :param users_factory: callable that returns a user store (something with
+        a ``verify_password(email, password)`` method). For the ``process``
+        executor it must be picklable, e.g. ``functools.partial(Users, dsn)``.
+    :param executor: one of ``thread`` or ``process``
+    :param workers: number of concurrent verifications
+    :param queue_size: number of verifications that may wait for a worker
+    :param timeout: seconds a request waits for its verification result
+    """
+
+    def __init__(self, users_factory, executor='thread', workers=2,
+                 queue_size=8, timeout=5):
+        if executor not in EXECUTORS:
+            raise ValueError('Unknown executor: {}'.format(executor))
+        if executor == 'thread':
+            self._users = users_factory()
+            self._pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix='verify'
+            )
+            self._verify = self._verify_in_thread
+        else:
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers
+            )
+            self._verify = functools.partial(_verify_in_process, users_factory)
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self.timeout = timeout
+
+    def _verify_in_thread(self, email, password):
+        return self._users.verify_password(email, password)
+
+    def _release(self, future):
+        self._slots.release()
+
+    def submit(self, email, password):
+        """ Schedule a verification.
+
+        :raise VerificationUnavailable: if all workers and queue slots are taken
+        :return: `concurrent.futures.Future` that resolves to a `bool`
+        """
+        if not self._slots.acquire(blocking=False):
+            _logger.warning('Verification queue full, rejecting login')
+            raise VerificationUnavailable()
+        try:
+            future = self._pool.submit(self._verify, email, password)
+        except:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def verify_password(self, email, password):
+        """ Verify the given credentials, waiting at most ``timeout`` seconds.
+
+        :raise VerificationUnavailable: if the verification wasn't admitted or
+            didn't finish in time
+        :return: `bool`
+        """
+        future = self.submit(email, password)
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            _logger.warning('Verification for %s timed out', email)
+            raise VerificationUnavailable()
+
+    def shutdown(self, wait=True):
+        """ Stop accepting verifications and release the pool's workers.
+        """
+        self._pool.shutdown(wait=wait)
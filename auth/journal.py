@@ -0,0 +1,388 @@
+"""
+    auth.journal
+    ~~~~~~~~~~~~
+
+    Local, append-only journal of issued tokens, indexed by token MAC and by
+    subject.
+
+    The journal is a directory of segments. Every segment consists of three
+    memory-mapped files:
+
+    - ``NNNNNN.log``: a header followed by fixed-size records (timestamp,
+      MAC digest and prefix, subject digest and prefix, and a link to the
+      previous record of the same subject);
+    - ``NNNNNN.mac``: an open-addressing hash table from MAC to record;
+    - ``NNNNNN.sub``: an open-addressing hash table from subject to its most
+      recent record.
+
+    A segment holds a fixed number of records; when it's full a new segment
+    is started. Looking up a token or listing a subject's tokens costs a few
+    hash probes per segment, no matter how many records there are.
+
+    Records and index entries are written before the record count in the
+    segment header is updated, so readers never see half-written records.
+    Writers in different processes (e.g. uwsgi workers) take a file lock on
+    the journal directory while appending; every process opens the lock file
+    itself, also when it inherited the journal from its parent.
+
+    To write the journal, add a :class:`JournalHandler` to the
+    ``auditlog.authserver`` logger:
+
+    ::
+
+        handlers:
+          journal-auditlog:
+            class: auth.journal.JournalHandler
+            directory: /var/lib/datapuntauth/journal
+
+    To query it:
+
+    ::
+
+        $ python -m auth.journal /var/lib/datapuntauth/journal lookup <MAC>
+        $ python -m auth.journal /var/lib/datapuntauth/journal subject user@example.com
+"""
+import argparse
+import collections
+import datetime
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+MAGIC = b'ATJ2'
+
+# Records per segment; segment files are sparse, so this is an upper bound
+SEGMENT_RECORDS = 1 << 18
+
+# magic, record size, capacity, record count
+_HEADER = struct.Struct('<4sIIQ')
+_HEADER_SIZE = 64
+# timestamp, previous record of subject (+1), MAC length, MAC digest,
+# subject digest, MAC prefix, subject prefix
+_RECORD = struct.Struct('<dIH2x16s16s96s256s')
+# key (first 8 bytes of the digest), record (+1, 0 means empty)
+_SLOT = struct.Struct('<QI4x')
+
+Entry = collections.namedtuple('Entry', ('timestamp', 'mac', 'sub'))
+
+
+def _digest(value):
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+
+
+def _key(digest):
+    return struct.unpack_from('<Q', digest)[0]
+
+
+def _encode(value, size):
+    # don't cut a multibyte character in half
+    return value.encode('utf-8')[:size].decode('utf-8', 'ignore').encode('utf-8')
+
+
+class _Segment:
+    """ One segment of the journal: a data file and its two hash tables.
+    """
+
+    def __init__(self, prefix, capacity=None, writable=False):
+        self.prefix = prefix
+        if capacity is not None and not os.path.exists(prefix + '.log'):
+            self._create(prefix, capacity)
+        mode, access = ('r+b', mmap.ACCESS_WRITE) if writable else ('rb', mmap.ACCESS_READ)
+        self._maps = []
+        self.data = self._map(prefix + '.log', mode, access)
+        magic, record_size, self.capacity, _ = _HEADER.unpack_from(self.data)
+        if magic != MAGIC or record_size != _RECORD.size:
+            raise ValueError('Not a journal segment: {}'.format(prefix))
+        self.slots = self._slots(self.capacity)
+        self.macs = self._map(prefix + '.mac', mode, access)
+        self.subs = self._map(prefix + '.sub', mode, access)
+
+    @staticmethod
+    def _slots(capacity):
+        slots = 1
+        while slots < 2 * capacity:
+            slots *= 2
+        return slots
+
+    @classmethod
+    def _create(cls, prefix, capacity):
+        # create the index files first: a segment exists once its data file
+        # does, and is written atomically by renaming it into place
+        for suffix in ('.mac', '.sub'):
+            with open(prefix + suffix, 'wb') as f:
+                f.truncate(cls._slots(capacity) * _SLOT.size)
+        tmp = prefix + '.log.tmp'
+        with open(tmp, 'wb') as f:
+            f.truncate(_HEADER_SIZE + capacity * _RECORD.size)
+            f.write(_HEADER.pack(MAGIC, _RECORD.size, capacity, 0))
+        os.rename(tmp, prefix + '.log')
+
+    def _map(self, path, mode, access):
+        with open(path, mode) as f:
+            result = mmap.mmap(f.fileno(), 0, access=access)
+        self._maps.append(result)
+        return result
+
+    def close(self):
+        for m in self._maps:
+            m.close()
+
+    def flush(self):
+        for m in self._maps:
+            m.flush()
+
+    @property
+    def count(self):
+        return _HEADER.unpack_from(self.data)[3]
+
+    def _record(self, n):
+        """ :return: ``(previous record of subject + 1, MAC digest, subject
+            digest, entry)``; the entry has a prefix of long subjects
+        """
+        timestamp, prev, mac_len, mac_digest, sub_digest, mac, sub = _RECORD.unpack_from(
+            self.data, _HEADER_SIZE + n * _RECORD.size
+        )
+        mac = mac.rstrip(b'\0').decode('utf-8')
+        if mac_len > len(mac):
+            mac += '...'
+        entry = Entry(timestamp, mac, sub.rstrip(b'\0').decode('utf-8'))
+        return prev, mac_digest, sub_digest, entry
+
+    def _probe(self, table, key):
+        """ Yield ``(slot offset, record + 1)`` for the slots with ``key``, and
+        finally the first empty slot with record 0.
+        """
+        mask = self.slots - 1
+        i = key & mask
+        while True:
+            offset = i * _SLOT.size
+            slot_key, record = _SLOT.unpack_from(table, offset)
+            if record == 0:
+                yield offset, 0
+                return
+            if slot_key == key:
+                yield offset, record
+            i = (i + 1) & mask
+
+    def append(self, timestamp, mac, sub):
+        n = self.count
+        mac_digest, sub_digest = _digest(mac), _digest(sub)
+        sub_key = _key(sub_digest)
+        sub_offset, head = next(self._probe(self.subs, sub_key))
+        _RECORD.pack_into(
+            self.data, _HEADER_SIZE + n * _RECORD.size,
+            timestamp, head, len(mac), mac_digest, sub_digest, _encode(mac, 96),
+            _encode(sub, 256)
+        )
+        mac_key = _key(mac_digest)
+        for mac_offset, record in self._probe(self.macs, mac_key):
+            if record == 0:
+                _SLOT.pack_into(self.macs, mac_offset, mac_key, n + 1)
+        _SLOT.pack_into(self.subs, sub_offset, sub_key, n + 1)
+        # commit
+        _HEADER.pack_into(self.data, 0, MAGIC, _RECORD.size, self.capacity, n + 1)
+
+    def lookup(self, mac):
+        digest = _digest(mac)
+        count = self.count
+        result = []
+        for _, record in self._probe(self.macs, _key(digest)):
+            if 0 < record <= count:
+                _, record_digest, _, entry = self._record(record - 1)
+                if record_digest == digest:
+                    result.append(entry)
+        return result
+
+    def subject(self, sub):
+        """ Yield the entries of ``sub`` in this segment, newest first.
+        """
+        count = self.count
+        digest = _digest(sub)
+        for _, record in self._probe(self.subs, _key(digest)):
+            while 0 < record <= count:
+                prev, _, record_digest, entry = self._record(record - 1)
+                if record_digest == digest:
+                    # the full subject, not the stored prefix
+                    yield entry._replace(sub=sub)
+                # links always point backwards
+                record = prev if prev < record else 0
+
+
+class Journal:
+    """ A journal directory.
+
+    :param directory: path of the journal directory (created if needed)
+    :param segment_records: number of records per new segment
+    :param writable: whether this process appends to the journal
+    """
+
+    def __init__(self, directory, segment_records=SEGMENT_RECORDS, writable=False):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.writable = writable
+        self._segments = []
+        self._lockfile = None
+        self._lock_pid = None
+        if writable:
+            os.makedirs(directory, exist_ok=True)
+        self._refresh()
+
+    def _lock(self):
+        """ :return: this process's lock file and lock for its threads
+        """
+        # flock doesn't exclude processes that share an open file description,
+        # so a process forked after the journal was opened (e.g. a uwsgi
+        # worker) opens the lock file again
+        if self._lock_pid != os.getpid():
+            self._lockfile = open(os.path.join(self.directory, 'lock'), 'a')
+            self._thread_lock = threading.Lock()
+            self._lock_pid = os.getpid()
+        return self._lockfile, self._thread_lock
+
+    def _names(self):
+        return sorted(
+            name[:-4] for name in os.listdir(self.directory)
+            if name.endswith('.log') and name[:-4].isdigit()
+        )
+
+    def _refresh(self):
+        """ Open segments created since the last refresh (e.g. by another
+        process).
+        """
+        names = self._names()
+        for name in names[len(self._segments):]:
+            self._segments.append(_Segment(
+                os.path.join(self.directory, name), writable=self.writable
+            ))
+
+    def append(self, mac, sub, timestamp=None):
+        """ Append a record for a token.
+
+        :param mac: the token's MAC (see :func:`auth.audit._mac_from_jwt`)
+        :param sub: the token's subject
+        :param timestamp: seconds since the epoch, defaults to now
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        lockfile, thread_lock = self._lock()
+        with thread_lock:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                if not self._segments or self._segments[-1].count >= self._segments[-1].capacity:
+                    prefix = os.path.join(self.directory, '{:06d}'.format(len(self._segments)))
+                    self._segments.append(_Segment(prefix, self.segment_records, writable=True))
+                self._segments[-1].append(timestamp, mac, sub)
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def lookup(self, mac):
+        """ :return: `list` of :class:`Entry` for the given MAC
+        """
+        self._refresh()
+        result = []
+        for segment in reversed(self._segments):
+            result.extend(segment.lookup(mac))
+        return result
+
+    def subject(self, sub, limit=None):
+        """ :return: `list` of :class:`Entry` for the given subject, newest
+            first
+        """
+        self._refresh()
+        result = []
+        for segment in reversed(self._segments):
+            for entry in segment.subject(sub):
+                if limit is not None and len(result) >= limit:
+                    return result
+                result.append(entry)
+        return result
+
+    def __len__(self):
+        self._refresh()
+        return sum(segment.count for segment in self._segments)
+
+    def flush(self):
+        for segment in self._segments:
+            segment.flush()
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
+        if self._lock_pid == os.getpid():
+            self._lockfile.close()
+        self._lockfile = self._lock_pid = None
+
+
+class JournalHandler(logging.Handler):
+    """ Logging handler that appends audit records (those logged by
+    :func:`auth.audit.log_token`) to a :class:`Journal`. Other records are
+    ignored.
+
+    :param directory: path of the journal directory
+    :param segment_records: number of records per new segment
+    """
+
+    def __init__(self, directory, segment_records=SEGMENT_RECORDS, level=logging.NOTSET):
+        super().__init__(level)
+        self.journal = Journal(directory, segment_records, writable=True)
+
+    def emit(self, record):
+        mac = getattr(record, 'token_mac', None)
+        if mac is None:
+            return
+        try:
+            self.journal.append(mac, str(record.token_sub), record.created)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.journal.flush()
+
+    def close(self):
+        self.journal.close()
+        super().close()
+
+
+def _format(entry):
+    timestamp = datetime.datetime.fromtimestamp(entry.timestamp).isoformat()
+    return '{}\t{}\t{}'.format(timestamp, entry.sub, entry.mac)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m auth.journal', description='Query the token audit journal.'
+    )
+    parser.add_argument('directory', help='journal directory')
+    commands = parser.add_subparsers(dest='command')
+    lookup = commands.add_parser('lookup', help='find the token with the given MAC')
+    lookup.add_argument('mac')
+    subject = commands.add_parser('subject', help="list a subject's tokens, newest first")
+    subject.add_argument('sub')
+    subject.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error('a command is required')
+    journal = Journal(args.directory)
+    start = time.perf_counter()
+    if args.command == 'lookup':
+        entries = journal.lookup(args.mac)
+    else:
+        entries = journal.subject(args.sub, args.limit)
+    elapsed = time.perf_counter() - start
+    for entry in entries:
+        print(_format(entry))
+    print('{} record(s) in {:.1f} ms'.format(len(entries), elapsed * 1000), file=sys.stderr)
+    journal.close()
+    return 0 if entries else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+    auth.keys
+    ~~~~~~~~~
+
+    Signing and verification keys for JWTs.
+
+    Keys are configured in the ``keys`` list of the ``jwt`` section. Every key
+    has a key id (``kid``) that is put in the header of the tokens it signs,
+    so several keys can be valid at the same time while keys are rotated:
+
+    - the first key with a ``secret`` or ``private_key_file`` signs new tokens;
+    - all keys verify tokens that name them in their ``kid`` header.
+
+    Asymmetric keys (RS256, ES256, EdDSA, ...) are parsed once, when a
+    :class:`~auth.token.TokenBuilder` first needs them, and their public parts
+    can be published as a JSON Web Key Set (see :func:`jwks`), so other
+    services can verify tokens without our secret. They need the optional
+    `cryptography <https://cryptography.io>`_ package.
+
+    Example configuration:
+
+    ::
+
+        jwt:
+          algorithm: ES256
+          lifetime: 3600
+          keys:
+            - kid: '2018-02'
+              private_key_file: /etc/datapuntauth/es256-2018-02.pem
+            - kid: '2017-11'
+              public_key_file: /etc/datapuntauth/es256-2017-11.pub.pem
+"""
+import base64
+import collections
+
+import jwt
+import jwt.algorithms
+import jwt.exceptions
+
+Key = collections.namedtuple(
+    'Key', ('kid', 'algorithm', 'signing_key', 'verification_key')
+)
+
+HMAC_ALGORITHMS = ('HS256', 'HS384', 'HS512')
+
+
+class EdDSAAlgorithm(jwt.algorithms.Algorithm):
+    """ EdDSA (Ed25519) signatures for PyJWT versions that don't have them.
+    """
+
+    def prepare_key(self, key):
+        from cryptography.hazmat.primitives.asymmetric import ed25519
+        if not isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+            raise TypeError('Expecting an Ed25519 key')
+        return key
+
+    def sign(self, msg, key):
+        return key.sign(msg)
+
+    def verify(self, msg, key, sig):
+        from cryptography.exceptions import InvalidSignature
+        try:
+            key.verify(sig, msg)
+        except InvalidSignature:
+            return False
+        return True
+
+
+def algorithms():
+    """ :return: mapping of algorithm names to PyJWT algorithm objects,
+        including EdDSA
+    """
+    result = jwt.algorithms.get_default_algorithms()
+    if 'EdDSA' not in result and getattr(jwt.algorithms, 'has_crypto', False):
+        result['EdDSA'] = EdDSAAlgorithm()
+    return result
+
+
+def _load_pem(path, private):
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    with open(path, 'rb') as f:
+        data = f.read()
+    if private:
+        return serialization.load_pem_private_key(data, None, default_backend())
+    return serialization.load_pem_public_key(data, default_backend())
+
+
+def load(keys, default_algorithm):
+    """ Parse the configured keys.
+
+    :param keys: the ``keys`` list of the ``jwt`` configuration section
+    :param default_algorithm: algorithm for keys that don't specify one
+    :raise ValueError: if a key doesn't fit its algorithm
+    :return: `list` of :class:`Key`
+    """
+    result = []
+    supported = algorithms()
+    for conf in keys:
+        algorithm = conf.get('algorithm', default_algorithm)
+        if algorithm not in supported:
+            raise ValueError('Unsupported algorithm for key {}: {}'.format(conf['kid'], algorithm))
+        if 'secret' in conf:
+            signing_key = verification_key = conf['secret']
+        elif 'private_key_file' in conf:
+            signing_key = _load_pem(conf['private_key_file'], private=True)
+            verification_key = signing_key.public_key()
+        elif 'public_key_file' in conf:
+            signing_key = None
+            verification_key = _load_pem(conf['public_key_file'], private=False)
+        else:
+            raise ValueError('No key material for key {}'.format(conf['kid']))
+        if (algorithm in HMAC_ALGORITHMS) != ('secret' in conf):
+            raise ValueError('Key {} does not fit algorithm {}'.format(conf['kid'], algorithm))
+        try:
+            supported[algorithm].prepare_key(verification_key)
+        except (TypeError, ValueError, jwt.exceptions.InvalidKeyError) as e:
+            raise ValueError('Key {} does not fit algorithm {}'.format(conf['kid'], algorithm)) from e
+        result.append(Key(str(conf['kid']), algorithm, signing_key, verification_key))
+    return result
+
+
+def _b64uint(value, length=None):
+    length = length or (value.bit_length() + 7) // 8
+    return base64.urlsafe_b64encode(value.to_bytes(length, 'big')).rstrip(b'=').decode('ascii')
+
+
+def jwk(key):
+    """ The public JSON Web Key (RFC 7517) for an asymmetric key.
+
+    :param key: :class:`Key`
+    :return: `dict`
+    """
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+    from cryptography.hazmat.primitives import serialization
+    public = key.verification_key
+    result = {'kid': key.kid, 'alg': key.algorithm, 'use': 'sig'}
+    if isinstance(public, rsa.RSAPublicKey):
+        numbers = public.public_numbers()
+        result.update(kty='RSA', n=_b64uint(numbers.n), e=_b64uint(numbers.e))
+    elif isinstance(public, ec.EllipticCurvePublicKey):
+        numbers = public.public_numbers()
+        size = (public.curve.key_size + 7) // 8
+        crv = {'secp256r1': 'P-256', 'secp384r1': 'P-384', 'secp521r1': 'P-521'}[public.curve.name]
+        result.update(
+            kty='EC', crv=crv,
+            x=_b64uint(numbers.x, size), y=_b64uint(numbers.y, size),
+        )
+    elif isinstance(public, ed25519.Ed25519PublicKey):
+        raw = public.public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw
+        )
+        result.update(
+            kty='OKP', crv='Ed25519',
+            x=base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii'),
+        )
+    else:
+        raise ValueError('Cannot publish key {}'.format(key.kid))
+    return result
+
+
+def jwks(keys):
+    """ The JSON Web Key Set with the public parts of all asymmetric keys.
+    Shared (HMAC) secrets are never published.
+
+    :param keys: iterable of :class:`Key`
+    :return: `dict`
+    """
+    return {'keys': [jwk(k) for k in keys if k.algorithm not in HMAC_ALGORITHMS]}
@@ -0,0 +1,135 @@
+"""
+    auth.loginpage
+    ~~~~~~~~~~~~~~
+
+    Pre-rendered login page.
+
+    Of the context of ``login.html`` only the query string varies per request;
+    whether the client is whitelisted and the error message take a handful of
+    values. :class:`LoginPage` renders every (whitelisted, error) variant once,
+    with a marker in place of the query string, and splits it into fragments.
+    Serving the page then means escaping the query string and joining the
+    fragments.
+
+    GET requests can be answered with a ``304 Not Modified``: every response
+    has an ``ETag`` (derived from the page version, the variant and the query
+    string) and a ``Last-Modified`` (the template's modification time).
+
+    Usage:
+
+    ::
+
+        from auth import loginpage
+
+        page = loginpage.LoginPage()
+        body = page.render(query_string, whitelisted, loginpage.ERROR_BAD_CREDENTIALS)
+"""
+import datetime
+import hashlib
+import os
+import pathlib
+
+import jinja2
+import markupsafe
+import werkzeug.http
+
+_project_path = pathlib.Path(os.path.dirname(os.path.abspath(__file__))).parent
+
+TEMPLATES_PATH = _project_path / 'templates'
+
+ERROR_NOT_WHITELISTED = 'U komt niet meer vanaf een vertrouwd internetadres.'
+ERROR_BAD_CREDENTIALS = 'De combinatie gebruikersnaam en wachtwoord wordt niet herkend.'
+
+ERRORS = (None, ERROR_NOT_WHITELISTED, ERROR_BAD_CREDENTIALS)
+
+# Stands in for the query string while pre-rendering; escaping leaves it as is
+_MARKER = '__login_query_string__'
+
+
+class LoginPage:
+    """ The pre-rendered variants of a login template.
+
+    :param path: directory with the template
+    :param name: name of the template
+    :param assets: :class:`auth.assets.AssetStore` whose versioned URLs the
+        template's ``static_url()`` returns
+    """
+
+    def __init__(self, path=TEMPLATES_PATH, name='login.html', assets=None):
+        self.environment = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(str(path)), autoescape=True
+        )
+        self.environment.globals['static_url'] = (
+            assets.url if assets is not None else 'static/{}'.format
+        )
+        self.template = self.environment.get_template(name)
+        mtime = os.path.getmtime(self.template.filename)
+        self.last_modified = datetime.datetime.fromtimestamp(
+            int(mtime), datetime.timezone.utc
+        )
+        version = hashlib.blake2b(digest_size=8)
+        self._variants = {}
+        for whitelisted in (False, True):
+            for error_html in ERRORS:
+                html = self.template.render(
+                    query_string=_MARKER, whitelisted=whitelisted, error_html=error_html
+                )
+                version.update(html.encode('utf-8'))
+                self._variants[whitelisted, error_html] = [
+                    fragment.encode('utf-8') for fragment in html.split(_MARKER)
+                ]
+        self.version = version.hexdigest()
+
+    def render(self, query_string, whitelisted, error_html=None):
+        """ :return: the page as UTF-8 encoded `bytes`
+        """
+        fragments = self._variants.get((bool(whitelisted), error_html))
+        if fragments is None:
+            # not one of the pre-rendered variants
+            return self.template.render(
+                query_string=query_string, whitelisted=whitelisted, error_html=error_html
+            ).encode('utf-8')
+        escaped = str(markupsafe.escape(query_string)).encode('utf-8')
+        return escaped.join(fragments)
+
+    def etag(self, query_string, whitelisted):
+        """ :return: the (unquoted) entity tag of the form without an error
+        """
+        digest = hashlib.blake2b(
+            '{}:{}'.format(int(bool(whitelisted)), query_string).encode('utf-8'),
+            digest_size=8
+        )
+        return '{}-{}'.format(self.version, digest.hexdigest())
+
+    def headers(self, etag):
+        """ :return: `list` of response headers for the form with ``etag``
+        """
+        return [
+            ('Content-Type', 'text/html; charset=utf-8'),
+            ('ETag', werkzeug.http.quote_etag(etag)),
+            ('Last-Modified', werkzeug.http.http_date(self.last_modified)),
+            ('Cache-Control', 'no-cache'),
+            ('Vary', 'X-Auth-Whitelist'),
+        ]
+
+    def not_modified_headers(self, etag):
+        """ :return: `list` of response headers for a 304 for the form with
+            ``etag``: the same as :meth:`headers`, but without a body there's
+            no ``Content-Type``
+        """
+        return [
+            (name, value) for name, value in self.headers(etag)
+            if name != 'Content-Type'
+        ]
+
+    def is_modified(self, environ, etag):
+        """ Evaluate the conditional headers (``If-None-Match``,
+        ``If-Modified-Since``) of a request.
+
+        :param environ: WSGI environment, or a `dict` with at least the
+            ``HTTP_IF_*`` headers of the request
+        :return: `False` if the client's copy is current
+        """
+        return werkzeug.http.is_resource_modified(
+            environ, etag=etag, last_modified=self.last_modified
+        )
@@ -0,0 +1,240 @@
+"""
+    auth.metrics
+    ~~~~~~~~~~~~
+
+    Latency histograms and counters, shared by all worker processes.
+
+    Every process writes its own numbers to a memory-mapped file in a
+    directory shared by the workers (``metrics-<pid>.db``); no locks are
+    shared between processes and recording a value is a few additions on a
+    memory view. Reading the metrics sums the files of all processes.
+    Without a directory every process keeps (and reports) only its own
+    numbers, in anonymous memory, so the service requires a directory when
+    it runs more than one worker.
+
+    Files of stopped processes are kept, so the totals survive worker
+    restarts; empty the directory when the service is deployed (e.g. make it
+    a ``tmpfs``).
+
+    :meth:`Metrics.exposition` renders the metrics in the Prometheus text
+    format:
+
+    - ``authserver_stage_seconds``: histogram of the time spent in each stage
+      of a request, with a ``stage`` label (``password_lookup`` and
+      ``password_hash`` are recorded by :mod:`auth.credentials`);
+    - ``authserver_logins_total``: counter of logins, with an ``outcome``
+      label (``session`` for single sign-on, see :mod:`auth.session`).
+
+    Usage:
+
+    ::
+
+        from auth import metrics
+
+        registry = metrics.Metrics(directory='/run/authserver-metrics')
+        with registry.time('verify_password'):
+            users.verify_password(email, password)
+        registry.inc('success')
+"""
+import bisect
+import hashlib
+import logging
+import mmap
+import os
+import pathlib
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+STAGES = (
+    'callback', 'verify_password', 'token', 'audit', 'render', 'redirect',
+    'password_lookup', 'password_hash'
+)
+
+OUTCOMES = ('success', 'bad_credentials', 'not_whitelisted', 'session')
+
+_MAGIC = b'AUTHMET1'
+_HEADER = 16  # magic and layout digest
+
+
+class _Timer:
+    __slots__ = ('metrics', 'stage', 'started')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started)
+
+
+class Metrics:
+    """ Histograms of the stages of a request and counters of login
+    outcomes.
+
+    Per stage the values are the count of every bucket (not cumulative, the
+    last bucket is ``+Inf``), the sum and the count of the observations,
+    followed by one value per outcome.
+
+    :param directory: directory shared by the workers, or `None` to keep the
+        metrics in this process
+    :param buckets: upper bounds of the histogram buckets, in seconds
+    :param stages: names of the stages
+    :param outcomes: names of the login outcomes
+    """
+
+    def __init__(self, directory=None, buckets=BUCKETS, stages=STAGES, outcomes=OUTCOMES):
+        self.directory = pathlib.Path(directory) if directory is not None else None
+        self.buckets = tuple(sorted(buckets))
+        self.stages = tuple(stages)
+        self.outcomes = tuple(outcomes)
+        self._stride = len(self.buckets) + 3
+        self._stage_offsets = {
+            stage: i * self._stride for i, stage in enumerate(self.stages)
+        }
+        offset = len(self.stages) * self._stride
+        self._outcome_offsets = {
+            outcome: offset + i for i, outcome in enumerate(self.outcomes)
+        }
+        self._size = offset + len(self.outcomes)
+        layout = repr((self.buckets, self.stages, self.outcomes)).encode('utf-8')
+        self._header = _MAGIC + hashlib.blake2b(layout, digest_size=8).digest()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._values = None
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def __getstate__(self):
+        # for the process executor: every process opens its own values
+        state = dict(self.__dict__)
+        del state['_lock'], state['_values']
+        state['_pid'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, _lock=threading.Lock(), _values=None)
+
+    def _open(self):
+        """ :return: memory view (of doubles) of this process's values
+        """
+        length = _HEADER + self._size * 8
+        if self.directory is None:
+            buffer = mmap.mmap(-1, length)
+        else:
+            path = self.directory / 'metrics-{}.db'.format(os.getpid())
+            fd = os.open(str(path), os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.ftruncate(fd, length)
+                buffer = mmap.mmap(fd, length)
+            finally:
+                os.close(fd)
+        buffer[:_HEADER] = self._header
+        return memoryview(buffer)[_HEADER:].cast('d')
+
+    def _local(self):
+        # Forked workers inherit the mapping of their parent; every process
+        # writes its own
+        if self._pid != os.getpid():
+            self._values = self._open()
+            self._pid = os.getpid()
+        return self._values
+
+    def observe(self, stage, seconds):
+        """ Record the duration of a stage.
+        """
+        offset = self._stage_offsets[stage]
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            values = self._local()
+            values[offset + bucket] += 1
+            values[offset + self._stride - 2] += seconds
+            values[offset + self._stride - 1] += 1
+
+    def time(self, stage):
+        """ :return: context manager that records the time spent in its body
+        """
+        return _Timer(self, stage)
+
+    def inc(self, outcome):
+        """ Count a login outcome.
+        """
+        offset = self._outcome_offsets[outcome]
+        with self._lock:
+            self._local()[offset] += 1
+
+    def _snapshots(self):
+        """ Generate the values of every process.
+        """
+        if self.directory is None:
+            if self._pid == os.getpid():
+                yield self._values.tolist()
+            return
+        for path in sorted(self.directory.glob('metrics-*.db')):
+            try:
+                with path.open('rb') as f:
+                    data = f.read()
+            except OSError:
+                continue  # removed in the meantime
+            if data[:_HEADER] != self._header or len(data) != _HEADER + self._size * 8:
+                _logger.warning('Ignoring metrics file with another layout: %s', path)
+                continue
+            yield memoryview(data)[_HEADER:].cast('d').tolist()
+
+    def collect(self):
+        """ Sum the metrics of all processes.
+
+        :return: ``(stages, outcomes)``: `dict` of stage to ``(buckets, sum,
+            count)``, where ``buckets`` are cumulative counts per upper bound
+            (the last one is ``+Inf``), and `dict` of outcome to count
+        """
+        totals = [0.0] * self._size
+        for values in self._snapshots():
+            totals = [a + b for a, b in zip(totals, values)]
+        stages = {}
+        for stage, offset in self._stage_offsets.items():
+            cumulative, buckets = 0, []
+            for count in totals[offset:offset + len(self.buckets) + 1]:
+                cumulative += count
+                buckets.append(int(cumulative))
+            stages[stage] = (
+                buckets, totals[offset + self._stride - 2],
+                int(totals[offset + self._stride - 1])
+            )
+        outcomes = {
+            outcome: int(totals[offset])
+            for outcome, offset in self._outcome_offsets.items()
+        }
+        return stages, outcomes
+
+    def exposition(self):
+        """ :return: the metrics in the Prometheus text format (version 0.0.4)
+        """
+        stages, outcomes = self.collect()
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+        lines = [
+            '# HELP authserver_stage_seconds Time spent in a stage of a request.',
+            '# TYPE authserver_stage_seconds histogram',
+        ]
+        for stage, (buckets, total, count) in stages.items():
+            for bound, cumulative in zip(bounds, buckets):
+                lines.append('authserver_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(
+                    stage, bound, cumulative
+                ))
+            lines.append('authserver_stage_seconds_sum{{stage="{}"}} {!r}'.format(stage, total))
+            lines.append('authserver_stage_seconds_count{{stage="{}"}} {}'.format(stage, count))
+        lines += [
+            '# HELP authserver_logins_total Logins by outcome.',
+            '# TYPE authserver_logins_total counter',
+        ]
+        for outcome, count in outcomes.items():
+            lines.append('authserver_logins_total{{outcome="{}"}} {}'.format(outcome, count))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,339 @@
+"""
+    auth.pool
+    ~~~~~~~~~
+
+    Pooled database connections for the user store.
+
+    :class:`dpuser.Users` opens a single connection when it's created and
+    reconnects whenever that connection breaks. :class:`PooledUsers` instead
+    borrows connections from a :class:`ConnectionPool` that
+
+    - is pre-warmed with ``min_size`` connections when the worker starts;
+    - never holds more than ``max_size`` connections, and makes callers wait
+      at most ``acquire_timeout`` seconds for one;
+    - retires connections older than ``max_lifetime`` or idle for longer than
+      ``idle_timeout`` seconds;
+    - validates a connection with a cheap status check when it's borrowed, and
+      only runs a ``SELECT 1`` if it has been idle for ``check_interval``;
+    - backs off (with jitter) after a failed connection attempt, so a database
+      blip doesn't make every worker reconnect at the same moment.
+
+    Usage:
+
+    ::
+
+        from auth import pool
+
+        users = pool.PooledUsers(dsn, min_size=1, max_size=4)
+        users.verify_password(email, password)
+        users.pool.stats()
+
+    :class:`PooledUsers` also reads and replaces stored password hashes, for
+    :class:`auth.credentials.CredentialVerifier`.
+"""
+import collections
+import contextlib
+import functools
+import logging
+import random
+import threading
+import time
+
+import dpuser
+import psycopg2
+import psycopg2.extensions
+
+_logger = logging.getLogger(__name__)
+
+# queries on the users table of dpuser, for auth.credentials
+_Q_SELECT_PASSWORD = 'SELECT password FROM users WHERE email=%s'
+# only replace the hash that was verified, not a password set in the meantime
+_Q_REPLACE_PASSWORD = 'UPDATE users SET password=%s WHERE email=%s AND password=%s'
+
+PoolStats = collections.namedtuple('PoolStats', (
+    'size',         # open connections
+    'idle',         # connections waiting to be borrowed
+    'in_use',       # borrowed connections
+    'waiting',      # callers waiting for a connection
+    'created',      # connections opened since the pool was created
+    'closed',       # connections closed since the pool was created
+    'failed',       # failed connection attempts
+    'timeouts',     # acquires that timed out
+))
+
+
+class PoolError(Exception):
+    """ Raised when no connection can be acquired.
+    """
+
+
+class _PooledConnection:
+    __slots__ = ('conn', 'created', 'last_used')
+
+    def __init__(self, conn, now):
+        self.conn = conn
+        self.created = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """ Thread-safe pool of database connections.
+
+    :param connect: callable that opens a new connection
+    :param min_size: connections to open when pre-warming
+    :param max_size: maximum number of open connections
+    :param max_lifetime: seconds after which a connection is retired
+    :param idle_timeout: seconds after which an idle connection is closed
+    :param acquire_timeout: seconds to wait for a connection
+    :param check_interval: idle seconds after which a connection is checked
+        with a query before it's handed out
+    :param max_backoff: maximum seconds to wait before reconnecting after a
+        failed connection attempt
+    """
+
+    def __init__(self, connect, min_size=1, max_size=4, max_lifetime=3600,
+                 idle_timeout=600, acquire_timeout=5, check_interval=30,
+                 max_backoff=10):
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError('Invalid pool size: {}-{}'.format(min_size, max_size))
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.check_interval = check_interval
+        self.max_backoff = max_backoff
+        self._lock = threading.Condition()
+        self._idle = collections.deque()
+        self._size = 0
+        self._waiting = 0
+        self._counters = collections.Counter()
+        self._backoff = 0
+        self._retry_at = 0
+
+    def prewarm(self):
+        """ Open connections until the pool holds ``min_size`` of them. Failures
+        are logged, not raised; the pool connects lazily after a failure.
+        """
+        conns = []
+        try:
+            while self._size < self.min_size:
+                conns.append(self._acquire(time.monotonic() + self.acquire_timeout))
+        except PoolError as e:
+            _logger.warning('Could not pre-warm connection pool: %s', e)
+        for conn in conns:
+            self._release(conn)
+
+    def stats(self):
+        """ :return: :class:`PoolStats`
+        """
+        with self._lock:
+            return PoolStats(
+                size=self._size, idle=len(self._idle),
+                in_use=self._size - len(self._idle), waiting=self._waiting,
+                created=self._counters['created'], closed=self._counters['closed'],
+                failed=self._counters['failed'], timeouts=self._counters['timeouts'],
+            )
+
+    @contextlib.contextmanager
+    def connection(self):
+        """ Borrow a connection. If the block raises and the connection turns
+        out to be broken, the connection is discarded instead of returned.
+
+        :raise PoolError: if no connection could be acquired in time
+        """
+        pooled = self._acquire(time.monotonic() + self.acquire_timeout)
+        try:
+            yield pooled.conn
+        except:
+            if not self._is_healthy(pooled.conn):
+                self._discard(pooled)
+                pooled = None
+            raise
+        finally:
+            if pooled is not None:
+                self._release(pooled)
+
+    def close(self):
+        """ Close all idle connections.
+        """
+        with self._lock:
+            idle, self._idle = list(self._idle), collections.deque()
+        for pooled in idle:
+            self._discard(pooled)
+
+    def _acquire(self, deadline):
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                pooled = self._idle.pop() if self._idle else None
+                if pooled is None:
+                    if self._size < self.max_size:
+                        if now < self._retry_at:
+                            raise PoolError('Backing off after failed connection attempt')
+                        self._size += 1
+                    else:
+                        if now >= deadline:
+                            self._counters['timeouts'] += 1
+                            raise PoolError('Timed out waiting for a connection')
+                        self._waiting += 1
+                        self._lock.wait(deadline - now)
+                        self._waiting -= 1
+                        continue
+            if pooled is None:
+                return self._open(now)
+            if self._is_usable(pooled, now):
+                pooled.last_used = now
+                return pooled
+            self._discard(pooled)
+
+    def _open(self, now):
+        """ Open a new connection; the caller has reserved a slot for it.
+        """
+        try:
+            conn = self._connect()
+        except Exception as e:
+            with self._lock:
+                self._size -= 1
+                self._counters['failed'] += 1
+                self._backoff = min(self.max_backoff, max(0.1, self._backoff * 2))
+                self._retry_at = now + random.uniform(0, self._backoff)
+                self._lock.notify()
+            _logger.critical('Could not connect to database: %s', e)
+            raise PoolError('Could not connect to database') from e
+        with self._lock:
+            self._counters['created'] += 1
+            self._backoff = 0
+        return _PooledConnection(conn, now)
+
+    def _release(self, pooled):
+        now = time.monotonic()
+        if now - pooled.created > self.max_lifetime or not self._is_healthy(pooled.conn):
+            self._discard(pooled)
+            return
+        pooled.last_used = now
+        with self._lock:
+            self._idle.append(pooled)
+            self._lock.notify()
+
+    def _discard(self, pooled):
+        with contextlib.suppress(Exception):
+            pooled.conn.close()
+        with self._lock:
+            self._size -= 1
+            self._counters['closed'] += 1
+            self._lock.notify()
+
+    def _is_usable(self, pooled, now):
+        """ Check a connection that is about to be handed out.
+        """
+        if now - pooled.created > self.max_lifetime:
+            return False
+        if now - pooled.last_used > self.idle_timeout:
+            return False
+        if not self._is_healthy(pooled.conn):
+            return False
+        if now - pooled.last_used > self.check_interval:
+            try:
+                with pooled.conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+            except psycopg2.Error:
+                return False
+        return True
+
+    @staticmethod
+    def _is_healthy(conn):
+        """ Cheap check that doesn't talk to the database.
+        """
+        if conn.closed:
+            return False
+        status = conn.get_transaction_status()
+        return status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class _PooledDBConnection:
+    """ Stand-in for ``dpuser.users._DBConnection`` that borrows a connection
+    from the pool for every cursor.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @contextlib.contextmanager
+    def transaction_cursor(self):
+        """ Yields a cursor with transaction.
+        """
+        with self.pool.connection() as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    yield cur
+
+    @contextlib.contextmanager
+    def cursor(self):
+        """ Yields a cursor without transaction.
+        """
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                yield cur
+
+
+def _connect(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    return conn
+
+
+class PooledUsers(dpuser.Users):
+    """ :class:`dpuser.Users` on top of a :class:`ConnectionPool`. The pool is
+    pre-warmed when the user store is created.
+
+    :param dsn: database connection string
+    :param pool_settings: keyword arguments for :class:`ConnectionPool`
+    """
+
+    def __init__(self, dsn, **pool_settings):
+        self.pool = ConnectionPool(lambda: _connect(dsn), **pool_settings)
+        self.pool.prewarm()
+        self._conn = _PooledDBConnection(self.pool)
+
+    def password_hash(self, email):
+        """ :return: the encoded password of the given user, or `None` if
+            there's no such user
+        """
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(_Q_SELECT_PASSWORD, (email,))
+                row = cur.fetchone()
+        return row[0] if row else None
+
+    def replace_password_hash(self, email, old, new):
+        """ Replace the encoded password of a user, if it's still ``old``: a
+        password set in the meantime is left alone.
+
+        :return: `bool`, whether the hash was replaced
+        """
+        with self.pool.connection() as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(_Q_REPLACE_PASSWORD, (new, email, old))
+                    return cur.rowcount > 0
+
+
+def dsn(settings):
+    """ Build a connection string from the ``postgres`` configuration section.
+    """
+    return 'postgresql://{user}:{password}@{host}:{port}/{dbname}'.format(**settings)
+
+
+def users_factory(settings):
+    """ Create a (picklable) factory for the user store configured in the
+    ``postgres`` configuration section: a :class:`PooledUsers` if the section
+    has ``pool`` settings, a plain :class:`dpuser.Users` otherwise.
+
+    :param settings: the ``postgres`` configuration section
+    """
+    pool_settings = settings.get('pool')
+    if pool_settings is None:
+        return functools.partial(dpuser.Users, dsn(settings))
+    return functools.partial(PooledUsers, dsn(settings), **pool_settings)
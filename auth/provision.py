@@ -0,0 +1,354 @@
+"""
+    auth.provision
+    ~~~~~~~~~~~~~~
+
+    Bulk loading of user accounts into the ``users`` table of :mod:`dpuser`.
+
+    Users are read from a CSV file (with a header that has ``email`` and
+    ``password`` columns) or a JSON Lines file (one object with ``email`` and
+    ``password`` per line), and are streamed through three steps:
+
+    - the passwords are hashed in a pool of worker processes, a batch at a
+      time, with the cost of the ``credentials`` configuration section (see
+      :func:`auth.credentials.calibrate`) or ``--iterations``;
+    - every batch is copied into a temporary table with ``COPY`` and moved
+      into ``users`` with a single ``INSERT``, in one transaction. Existing
+      accounts are left alone, or get the new password with ``--update``;
+    - after every batch the number of records done is written to the
+      ``--state`` file. Running the same command again continues after the
+      last committed batch.
+
+    Records without a valid email address or with a password shorter than 8
+    characters are skipped and logged. With ``--dry-run`` the accounts are
+    written to a :class:`MemoryWriter` instead of the database.
+
+    Usage:
+
+    ::
+
+        $ python -m auth.provision users.csv --state users.csv.state
+        $ python -m auth.provision users.jsonl --dry-run --iterations 1000
+"""
+import argparse
+import collections
+import concurrent.futures
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+
+from dpuser import password_hasher
+
+_logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl')
+
+MIN_PASSWORD_LENGTH = 8
+
+_Q_STAGE = """
+    CREATE TEMPORARY TABLE IF NOT EXISTS provision_users (
+        email character varying(254),
+        password character varying(128)
+    ) ON COMMIT DELETE ROWS"""
+_Q_COPY = 'COPY provision_users (email, password) FROM STDIN'
+_Q_INSERT = """
+    INSERT INTO users (email, password)
+    SELECT DISTINCT ON (email) email, password FROM provision_users
+    ON CONFLICT (email) DO {}"""
+
+Progress = collections.namedtuple('Progress', (
+    'records',      # records read, including skipped ones
+    'invalid',      # records skipped because they're invalid
+    'written',      # accounts inserted or updated
+    'existing',     # accounts that already existed and were left alone
+    'elapsed',      # seconds since the start
+))
+
+
+def _valid_email(email):
+    # the values are copied in the COPY text format, so no whitespace or
+    # backslashes
+    return (
+        0 < len(email) <= 254 and email.count('@') == 1
+        and not any(c.isspace() or c == '\\' for c in email)
+    )
+
+
+def _json_records(f):
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = {}
+        yield record if isinstance(record, dict) else {}
+
+
+def read_users(f, fmt):
+    """ Read users from a CSV or JSON Lines file.
+
+    :param f: text file
+    :param fmt: one of ``csv`` or ``jsonl``
+    :return: iterator of ``(email, password)``, or `None` for every invalid
+        record
+    """
+    if fmt == 'csv':
+        records = csv.DictReader(f)
+    elif fmt == 'jsonl':
+        records = _json_records(f)
+    else:
+        raise ValueError('Unknown format: {}'.format(fmt))
+    for number, record in enumerate(records, 1):
+        email = str(record.get('email') or '').strip().lower()
+        password = record.get('password')
+        if not _valid_email(email):
+            _logger.warning('Record %d: invalid email address', number)
+            yield None
+        elif not isinstance(password, str) or len(password) < MIN_PASSWORD_LENGTH:
+            _logger.warning('Record %d: password missing or too short', number)
+            yield None
+        else:
+            yield email, password
+
+
+def hash_batch(users, iterations):
+    """ :return: `list` of ``(email, encoded password)``
+    """
+    return [
+        (email, password_hasher.encode(password, iterations=iterations))
+        for email, password in users
+    ]
+
+
+class PostgresWriter:
+    """ Writes accounts to the ``users`` table, a batch per transaction.
+
+    :param dsn: connection string (see :func:`auth.pool.dsn`)
+    :param update: whether to set the password of existing accounts
+    """
+
+    def __init__(self, dsn, update=False):
+        import psycopg2
+        self._conn = psycopg2.connect(dsn)
+        self._insert = _Q_INSERT.format(
+            'UPDATE SET password = EXCLUDED.password' if update else 'NOTHING'
+        )
+
+    def write(self, accounts):
+        """ :return: number of accounts inserted or updated
+        """
+        data = io.StringIO(''.join(
+            '{}\t{}\n'.format(email, encoded) for email, encoded in accounts
+        ))
+        with self._conn:
+            with self._conn.cursor() as cur:
+                cur.execute(_Q_STAGE)
+                cur.copy_expert(_Q_COPY, data)
+                cur.execute(self._insert)
+                return cur.rowcount
+
+    def close(self):
+        self._conn.close()
+
+
+class MemoryWriter:
+    """ Stand-in for :class:`PostgresWriter` that keeps the accounts in
+    memory.
+
+    :param users: `dict` of email to encoded password of the existing
+        accounts (optional)
+    :param update: whether to set the password of existing accounts
+    """
+
+    def __init__(self, users=None, update=False):
+        self.users = {} if users is None else users
+        self.update = update
+        self.batches = 0
+
+    def write(self, accounts):
+        batch = dict(accounts)
+        if not self.update:
+            batch = {
+                email: encoded for email, encoded in batch.items() if email not in self.users
+            }
+        self.users.update(batch)
+        self.batches += 1
+        return len(batch)
+
+    def close(self):
+        pass
+
+
+def _batches(records, size):
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, size))
+        if not batch:
+            return
+        yield len(batch), [record for record in batch if record is not None]
+
+
+def provision(records, writer, iterations=password_hasher.ITERATIONS, batch_size=1000,
+              workers=None, skip=0, on_batch=None):
+    """ Hash and write users.
+
+    :param records: iterator of ``(email, password)`` or `None` (see
+        :func:`read_users`)
+    :param writer: :class:`PostgresWriter` or :class:`MemoryWriter`
+    :param iterations: PBKDF2 iterations
+    :param batch_size: records per batch (and transaction)
+    :param workers: hashing processes; `None` for one per CPU, 0 to hash in
+        this process
+    :param skip: number of records that were done before
+    :param on_batch: called with the :class:`Progress` after every written
+        batch (optional)
+    :return: :class:`Progress`
+    """
+    started = time.perf_counter()
+    counts = collections.Counter(records=skip)
+    batches = _batches(itertools.islice(records, skip, None), batch_size)
+
+    def write(size, accounts):
+        written = writer.write(accounts) if accounts else 0
+        counts.update(
+            records=size, invalid=size - len(accounts), written=written,
+            existing=len(accounts) - written
+        )
+        progress = Progress(elapsed=time.perf_counter() - started, **{
+            field: counts[field] for field in Progress._fields[:-1]
+        })
+        if on_batch is not None:
+            on_batch(progress)
+        return progress
+
+    progress = Progress(skip, 0, 0, 0, 0.0)
+    if workers == 0:
+        for size, users in batches:
+            progress = write(size, hash_batch(users, iterations))
+        return progress
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        # keep a few batches per worker in flight, and write them in order
+        pending = collections.deque()
+        limit = 2 * (workers or os.cpu_count() or 1)
+        for size, users in batches:
+            pending.append((size, pool.submit(hash_batch, users, iterations)))
+            if len(pending) >= limit:
+                size, future = pending.popleft()
+                progress = write(size, future.result())
+        while pending:
+            size, future = pending.popleft()
+            progress = write(size, future.result())
+    return progress
+
+
+def load_state(path, source):
+    """ :return: the number of records of ``source`` that were done, according
+        to the state file at ``path``
+    :raise ValueError: if the state file is about another source
+    """
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return 0
+    if state['source'] != source:
+        raise ValueError('State file {} is for {}'.format(path, state['source']))
+    return state['records']
+
+
+def save_state(path, source, progress):
+    """ Write the state file, atomically.
+    """
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as f:
+        json.dump({'source': source, 'records': progress.records}, f)
+    os.replace(tmp, path)
+
+
+def _report(progress, skip=0):
+    print('{} records ({:.0f}/s): {} written, {} existing, {} invalid'.format(
+        progress.records, (progress.records - skip) / max(progress.elapsed, 1e-9),
+        progress.written, progress.existing, progress.invalid
+    ), file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m auth.provision', description='Load user accounts in bulk.'
+    )
+    parser.add_argument('input', help='CSV or JSON Lines file, - for stdin')
+    parser.add_argument('--format', choices=FORMATS,
+                        help='input format (default: from the file extension)')
+    parser.add_argument('--config', help='configuration file (default: $CONFIG)')
+    parser.add_argument('--state', help='file to record progress in, and resume from')
+    parser.add_argument('--update', action='store_true',
+                        help='set the password of existing accounts')
+    parser.add_argument('--dry-run', action='store_true',
+                        help="hash the passwords, but don't write them to the database")
+    parser.add_argument('--iterations', type=int,
+                        help='PBKDF2 iterations (default: from the credentials section)')
+    parser.add_argument('--batch-size', type=int, default=5000,
+                        help='accounts per transaction (default: 5000)')
+    parser.add_argument('--workers', type=int,
+                        help='hashing processes (default: one per CPU, 0: none)')
+    parser.add_argument('--progress-interval', type=float, default=5,
+                        help='seconds between progress reports (default: 5)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    fmt = args.format
+    if fmt is None:
+        fmt = os.path.splitext(args.input)[1].lstrip('.').lower()
+        if fmt not in FORMATS:
+            parser.error('cannot tell the format of {}, use --format'.format(args.input))
+    iterations = args.iterations
+    writer = MemoryWriter(update=args.update)
+    if iterations is None or not args.dry_run:
+        from . import config as config_module, credentials, pool
+        config = config_module.load(configpath=args.config or os.getenv('CONFIG'))
+        if iterations is None:
+            iterations = credentials.calibrate(**config.get('credentials', {}))
+        if not args.dry_run:
+            writer = PostgresWriter(pool.dsn(config['postgres']), args.update)
+
+    source = os.path.abspath(args.input) if args.input != '-' else '-'
+    skip = 0
+    if args.state:
+        try:
+            skip = load_state(args.state, source)
+        except ValueError as e:
+            parser.error(str(e))
+        if skip:
+            print('Resuming after {} records'.format(skip), file=sys.stderr)
+    reported = [time.perf_counter()]
+
+    def on_batch(progress):
+        if args.state and not args.dry_run:
+            save_state(args.state, source, progress)
+        if time.perf_counter() - reported[0] >= args.progress_interval:
+            _report(progress, skip)
+            reported[0] = time.perf_counter()
+
+    f = sys.stdin if args.input == '-' else open(args.input, newline='', encoding='utf-8')
+    try:
+        progress = provision(
+            read_users(f, fmt), writer, iterations, args.batch_size, args.workers, skip,
+            on_batch
+        )
+    finally:
+        writer.close()
+        if f is not sys.stdin:
+            f.close()
+    _report(progress, skip)
+    if args.dry_run:
+        print('Dry run: nothing was written to the database', file=sys.stderr)
+    return 1 if progress.invalid else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+    auth.reload
+    ~~~~~~~~~~~
+
+    Reloads the configuration without restarting workers.
+
+    A :class:`Reloader` re-reads the configuration file when it changes (every
+    worker checks its modification time every ``interval`` seconds), or when
+    :meth:`Reloader.reload` is called. The new configuration is loaded and
+    validated, and a new token builder and callback allowlist are built from
+    it and checked. Only if all of that succeeds are they swapped in; a broken
+    configuration is logged and the running one stays live.
+
+    Reloaded are:
+
+    - the ``callbacks`` allowlist;
+    - the ``jwt`` section (secret, signing keys, lifetime, algorithm);
+    - the levels of the loggers in the ``logging`` section (the handlers are
+      kept).
+
+    Changes to other sections are reported, but need a restart.
+
+    Components are swapped by replacing the object a :class:`Swappable`
+    refers to, which is atomic for each component: a request sees either the
+    old or the new version of it. The token builder and the callback
+    allowlist are two swaps, though, so a login that runs during a reload
+    can briefly pair the new token builder with a policy (e.g. a lifetime)
+    of the old allowlist. The token builder is swapped first, so such a
+    token is still signed with the new keys, and has the lifetime its
+    callback had a moment before.
+"""
+import logging
+import os
+import threading
+
+from . import callbacks, config as config_module, token
+
+_logger = logging.getLogger(__name__)
+
+# Sections that can't be changed without restarting
+RESTART_SECTIONS = (
+    'app', 'postgres', 'verification', 'throttle', 'revocation', 'audit', 'startup',
+    'reload', 'metrics', 'accesstoken', 'session', 'credentials', 'introspection'
+)
+
+
+class Swappable:
+    """ Proxy for the current version of a component.
+
+    :param current: the component
+    """
+
+    def __init__(self, current):
+        self.current = current
+
+    def swap(self, new):
+        """ Replace the component.
+
+        :return: the old component
+        """
+        old, self.current = self.current, new
+        return old
+
+    def __getattr__(self, name):
+        return getattr(self.current, name)
+
+
+def _log_levels(logging_config):
+    """ :return: `list` of ``(logger name, level)``; the root logger's name
+        is `None`
+    :raise ValueError: if a level is unknown
+    """
+    levels = [
+        (name, settings['level'])
+        for name, settings in logging_config.get('loggers', {}).items()
+        if 'level' in settings
+    ]
+    if 'level' in logging_config.get('root', {}):
+        levels.append((None, logging_config['root']['level']))
+    for name, level in levels:
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError('Unknown level for logger {}: {}'.format(name, level))
+    return levels
+
+
+class Reloader:
+    """ Watches the configuration file and swaps in reloaded components.
+
+    :param configpath: path to the configuration file (optional, see
+        :func:`auth.config.load`)
+    :param config: the configuration that is live now
+    :param tokenbuilder: :class:`Swappable` of the :class:`auth.token.TokenBuilder`
+    :param callback_index: :class:`Swappable` of the
+        :class:`auth.callbacks.CallbackIndex`
+    :param interval: seconds between checks of the configuration file; 0
+        disables watching
+    """
+
+    def __init__(self, configpath, config, tokenbuilder, callback_index, interval=5):
+        self.path = config_module._find_config(configpath)
+        self.config = config
+        self.tokenbuilder = tokenbuilder
+        self.callback_index = callback_index
+        self.interval = interval
+        self.reloads = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._fingerprint = self._stat()
+
+    def _stat(self):
+        try:
+            stat = os.stat(str(self.path))
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def check(self):
+        """ Reload if the configuration file changed since the last check.
+
+        :return: whether a new configuration was swapped in
+        """
+        fingerprint = self._stat()
+        if fingerprint is None or fingerprint == self._fingerprint:
+            return False
+        self._fingerprint = fingerprint
+        return self.reload()
+
+    def reload(self):
+        """ Load, validate and swap in the configuration.
+
+        :return: whether the configuration was swapped in; `False` if it was
+            rejected
+        """
+        with self._lock:
+            current = self.tokenbuilder.current
+            try:
+                config = config_module.load(str(self.path))
+                tokenbuilder = token.TokenBuilder(
+                    revocations=current.revocations, **config['jwt']
+                )
+                tokenbuilder.decode(tokenbuilder.create().encode())
+                callback_index = callbacks.CallbackIndex.from_config(config['callbacks'])
+                for policy in callback_index.values():
+                    tokenbuilder.for_policy(policy)
+                levels = _log_levels(config.get('logging', {}))
+            except Exception:
+                self.failures += 1
+                _logger.exception('Rejected configuration from %s; keeping the old one', self.path)
+                return False
+            for section in RESTART_SECTIONS:
+                if config.get(section) != self.config.get(section):
+                    _logger.warning('Changes to %s need a restart', section)
+            if current.revocations is not None:
+                current.revocations.lifetime = callbacks.max_lifetime(
+                    config['callbacks'], tokenbuilder.lifetime
+                )
+            # the builder first: tokens made in between have the new keys
+            # (see the module docstring)
+            self.tokenbuilder.swap(tokenbuilder)
+            self.callback_index.swap(callback_index)
+            for name, level in levels:
+                logging.getLogger(name).setLevel(level)
+            self.config = config
+            self.reloads += 1
+        _logger.info('Reloaded configuration from %s', self.path)
+        return True
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                _logger.exception('Could not check configuration file %s', self.path)
+
+    def start(self):
+        """ Start watching the configuration file in a daemon thread.
+        """
+        if not self.interval or self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._watch, name='config-reloader', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
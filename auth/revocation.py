@@ -0,0 +1,226 @@
+"""
+    auth.revocation
+    ~~~~~~~~~~~~~~~
+
+    Revocation of tokens before they expire.
+
+    Tokens can be revoked one at a time (by their MAC, see
+    :func:`auth.audit._mac_from_jwt`) or all at once for a subject. Revoking a
+    subject revokes the tokens issued to it *until then*; tokens issued later
+    are valid.
+
+    :class:`TokenBuilder.decode <auth.token.TokenBuilder.decode>` checks every
+    token against the :class:`RevocationList`. Nearly all tokens aren't
+    revoked, so the check is built for that case: the file is checked for new
+    revocations at most every ``refresh_interval`` seconds, an empty list
+    costs one attribute test, and otherwise a token costs two dict lookups.
+    Entries are pruned once the tokens they revoke have expired anyway.
+
+    Without a ``path`` the list only lives in the memory of one process, so
+    the service configuration requires one: revocations are appended to that
+    file and every worker picks up the new lines within ``refresh_interval``
+    seconds, and they survive restarts.
+
+    Usage:
+
+    ::
+
+        from auth import revocation
+
+        revocations = revocation.RevocationList(lifetime=3600)
+        tokenbuilder = token.TokenBuilder(..., revocations=revocations)
+        revocations.revoke_sub('user@example.com')
+        # raises revocation.TokenRevoked
+        tokenbuilder.decode(jwt)
+"""
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+import jwt.exceptions
+
+_logger = logging.getLogger(__name__)
+
+# TokenBuilder.create backdates ``iat`` by a minute
+ISSUED_AT_OFFSET = 60
+
+
+class TokenRevoked(jwt.exceptions.InvalidTokenError):
+    """ Raised when decoding a token that has been revoked.
+    """
+
+
+class RevocationList:
+    """ Revoked token MACs and subjects.
+
+    :param lifetime: lifetime of the tokens in seconds; a revoked subject is
+        forgotten after this time
+    :param path: optional file in which revocations are shared between
+        processes
+    :param refresh_interval: seconds between checks for new revocations in
+        ``path`` and for expired entries
+    """
+
+    def __init__(self, lifetime, path=None, refresh_interval=1):
+        self.lifetime = lifetime
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._macs = {}  # MAC -> expires
+        self._subs = {}  # sub -> revoked at
+        self._size = 0
+        self._next_refresh = 0
+        self._file_id = None
+        self._offset = 0
+
+    def __len__(self):
+        return self._size
+
+    def _apply(self, entry):
+        if 'mac' in entry:
+            self._macs[entry['mac']] = max(entry['expires'], self._macs.get(entry['mac'], 0))
+        else:
+            self._subs[entry['sub']] = max(entry['revoked_at'], self._subs.get(entry['sub'], 0))
+        self._size = len(self._macs) + len(self._subs)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        # a separate lock file, because _compact replaces ``path``
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _record(self, entry):
+        with self._lock:
+            if self.path is not None:
+                with self._file_lock():
+                    self._refresh_file()
+                    with open(self.path, 'a') as f:
+                        f.write(json.dumps(entry) + '\n')
+                    self._refresh_file()
+            else:
+                self._apply(entry)
+
+    def revoke_mac(self, mac, expires=None):
+        """ Revoke the token with the given MAC.
+
+        :param expires: the token's ``exp``; defaults to a full lifetime from
+            now
+        """
+        if expires is None:
+            expires = time.time() + self.lifetime
+        self._record({'mac': mac, 'expires': expires})
+        _logger.info('Revoked token %s', mac)
+
+    def revoke_token(self, encoded_token, claims):
+        """ Revoke a decoded token.
+
+        :param encoded_token: the JWT
+        :param claims: its verified claims
+        """
+        if isinstance(encoded_token, bytes):
+            encoded_token = encoded_token.decode('utf-8')
+        exp = claims.get('exp')
+        self.revoke_mac(
+            encoded_token.rpartition('.')[2],
+            exp if isinstance(exp, (int, float)) else None
+        )
+
+    def revoke_sub(self, sub):
+        """ Revoke all tokens issued to ``sub`` until now.
+        """
+        self._record({'sub': sub, 'revoked_at': time.time()})
+        _logger.info('Revoked tokens of %s', sub)
+
+    def is_revoked(self, mac, claims):
+        """ :param mac: the token's MAC
+            :param claims: the token's verified claims
+            :return: `bool`
+        """
+        now = time.time()
+        if now >= self._next_refresh:
+            self.refresh(now)
+        if not self._size:
+            return False
+        if mac in self._macs:
+            return True
+        revoked_at = self._subs.get(claims.get('sub'))
+        if revoked_at is None:
+            return False
+        iat = claims.get('iat')
+        if not isinstance(iat, (int, float)):
+            return True
+        return iat + ISSUED_AT_OFFSET <= revoked_at
+
+    def check(self, mac, claims):
+        """ :raise TokenRevoked: if the token has been revoked
+        """
+        if self.is_revoked(mac, claims):
+            raise TokenRevoked('Token has been revoked')
+
+    def refresh(self, now=None):
+        """ Read new revocations from ``path`` and prune expired entries.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._next_refresh = now + self.refresh_interval
+            if self.path is not None:
+                self._refresh_file()
+            self._prune(now)
+
+    def _refresh_file(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        file_id = (stat.st_dev, stat.st_ino)
+        if file_id != self._file_id or stat.st_size < self._offset:
+            # new or rewritten file: start over
+            self._file_id, self._offset = file_id, 0
+            self._macs, self._subs = {}, {}
+            self._size = 0
+        if stat.st_size == self._offset:
+            return
+        with open(self.path) as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith('\n'):
+                    # partially written; read it next time
+                    break
+                self._offset += len(line.encode('utf-8'))
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, KeyError, TypeError):
+                    _logger.warning('Ignoring invalid revocation: %r', line)
+
+    def _prune(self, now):
+        macs = {mac: exp for mac, exp in self._macs.items() if exp >= now}
+        subs = {sub: at for sub, at in self._subs.items() if at + self.lifetime >= now}
+        if len(macs) == len(self._macs) and len(subs) == len(self._subs):
+            return
+        self._macs, self._subs = macs, subs
+        self._size = len(macs) + len(subs)
+        if self.path is not None:
+            self._compact()
+
+    def _compact(self):
+        """ Rewrite ``path`` without the pruned entries. Other processes notice
+        the new file and reload it.
+        """
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with self._file_lock():
+            # pick up revocations appended by other processes first
+            self._refresh_file()
+            with open(tmp, 'w') as f:
+                for mac, expires in self._macs.items():
+                    f.write(json.dumps({'mac': mac, 'expires': expires}) + '\n')
+                for sub, revoked_at in self._subs.items():
+                    f.write(json.dumps({'sub': sub, 'revoked_at': revoked_at}) + '\n')
+            os.rename(tmp, self.path)
+        stat = os.stat(self.path)
+        self._file_id, self._offset = (stat.st_dev, stat.st_ino), stat.st_size
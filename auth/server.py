@@ -1,43 +1,184 @@
 """
     Authentication service
     ~~~~~~~~~~~~~~~~~~~~~~
+
+    The Flask application is created by :func:`create_app`; importing this
+    module creates ``app`` from the configuration at ``$CONFIG``.
+
+    Startup is split in two parts:
+
+    - work that is safe to do in the uwsgi master: loading the configuration,
+      configuring logging, calibrating the password hash cost, building the
+      token builder, the callback allowlist, the login page and the static
+      assets;
+    - work that must be done in every worker process: starting the audit
+      pipeline thread and creating the user store (with its database
+      connections and verification pool).
+
+    With ``UWSGI_LAZY_APPS`` every worker does both. Without it, the master
+    loads the application once, moves everything it created out of the
+    garbage collector's sight (:func:`gc.freeze`, so collections in the
+    workers don't dirty the shared copy-on-write pages) and the workers only
+    do the second part, right after they're forked.
+
+    The components themselves are built by :mod:`auth.components`, which
+    :mod:`auth.asgi` shares.
+
+    Before a worker takes traffic it runs the warmup steps listed in the
+    ``startup`` configuration section:
+
+    - ``tokens``: encode and decode tokens;
+    - ``pages``: serve the login page once;
+    - ``pool``: create the user store, which fills its connection pool.
+
+    Every worker watches the configuration file and reloads the callback
+    allowlist, the token builder and the log levels when it changes (see
+    :mod:`auth.reload`).
+
+    The time spent importing, preparing and warming up is logged and kept in
+    ``app.config['STARTUP_TIMES']`` (in milliseconds), to spot cold-start
+    regressions.
 """
+import time
+
+_import_started = time.perf_counter()
+
+import gc
 import logging.config
 import os
+import urllib.parse
 
-from dpuser import Users
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-from . import token
+from . import callbacks
+from .components import build as build_components, start_worker as start_components
 from .config import load as config_load
-from .blueprints import idpblueprint
+from .blueprints import (
+    accesstokenblueprint, assetsblueprint, idpblueprint, jwksblueprint
+)
 
-# ====== 1. LOAD CONFIGURATION SETTINGS AND INITIALIZE LOGGING
+# Time spent importing this module and its dependencies
+_IMPORT_TIME = (time.perf_counter() - _import_started) * 1000
 
-config = config_load(configpath=os.getenv('CONFIG'))
-logging.config.dictConfig(config['logging'])
 _logger = logging.getLogger(__name__)
 
-# ====== 2. CREATE AUTHZ FLOW
-dsn = 'postgresql://{user}:{password}@{host}:{port}/{dbname}'.format(
-    **config['postgres']
-)
-users = Users(dsn)
-tokenbuilder = token.TokenBuilder(**config['jwt'])
+WARMUP_STEPS = ('tokens', 'pages', 'pool')
+
+def _preloading():
+    """ Whether the application is being loaded in the uwsgi master, to be
+    shared by the workers it forks.
+    """
+    try:
+        import uwsgi
+    except ImportError:
+        return False
+    return uwsgi.worker_id() == 0
+
+
+def _warmup(app, components, steps):
+    if 'tokens' in steps:
+        tokenbuilder = components.tokenbuilder
+        for encoded in tokenbuilder.encode_many(tokenbuilder.create() for _ in range(10)):
+            tokenbuilder.decode(encoded)
+    if 'pages' in steps and components.config.get('callbacks'):
+        callback = callbacks.Policy.from_config(components.config['callbacks'][0]).prefix
+        query = urllib.parse.urlencode({'callback': callback})
+        url = '{}/idp/login?{}'.format(components.config['app']['root'], query)
+        status = app.test_client().get(url).status_code
+        if status != 200:
+            _logger.warning('Warmup request for the login page returned %s', status)
+    if 'pool' in steps:
+        components.users.get()
+
+
+def create_app(configpath=None):
+    """ Create the WSGI application.
+
+    :param configpath: path to the configuration file (optional, see
+        :func:`auth.config.load`)
+    :return: :class:`flask.Flask`; the application's components are in
+        ``app.extensions['authserver']`` (a
+        :class:`auth.components.Components`)
+    """
+    started = time.perf_counter()
+    times = {'import': _IMPORT_TIME}
+
+    # ====== 1. LOAD CONFIGURATION SETTINGS AND INITIALIZE LOGGING
+
+    config = config_load(configpath=configpath)
+    logging.config.dictConfig(config['logging'])
+
+    # ====== 2. CREATE AUTHZ FLOW AND RUN CONFIGURATION CHECKS
+
+    components = build_components(config, configpath)
+
+    # ====== 3. CREATE FLASK WSGI APP AND BLUEPRINTS
+
+    app = Flask('authserver', static_folder=None)
+    if config['app'].get('proxy_hops'):
+        # take the client address (for the throttle) from X-Forwarded-For
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config['app']['proxy_hops'])
+    idp_bp = idpblueprint(
+        components.tokenbuilder, components.callback_index, components.users,
+        components.throttle, components.revocation_key, components.assets,
+        components.metrics, components.sessions, components.introspection_key,
+        components.metrics_key
+    )
+    # SimpleIdP
+    app.register_blueprint(idp_bp, url_prefix="{}/idp".format(config['app']['root']))
+    # Static assets
+    app.register_blueprint(assetsblueprint(components.assets), url_prefix="{}/idp".format(config['app']['root']))
+    # Public keys for token verification
+    app.register_blueprint(
+        jwksblueprint(components.tokenbuilder), url_prefix=config['app']['root']
+    )
+    # Refresh token to access token exchange
+    if components.accesstokenbuilder is not None:
+        app.register_blueprint(
+            accesstokenblueprint(components.tokenbuilder, components.accesstokenbuilder),
+            url_prefix=config['app']['root']
+        )
+
+    app.extensions['authserver'] = components
+    app.config['STARTUP_TIMES'] = times
+    steps = config.get('startup', {}).get('warmup', WARMUP_STEPS)
+
+    # ====== 4. WARM UP
+
+    # everything up to here can be shared by the workers
+    _warmup(app, components, [step for step in steps if step != 'pool'])
+    times['prepare'] = (time.perf_counter() - started) * 1000
 
-# ====== 3. RUN CONFIGURATION CHECKS
+    def start_worker():
+        worker_started = time.perf_counter()
+        start_components(components)
+        _warmup(app, components, [step for step in steps if step == 'pool'])
+        times['worker'] = (time.perf_counter() - worker_started) * 1000
+        _logger.info(
+            'Started in %.1f ms (import %.1f ms, prepare %.1f ms, worker %.1f ms)',
+            sum(times.values()), times['import'], times['prepare'], times['worker']
+        )
 
-# Check whether we can generate refreshtokens
-try:
-    tokenbuilder.decode(tokenbuilder.create().encode())
-except:
-    _logger.critical('Cannot startup: invalid config')
-    raise
+    if _preloading():
+        import uwsgidecorators
+        uwsgidecorators.postfork(start_worker)
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+    else:
+        start_worker()
+    return app
 
-# ====== 4. CREATE FLASK WSGI APP AND BLUEPRINTS
 
-app = Flask('authserver', static_url_path="{}/idp/static".format(config['app']['root']))
-idp_bp = idpblueprint(tokenbuilder, config['callbacks'], users)
+app = create_app(os.getenv('CONFIG'))
 
-# SimpleIdP
-app.register_blueprint(idp_bp, url_prefix="{}/idp".format(config['app']['root']))
+# The components of ``app``, for the tests and the interactive interpreter
+_components = app.extensions['authserver']
+config = _components.config
+tokenbuilder = _components.tokenbuilder
+accesstokenbuilder = _components.accesstokenbuilder
+users = _components.users
+limiter = _components.throttle
+asset_store = _components.assets
+reloader = _components.reloader
@@ -0,0 +1,195 @@
+"""
+    auth.session
+    ~~~~~~~~~~~~
+
+    Single sign-on sessions for the login routes.
+
+    A successful password login creates a session and sets a cookie with its
+    id. When the browser comes back to the login form (for any allowed
+    callback) within ``ttl`` seconds, it's redirected to the callback with a
+    new token right away: no form, no password verification.
+
+    The cookie value is ``<session id>.<expires>.<signature>``, where the
+    signature is an HMAC of the id and the expiry time. Forged or expired
+    cookies are rejected without a lookup. The session itself (subject and
+    creation time) lives in a backend, which expires it after ``ttl``
+    seconds. :class:`MemoryBackend` keeps sessions in the worker process;
+    :class:`UwsgiCacheBackend` keeps them in a uwsgi cache so all workers on
+    a host share them.
+
+    Revoking a subject (see :meth:`SessionStore.revoke_sub`) ends its
+    sessions that were created before.
+
+    Usage:
+
+    ::
+
+        from auth import session
+
+        sessions = session.SessionStore(**config['session'])
+        cookie = sessions.create('user@example.com')
+        sessions.get(cookie)  # 'user@example.com'
+"""
+import base64
+import collections
+import hashlib
+import hmac
+import secrets
+import struct
+import threading
+import time
+
+BACKENDS = ('memory', 'uwsgi')
+
+COOKIE_NAME = 'authsession'
+
+_SESSION = struct.Struct('!d')  # created, followed by the subject
+_REVOKED = struct.Struct('!d')  # revoked at
+
+
+class MemoryBackend:
+    """ Keeps sessions in a dictionary in this process. Expired entries are
+    evicted first, then the least recently created ones if there are more
+    than ``max_keys``.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._entries = collections.OrderedDict()  # key -> (value, expires)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, now + ttl)
+            # all entries of a store have about the same ttl, so the oldest
+            # ones expire first
+            while self._entries:
+                oldest = next(iter(self._entries.values()))
+                if oldest[1] > now and len(self._entries) <= self.max_keys:
+                    break
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class UwsgiCacheBackend:
+    """ Keeps sessions in a uwsgi cache, shared by all workers of a uwsgi
+    instance. The cache must be configured, e.g. with
+    ``UWSGI_CACHE2: name=sessions,items=100000``.
+    """
+
+    def __init__(self, cache='sessions'):
+        import uwsgi
+        self._uwsgi = uwsgi
+        self.cache = cache
+
+    def get(self, key):
+        return self._uwsgi.cache_get(key, self.cache)
+
+    def set(self, key, value, ttl):
+        self._uwsgi.cache_update(key, value, int(ttl) + 1, self.cache)
+
+    def delete(self, key):
+        self._uwsgi.cache_del(key, self.cache)
+
+
+class SessionStore:
+    """ Creates and checks session cookies.
+
+    :param secret: key for the cookie signatures
+    :param ttl: lifetime of a session in seconds
+    :param backend: one of ``memory`` or ``uwsgi``, or a backend instance
+    :param cookie_name: name of the session cookie
+    :param secure: whether the cookie is only sent over HTTPS
+    """
+
+    def __init__(self, secret, ttl=3600, backend='memory', cookie_name=COOKIE_NAME,
+                 secure=True):
+        if backend == 'memory':
+            backend = MemoryBackend()
+        elif backend == 'uwsgi':
+            backend = UwsgiCacheBackend()
+        elif isinstance(backend, str):
+            raise ValueError('Unknown session backend: {}'.format(backend))
+        self.backend = backend
+        self.ttl = ttl
+        self.cookie_name = cookie_name
+        self.secure = secure
+        # don't use the configured secret itself, which may be shared with
+        # other purposes
+        self._key = hmac.new(
+            secret.encode('utf-8'), b'auth.session cookie', hashlib.sha256
+        ).digest()
+
+    def _sign(self, payload):
+        digest = hmac.new(self._key, payload.encode('ascii'), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:16]).rstrip(b'=').decode('ascii')
+
+    def _session_id(self, cookie):
+        """ :return: the session id of a well-formed, correctly signed and
+            unexpired cookie, or `None`
+        """
+        if not cookie or cookie.count('.') != 2:
+            return None
+        session_id, expires, signature = cookie.split('.')
+        payload = '{}.{}'.format(session_id, expires)
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        if not expires.isdigit() or int(expires) <= time.time():
+            return None
+        return session_id
+
+    def create(self, sub):
+        """ Start a session for a subject.
+
+        :return: the cookie value
+        """
+        now = time.time()
+        session_id = secrets.token_urlsafe(16)
+        self.backend.set(
+            'session:' + session_id, _SESSION.pack(now) + sub.encode('utf-8'), self.ttl
+        )
+        payload = '{}.{}'.format(session_id, int(now + self.ttl))
+        return '{}.{}'.format(payload, self._sign(payload))
+
+    def get(self, cookie):
+        """ :return: the subject of the session, or `None` if the cookie or
+            the session isn't valid
+        """
+        session_id = self._session_id(cookie)
+        if session_id is None:
+            return None
+        value = self.backend.get('session:' + session_id)
+        if not value:
+            return None
+        created, = _SESSION.unpack_from(value)
+        sub = value[_SESSION.size:].decode('utf-8')
+        revoked = self.backend.get('revoked:' + sub)
+        if revoked and _REVOKED.unpack(revoked)[0] >= created:
+            return None
+        return sub
+
+    def delete(self, cookie):
+        """ End the session of a cookie.
+        """
+        session_id = self._session_id(cookie)
+        if session_id is not None:
+            self.backend.delete('session:' + session_id)
+
+    def revoke_sub(self, sub):
+        """ End all sessions of a subject created so far.
+        """
+        self.backend.set('revoked:' + sub, _REVOKED.pack(time.time()), self.ttl)
@@ -0,0 +1,137 @@
+"""
+    auth.singleflight
+    ~~~~~~~~~~~~~~~~~
+
+    Coalesces concurrent identical password verifications.
+
+    When a client double-submits the login form, or a script retries without
+    waiting, the same credentials are verified several times at once. The
+    :class:`CoalescingVerifier` lets such requests share a single verification
+    that is in flight: the first request verifies, the others wait for its
+    result. Results are only shared while the verification runs; nothing is
+    cached afterwards.
+
+    Requests are matched on a keyed hash of the email address and password, so
+    the in-flight table never holds passwords and can't be probed without the
+    (per-process, random) key.
+
+    Usage:
+
+    ::
+
+        from auth import singleflight
+
+        users = singleflight.CoalescingVerifier(verification_executor)
+        users.verify_password(email, password)
+        users.stats()  # {'calls': ..., 'coalesced': ..., 'in_flight': ...}
+"""
+import concurrent.futures
+import hashlib
+import hmac
+import os
+import threading
+
+from . import executor
+
+
+class CoalescingVerifier:
+    """ Wraps a user store (or a :class:`auth.executor.VerificationExecutor`)
+    and exposes the same verification methods.
+
+    :param users: something with a ``verify_password(email, password)`` method
+        and optionally a ``submit(email, password)`` method that returns a
+        `concurrent.futures.Future`
+    """
+
+    def __init__(self, users):
+        self._users = users
+        self._secret = os.urandom(32)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._calls = 0
+        self._coalesced = 0
+        self.timeout = getattr(users, 'timeout', None)
+        if hasattr(users, 'submit'):
+            self.submit = self._submit
+
+    def _key(self, email, password):
+        # length-prefixed, so different (email, password) pairs never collide
+        message = '{}:{}:{}'.format(len(email), email.lower(), password)
+        return hmac.new(self._secret, message.encode('utf-8'), hashlib.sha256).digest()
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def _join_or_lead(self, key, lead):
+        """ Return the in-flight future for ``key``, or register a new one
+        created by ``lead()``.
+
+        :return: ``(future, is_leader)``
+        """
+        with self._lock:
+            self._calls += 1
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._coalesced += 1
+                return future, False
+            future = self._in_flight[key] = lead()
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return future, True
+
+    def _submit(self, email, password):
+        """ Schedule a verification on the wrapped executor, or join an
+        identical one that is in flight.
+
+        :return: `concurrent.futures.Future` that resolves to a `bool`
+        """
+        future, _ = self._join_or_lead(
+            self._key(email, password),
+            lambda: self._users.submit(email, password)
+        )
+        return future
+
+    def verify_password(self, email, password):
+        """ Verify the given credentials, or wait for an identical verification
+        that is in flight.
+
+        :return: `bool`
+        """
+        if hasattr(self, 'submit'):
+            try:
+                return self.submit(email, password).result(timeout=self.timeout)
+            except concurrent.futures.TimeoutError:
+                raise executor.VerificationUnavailable()
+        future, is_leader = self._join_or_lead(
+            self._key(email, password), concurrent.futures.Future
+        )
+        if not is_leader:
+            try:
+                return future.result(timeout=self.timeout)
+            except concurrent.futures.TimeoutError:
+                raise executor.VerificationUnavailable()
+        try:
+            result = self._users.verify_password(email, password)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    def shutdown(self, wait=True):
+        shutdown = getattr(self._users, 'shutdown', None)
+        if shutdown is not None:
+            shutdown(wait=wait)
+
+    def stats(self):
+        """ :return: `dict` with the number of verifications requested
+            (``calls``), how many of those joined one in flight
+            (``coalesced``) and the number in flight now (``in_flight``)
+        """
+        with self._lock:
+            return {
+                'calls': self._calls,
+                'coalesced': self._coalesced,
+                'in_flight': len(self._in_flight),
+            }
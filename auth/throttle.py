@@ -0,0 +1,187 @@
+"""
+    auth.throttle
+    ~~~~~~~~~~~~~
+
+    Brute-force protection for password logins.
+
+    Every password login reserves a token from two token buckets, one for
+    the email address and one for the client address, *before* the password
+    is verified. A successful login gives its tokens back, so only failed
+    logins count. When either bucket is empty the login is rejected with a
+    429, so a credential-stuffing run costs a dictionary lookup per attempt
+    instead of a password hash. Because the token is taken up front,
+    concurrent attempts can't all slip past the check before the first
+    failure is recorded.
+
+    Behind a proxy the client address is only meaningful if the application
+    takes it from ``X-Forwarded-For`` (see ``proxy_hops`` in the ``app``
+    configuration section); otherwise all clients share the proxy's bucket.
+
+    Buckets live in a backend. :class:`MemoryBackend` keeps them in the
+    worker process; :class:`UwsgiCacheBackend` keeps them in a uwsgi cache so
+    all workers on a host share them.
+
+    Usage:
+
+    ::
+
+        from auth import throttle
+
+        limiter = throttle.Throttle(**config['throttle'])
+        # takes a token, or raises a 429 if either bucket is empty
+        limiter.check(email, request.remote_addr)
+        if users.verify_password(email, password):
+            limiter.record_success(email, request.remote_addr)
+"""
+import collections
+import logging
+import struct
+import threading
+import time
+
+import werkzeug.exceptions
+
+_logger = logging.getLogger(__name__)
+
+BACKENDS = ('memory', 'uwsgi')
+
+
+class Throttled(werkzeug.exceptions.TooManyRequests):
+    """ Raised when a login attempt exceeds one of the limits.
+    """
+    description = 'Too many login attempts, please try again later.'
+
+    def __init__(self, retry_after, description=None):
+        super().__init__(description)
+        self.retry_after = retry_after
+
+    def get_headers(self, *args, **kwargs):
+        headers = super().get_headers(*args, **kwargs)
+        headers.append(('Retry-After', str(int(self.retry_after) + 1)))
+        return headers
+
+
+def _take(bucket, rate, burst, now, cost=1):
+    """ Take a token from a bucket.
+
+    :param bucket: ``(tokens, updated)`` or `None` for a full bucket
+    :param rate: tokens added per minute
+    :param burst: bucket capacity
+    :param cost: tokens to take if one is available; 0 only checks, a
+        negative cost gives tokens back
+    :return: ``(new_bucket, retry_after)``, where ``retry_after`` is `None` if
+        a token was available and the number of seconds until one is
+        available otherwise
+    """
+    if bucket is None:
+        tokens = burst
+    else:
+        tokens, updated = bucket
+        tokens = min(burst, tokens + (now - updated) * rate / 60)
+    if cost < 0:
+        return (min(burst, tokens - cost), now), None
+    if tokens >= 1:
+        return (tokens - cost, now), None
+    return (tokens, now), (1 - tokens) * 60 / rate
+
+
+class MemoryBackend:
+    """ Keeps buckets in a dictionary in this process. At most ``max_keys``
+    buckets are kept; the least recently used ones are forgotten first.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now, cost=1):
+        with self._lock:
+            bucket, retry_after = _take(self._buckets.pop(key, None), rate, burst, now, cost)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+class UwsgiCacheBackend:
+    """ Keeps buckets in a uwsgi cache, shared by all workers of a uwsgi
+    instance. The cache must be configured, e.g. with
+    ``UWSGI_CACHE2: name=throttle,items=100000``.
+    """
+
+    _format = struct.Struct('!dd')
+
+    def __init__(self, cache='throttle', expires=3600):
+        import uwsgi
+        self._uwsgi = uwsgi
+        self.cache = cache
+        self.expires = expires
+
+    def take(self, key, rate, burst, now, cost=1):
+        uwsgi = self._uwsgi
+        uwsgi.lock()
+        try:
+            value = uwsgi.cache_get(key, self.cache)
+            bucket = self._format.unpack(value) if value else None
+            bucket, retry_after = _take(bucket, rate, burst, now, cost)
+            uwsgi.cache_update(key, self._format.pack(*bucket), self.expires, self.cache)
+        finally:
+            uwsgi.unlock()
+        return retry_after
+
+
+class Throttle:
+    """ Limits password logins per email address and per client address.
+
+    :param backend: one of ``memory`` or ``uwsgi``, or a backend instance
+    :param email: ``{'rate': ..., 'burst': ...}`` limit per email address,
+        where ``rate`` is in attempts per minute
+    :param address: same, per client address
+    """
+
+    def __init__(self, backend='memory', email=None, address=None):
+        if backend == 'memory':
+            backend = MemoryBackend()
+        elif backend == 'uwsgi':
+            backend = UwsgiCacheBackend()
+        elif isinstance(backend, str):
+            raise ValueError('Unknown throttle backend: {}'.format(backend))
+        self.backend = backend
+        self.limits = []
+        if address:
+            self.limits.append(('address:', address['rate'], address['burst']))
+        if email:
+            self.limits.append(('email:', email['rate'], email['burst']))
+
+    def _keys(self, email, address):
+        keys = {'address:': address or '', 'email:': email.lower()}
+        for prefix, rate, burst in self.limits:
+            yield prefix + keys[prefix], rate, burst
+
+    def check(self, email, address):
+        """ Take a token from the buckets for the given email and client
+        address, before the password is verified. Give it back with
+        :meth:`record_success` if the login succeeds.
+
+        :raise Throttled: if one of the limits is exceeded; no tokens are
+            taken then
+        """
+        now = time.time()
+        taken = []
+        for key, rate, burst in self._keys(email, address):
+            retry_after = self.backend.take(key, rate, burst, now)
+            if retry_after is not None:
+                for key, rate, burst in taken:
+                    self.backend.take(key, rate, burst, now, cost=-1)
+                _logger.warning('Throttled login attempt for %s', key)
+                raise Throttled(retry_after)
+            taken.append((key, rate, burst))
+
+    def record_success(self, email, address):
+        """ Give back the tokens :meth:`check` took, after a successful
+        password verification.
+        """
+        now = time.time()
+        for key, rate, burst in self._keys(email, address):
+            self.backend.take(key, rate, burst, now, cost=-1)
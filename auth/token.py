@@ -28,16 +28,183 @@
         decoded['someprop'] = 'something else altogether'
         # and create a JWT again
         decoded.encode()
+
+        # encode many tokens at once
+        jwts = tokens.encode_many(tokens.create(sub=sub) for sub in subjects)
 """
+import base64
+import calendar
 import collections
-import functools
+import datetime
+import hashlib
+import heapq
+import hmac
+import json
+import threading
 import time
 import types
 import jwt
 
+from . import keys
+
+_HMAC_DIGESTS = {
+    'HS256': hashlib.sha256,
+    'HS384': hashlib.sha384,
+    'HS512': hashlib.sha512,
+}
+
+_json_dumps = json.JSONEncoder(separators=(',', ':')).encode
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+class _PyJWT(jwt.PyJWT):
+    """ PyJWT with all algorithms of :func:`auth.keys.algorithms`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        for name, algorithm in keys.algorithms().items():
+            if name not in self._algorithms:
+                self.register_algorithm(name, algorithm)
+
+
+_pyjwt = _PyJWT()
+
+
+class _JWSEncoder:
+    """ Precompiled JWS encoder.
+
+    The JOSE header is the same for every token, so its base64url segment is
+    computed once; so is the prepared signing key. Output is byte-for-byte
+    what `jwt.encode <jwt>` produces for the same claims and headers.
+
+    :param algorithm: JWS algorithm name
+    :param key: signing key (a secret or a parsed private key)
+    :param headers: additional JOSE headers, e.g. ``{'kid': ...}``
+    """
+
+    def __init__(self, algorithm, key, headers=None):
+        header = {'typ': 'JWT', 'alg': algorithm}
+        header.update(headers or {})
+        self._header = _b64encode(_json_dumps(header).encode('utf-8')) + b'.'
+        self._prepare(algorithm, key)
+
+    def _prepare(self, algorithm, key):
+        self._alg = keys.algorithms()[algorithm]
+        self._key = self._alg.prepare_key(key)
+
+    def _sign(self, signing_input):
+        return self._alg.sign(signing_input, self._key)
+
+    def __call__(self, payload):
+        for claim in ('exp', 'iat', 'nbf'):
+            # like jwt.encode, convert datetimes in the registered time claims
+            if isinstance(payload.get(claim), datetime.datetime):
+                payload = dict(payload)
+                payload[claim] = calendar.timegm(payload[claim].utctimetuple())
+        signing_input = self._header + _b64encode(_json_dumps(payload).encode('utf-8'))
+        return signing_input + b'.' + _b64encode(self._sign(signing_input))
+
+
+class _HMACEncoder(_JWSEncoder):
+    """ Precompiled JWS encoder for the HMAC algorithms; the HMAC key schedule
+    is computed once and copied for every signature.
+    """
+
+    def _prepare(self, algorithm, secret):
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        self._mac = hmac.new(secret, digestmod=_HMAC_DIGESTS[algorithm])
+
+    def _sign(self, signing_input):
+        mac = self._mac.copy()
+        mac.update(signing_input)
+        return mac.digest()
+
+
+class VerifiedTokenCache:
+    """ LRU cache of verified token claims, keyed by the token's message
+    authentication code (the segment :func:`auth.audit._mac_from_jwt`
+    extracts).
+
+    A hit requires the whole token to be equal to the cached one, so a
+    forged header or payload with a known MAC never matches. Entries are
+    evicted when their ``exp`` has passed, or when the cache is full (least
+    recently used first).
+
+    :param maxsize: maximum number of cached tokens
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._expiry = []  # heap of (exp, mac)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _split(encoded_token):
+        if isinstance(encoded_token, bytes):
+            encoded_token = encoded_token.decode('utf-8', 'replace')
+        return encoded_token, encoded_token.rpartition('.')[2]
+
+    def get(self, encoded_token):
+        """ :return: the cached claims, or `None` if the token isn't cached or
+            has expired
+        """
+        encoded_token, mac = self._split(encoded_token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(mac)
+            if entry is None or entry[0] != encoded_token:
+                self.misses += 1
+                return None
+            if entry[2] is not None and entry[2] < now:
+                del self._entries[mac]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(mac)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, encoded_token, claims):
+        """ Cache the claims of a verified token.
+        """
+        encoded_token, mac = self._split(encoded_token)
+        exp = claims.get('exp')
+        if not isinstance(exp, (int, float)):
+            exp = None
+        now = time.time()
+        with self._lock:
+            self._entries[mac] = (encoded_token, claims, exp)
+            self._entries.move_to_end(mac)
+            if exp is not None:
+                heapq.heappush(self._expiry, (exp, mac))
+            # evict expired tokens, then the least recently used ones
+            while self._expiry and self._expiry[0][0] < now:
+                exp, mac = heapq.heappop(self._expiry)
+                entry = self._entries.get(mac)
+                if entry is not None and entry[2] == exp:
+                    del self._entries[mac]
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            if len(self._expiry) > 2 * self.maxsize:
+                self._expiry = [
+                    (e[2], m) for m, e in self._entries.items() if e[2] is not None
+                ]
+                heapq.heapify(self._expiry)
+
+
 # Use a namedtuple to emphasize the immutability of the config
 _TokenBuilder = collections.namedtuple(
-    '_TokenBuilder', ('secret', 'lifetime', 'algorithm')
+    '_TokenBuilder', ('secret', 'lifetime', 'algorithm', 'keys')
 )
 
 
@@ -47,32 +214,103 @@ class TokenBuilder(_TokenBuilder):
     NOTE: needs Python >= 3.4
 
     The key-value datastucture in the tokens is a dictionary that provides an
-    additional method ``encode()``. Under water, ``encode()`` will call
-    `jwt.encode <jwt>` with all but the ``data`` argument passed in. It does
-    so by using the convenient fact that `jwt.encode <jwt>` takes a `dict` as
-    its first argument; it can use `functools.partialmethod` to create a
-    partial and then bind that method to a dynamically created `dict`
-    subclass. The result is a `dict` with an ``encode()`` method that, when
-    called, will return a JWT based on ``self``.
+    additional method ``encode()``. Under water, ``encode()`` calls this
+    builder's encoder with the dict as its payload. The encoder is created
+    once per builder: for the HMAC algorithms it's a precompiled
+    `_HMACEncoder`, for anything else it falls back to `jwt.encode <jwt>`.
+    The encode method is bound to a dynamically created `dict` subclass. The
+    result is a `dict` with an ``encode()`` method that, when called, will
+    return a JWT based on ``self``.
+
+    Instead of a single ``secret``, a builder can be given a list of ``keys``
+    (see :mod:`auth.keys`) to sign with asymmetric algorithms and to rotate
+    keys. Tokens then carry a ``kid`` header that selects the verification
+    key.
+
+    A builder can be given a :class:`auth.revocation.RevocationList`, which
+    :meth:`decode` consults for every token.
+
+    :meth:`for_policy` derives builders for the token policies of callbacks
+    (see :class:`auth.callbacks.Policy`).
 
     """
 
+    def __new__(cls, secret=None, lifetime=None, algorithm='HS256', keys=None,
+                revocations=None, claims=None, kid=None):
+        self = super().__new__(cls, secret, lifetime, algorithm, keys)
+        self.revocations = revocations
+        self.claims = dict(claims or {})
+        self.kid = kid
+        self._derived = {}  # id(policy) -> (policy, builder)
+        return self
+
+    @property
+    def _keys(self):
+        """Parsed keys as a `dict` of key id to :class:`auth.keys.Key`, in
+        configuration order.
+        """
+        try:
+            return self._ks
+        except AttributeError:
+            pass
+        self._ks = collections.OrderedDict(
+            (key.kid, key) for key in keys.load(self.keys or (), self.algorithm)
+        )
+        return self._ks
+
+    @property
+    def _encoder(self):
+        """Callable that turns a claims mapping into a JWT (`bytes`).
+        """
+        try:
+            return self._enc
+        except AttributeError:
+            pass
+        signing = [k for k in self._keys.values() if k.signing_key is not None]
+        if self.kid is not None:
+            signing = [k for k in signing if k.kid == str(self.kid)]
+            if not signing:
+                raise ValueError('Key {} can not sign tokens'.format(self.kid))
+        if signing:
+            key = signing[0]
+            encoder = _HMACEncoder if key.algorithm in _HMAC_DIGESTS else _JWSEncoder
+            self._enc = encoder(key.algorithm, key.signing_key, {'kid': key.kid})
+        elif self.keys:
+            raise ValueError('None of the keys can sign tokens')
+        elif self.algorithm in _HMAC_DIGESTS:
+            self._enc = _HMACEncoder(self.algorithm, self.secret)
+        else:
+            secret, algorithm = self.secret, self.algorithm
+            self._enc = lambda payload: jwt.encode(payload, secret, algorithm=algorithm)
+        return self._enc
+
+    @property
+    def _cache(self):
+        """:class:`VerifiedTokenCache` used by :meth:`decode`.
+        """
+        try:
+            return self._vc
+        except AttributeError:
+            pass
+        self._vc = VerifiedTokenCache()
+        return self._vc
+
     @property
     def _tokendata(self):
         """TokenData type as a property.
 
         This is a dynamically created class that wraps this
-        namedtuple's instance data and the `jwt.encode <jwt>` function
+        namedtuple's instance data and its encoder
 
         """
         try:
             return self._td
         except AttributeError:
             pass
-        # wrap the secret and algortihm in a partial
-        encode = functools.partialmethod(
-            jwt.encode, self.secret, algorithm=self.algorithm
-        )
+        builder = self
+
+        def encode(data):
+            return builder._encoder(data)
         # create the namespace structure
         td_ns = {'encode': encode}
         # create a class TokenData that bases dict & includes the encode method
@@ -87,6 +325,12 @@ class TokenBuilder(_TokenBuilder):
         The resulting dict will be an instance of the dynamically created dict
         subclass that contains the ``encode()`` method.
 
+        Verified claims are cached until the token expires, so decoding the
+        same token again skips signature verification and JSON parsing. The
+        result is a (shallow) copy of the cached claims.
+
+        :raise auth.revocation.TokenRevoked: if the token has been revoked
+
         Usage::
 
             data = accesstokens.decode(accesstoken_jwt)
@@ -95,16 +339,81 @@ class TokenBuilder(_TokenBuilder):
             new_jwt = accesstokens.encode()
 
         """
-        data = jwt.decode(encoded_token, key=self.secret)
+        data = self._cache.get(encoded_token)
+        if data is None:
+            key, algorithm = self._verification_key(encoded_token)
+            # the issuer isn't the audience of its tokens; an ``aud`` claim
+            # (see for_policy) is for the relying party to check
+            data = _pyjwt.decode(
+                encoded_token, key=key, algorithms=[algorithm], options={'verify_aud': False}
+            )
+            self._cache.put(encoded_token, data)
+        if self.revocations is not None:
+            self.revocations.check(VerifiedTokenCache._split(encoded_token)[1], data)
         return self._tokendata(data)
 
+    def _verification_key(self, encoded_token):
+        """ Select the key that verifies the given token, by its ``kid``
+        header. Tokens without a ``kid`` are verified with ``secret``.
+
+        :raise jwt.exceptions.InvalidTokenError: if there is no such key
+        :return: ``(key, algorithm)``
+        """
+        if self.keys:
+            kid = _pyjwt.get_unverified_header(encoded_token).get('kid')
+            key = self._keys.get(str(kid)) if kid is not None else None
+            if key is not None:
+                return key.verification_key, key.algorithm
+            if kid is not None or self.secret is None:
+                raise jwt.exceptions.InvalidTokenError('Unknown key: {}'.format(kid))
+        return self.secret, self.algorithm
+
+    def jwks(self):
+        """ JSON Web Key Set with the public keys of this builder.
+        """
+        return keys.jwks(self._keys.values())
+
     def create(self, **kwargs):
         """ Create a new token.
         """
         now = int(time.time())
-        data = self._tokendata({
-            'iat': now - 60,  # start a minute early
-            'exp': now + self.lifetime,
-        })
+        data = self._tokendata(self.claims)
+        data['iat'] = now - 60  # start a minute early
+        data['exp'] = now + self.lifetime
         data.update(kwargs)
         return data
+
+    def for_policy(self, policy):
+        """ The builder for the tokens of a callback policy, which differs
+        from this one in its lifetime, extra claims or signing key. Derived
+        builders are created once per policy and share this builder's keys,
+        verified token cache and revocation list.
+
+        :param policy: :class:`auth.callbacks.Policy` or `None`
+        :raise ValueError: if the policy's key can't sign tokens
+        """
+        if policy is None or getattr(policy, 'is_default', True):
+            return self
+        try:
+            return self._derived[id(policy)][1]
+        except KeyError:
+            pass
+        builder = TokenBuilder(
+            self.secret, policy.lifetime or self.lifetime, self.algorithm, self.keys,
+            revocations=self.revocations, claims=dict(self.claims, **(policy.claims or {})),
+            kid=policy.kid if policy.kid is not None else self.kid
+        )
+        if self.keys:
+            builder._ks = self._keys
+        builder._vc = self._cache
+        builder._encoder  # fail early on an unusable key
+        # the policy is kept so its id isn't reused while it's cached
+        self._derived[id(policy)] = (policy, builder)
+        return builder
+
+    def encode_many(self, tokens):
+        """ Encode an iterable of token data (e.g. as returned by
+        :meth:`create`) into a list of JWTs.
+        """
+        encoder = self._encoder
+        return [encoder(data) for data in tokens]
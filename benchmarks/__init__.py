@@ -0,0 +1,12 @@
+"""
+    benchmarks
+    ~~~~~~~~~~
+
+    Performance benchmarks for the authentication service. These are not part
+    of the test suite; run them explicitly, e.g. ``python -m benchmarks.callbacks``.
+
+    ``python -m benchmarks.suite`` runs the cases of all modules, writes the
+    results as JSON and fails on regressions against a saved baseline (see
+    :mod:`benchmarks.suite`). ``python -m benchmarks.load`` load tests the
+    whole application without a database (see :mod:`benchmarks.load`).
+"""
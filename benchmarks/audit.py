@@ -0,0 +1,77 @@
+"""
+    benchmarks.audit
+    ~~~~~~~~~~~~~~~~
+
+    Measures the cost of :func:`auth.audit.log_token` on the request thread,
+    with the audit records formatted there (the default) and with the
+    background pipeline started.
+
+    Usage:
+
+    ::
+
+        $ python -m benchmarks.audit
+"""
+import logging
+import timeit
+
+from auth import audit, token
+
+NUMBER = 20000
+
+
+class _FormattingHandler(logging.Handler):
+    """ Formats records and throws them away.
+    """
+
+    def emit(self, record):
+        self.format(record)
+
+
+def _token():
+    return token.TokenBuilder('secret', 300).create(sub='user@example.com').encode()
+
+
+def bench(number=NUMBER):
+    """ :return: `dict` with the mean time per call in seconds
+    """
+    return {
+        name: timeit.timeit(case, number=number) / number
+        for name, case in cases().items()
+    }
+
+
+def cases():
+    """ :return: `dict` of case name to a callable that runs one operation
+
+    The audit logger's handlers are replaced by one that only formats.
+    """
+    logger = audit._jwtlogger
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(_FormattingHandler())
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    encoded = _token()
+
+    def pipeline():
+        if audit.pipeline_stats() is None:
+            audit.start_pipeline(queue_size=100000, overflow='drop')
+        audit.log_token(encoded, 'user@example.com')
+
+    def sync():
+        if audit.pipeline_stats() is not None:
+            audit.stop_pipeline()
+        audit.log_token(encoded, 'user@example.com')
+
+    return {'audit.log_token': sync, 'audit.log_token_pipeline': pipeline}
+
+
+def main():
+    for name, seconds in bench().items():
+        print('{:>28} {:>10.2f} us'.format(name, seconds * 1e6))
+    audit.stop_pipeline()
+
+
+if __name__ == '__main__':
+    main()
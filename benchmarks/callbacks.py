@@ -0,0 +1,107 @@
+"""
+    benchmarks.callbacks
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Compares the compiled :class:`auth.callbacks.CallbackIndex` with a linear
+    ``str.startswith`` scan over the allowlist.
+
+    :func:`cases` times validating an allowed and a denied callback with
+    :func:`auth.blueprints.simpleidp.validate_callback_url`, which the login
+    routes call, per allowlist size, for :mod:`benchmarks.suite`.
+
+    Usage:
+
+    ::
+
+        $ python -m benchmarks.callbacks
+"""
+import random
+import timeit
+
+import werkzeug.exceptions
+
+from auth import callbacks
+from auth.blueprints import simpleidp
+
+SIZES = (10, 1000, 10000)
+NUMBER = 2000
+
+
+def make_allowlist(size):
+    return [
+        'https://rp{}.api.data.amsterdam.nl/oauth2/callback'.format(i)
+        for i in range(size)
+    ]
+
+
+def make_requests(allowlist, count=100):
+    """ Half of the requested callbacks are allowed, half are not.
+    """
+    rnd = random.Random(42)
+    allowed = [rnd.choice(allowlist) + '?next=/home' for _ in range(count // 2)]
+    denied = [
+        'https://rp{}.evil.example.com/oauth2/callback'.format(i)
+        for i in range(count - len(allowed))
+    ]
+    return allowed + denied
+
+
+def bench(size, number=NUMBER):
+    """ Time both implementations for an allowlist of the given size.
+
+    :return: `dict` with the mean time per validation in seconds
+    """
+    allowlist = make_allowlist(size)
+    requests = make_requests(allowlist)
+    index = callbacks.CallbackIndex(allowlist)
+
+    def linear():
+        for url in requests:
+            any(url.startswith(cb) for cb in allowlist)
+
+    def compiled():
+        for url in requests:
+            index.match(url)
+
+    # keep the linear scan's runtime bounded for big allowlists
+    linear_number = max(1, number * 10 // size)
+    return {
+        'linear': timeit.timeit(linear, number=linear_number) / linear_number / len(requests),
+        'compiled': timeit.timeit(compiled, number=number) / number / len(requests),
+    }
+
+
+def cases():
+    """ :return: `dict` of case name to a callable that runs one operation
+    """
+    result = {}
+    for size in SIZES:
+        allowlist = make_allowlist(size)
+        index = callbacks.CallbackIndex(allowlist)
+
+        def validate(callback_url, index=index):
+            try:
+                simpleidp.validate_callback_url(index, callback_url)
+            except werkzeug.exceptions.BadRequest:
+                pass
+
+        allowed = allowlist[size // 2] + '?next=/home'
+        denied = 'https://rp{}.evil.example.com/oauth2/callback'.format(size // 2)
+        name = 'callbacks.{}.'.format(size)
+        result[name + 'allowed'] = lambda validate=validate, url=allowed: validate(url)
+        result[name + 'denied'] = lambda validate=validate, url=denied: validate(url)
+    return result
+
+
+def main():
+    print('{:>8} {:>14} {:>14} {:>9}'.format('size', 'linear (us)', 'compiled (us)', 'speedup'))
+    for size in SIZES:
+        result = bench(size)
+        print('{:>8} {:>14.3f} {:>14.3f} {:>8.1f}x'.format(
+            size, result['linear'] * 1e6, result['compiled'] * 1e6,
+            result['linear'] / result['compiled']
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+    benchmarks.config
+    ~~~~~~~~~~~~~~~~~
+
+    Measures loading large configurations: interpolating environment
+    variables and :func:`auth.config.load`, both parsing and validating
+    (cold) and from the in-memory snapshot (cached).
+
+    Usage:
+
+    ::
+
+        $ python -m benchmarks.config
+"""
+import atexit
+import os
+import shutil
+import tempfile
+import timeit
+
+import yaml
+
+from auth import config
+
+SIZES = (10, 1000, 10000)
+NUMBER = 20
+
+
+def make_config(size):
+    """ :return: a valid configuration with ``size`` callbacks and as many
+        environment references, half of them with defaults
+    """
+    return {
+        'app': {'host': 'localhost', 'port': 8109, 'root': '/auth'},
+        'callbacks': [
+            ('https://rp{}.${{BENCH_CALLBACK_DOMAIN}}/oauth2/callback' if i % 2 else
+             'https://rp{}.${{BENCH_MISSING:-api.data.amsterdam.nl}}/oauth2/callback').format(i)
+            for i in range(size)
+        ],
+        'jwt': {'secret': '${BENCH_SECRET}', 'algorithm': 'HS256', 'lifetime': 10},
+        'postgres': {
+            'host': 'localhost', 'port': 5432, 'user': 'dpuser',
+            'password': '${BENCH_SECRET}', 'dbname': 'accounts'
+        },
+    }
+
+
+def _environment():
+    os.environ.setdefault('BENCH_CALLBACK_DOMAIN', 'api.data.amsterdam.nl')
+    os.environ.setdefault('BENCH_SECRET', 'secret')
+    os.environ.pop(config.CACHE_DIR_ENV, None)
+
+
+def cases():
+    """ :return: `dict` of case name to a callable that runs one operation
+    """
+    _environment()
+    directory = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, directory, True)
+    result = {}
+    for size in SIZES:
+        data = make_config(size)
+        path = os.path.join(directory, 'config-{}.yml'.format(size))
+        with open(path, 'w') as f:
+            yaml.safe_dump(data, f)
+
+        def load_cold(path=path):
+            config._snapshots.clear()
+            config.load(path)
+
+        config.load(path)
+        name = 'config.{}.'.format(size)
+        result[name + 'interpolate'] = \
+            lambda data=data: config._interpolate_environment(data)
+        result[name + 'load'] = load_cold
+        result[name + 'load_cached'] = lambda path=path: config.load(path)
+    return result
+
+
+def main():
+    print('{:>8} {:>16} {:>12} {:>16}'.format(
+        'size', 'interpolate (ms)', 'load (ms)', 'load_cached (ms)'
+    ))
+    results = cases()
+    for size in SIZES:
+        times = [
+            timeit.timeit(results['config.{}.{}'.format(size, case)], number=NUMBER) / NUMBER
+            for case in ('interpolate', 'load', 'load_cached')
+        ]
+        print('{:>8} {:>16.3f} {:>12.3f} {:>16.3f}'.format(size, *(t * 1e3 for t in times)))
+
+
+if __name__ == '__main__':
+    main()
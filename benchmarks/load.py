@@ -0,0 +1,270 @@
+"""
+    benchmarks.load
+    ~~~~~~~~~~~~~~~
+
+    End-to-end load test of the Flask application (``auth.server.app``)
+    without a database.
+
+    The user store is replaced by :class:`FakeUsers`, which keeps PBKDF2
+    password hashes in memory, with a tunable number of iterations (the hash
+    cost) and a tunable delay per verification (the database round trip).
+    Everything else is the real application: the verification executor, the
+    throttle, the login page, token creation and audit logging.
+
+    A number of client threads replay a mix of requests:
+
+    - ``form``: ``GET /idp/login``;
+    - ``login``: a password login with the right password;
+    - ``failed``: a password login with a wrong password;
+    - ``employee``: an employee login from a whitelisted address.
+
+    The requests go through the WSGI interface of the application (Flask's
+    test client), so the numbers exclude the HTTP server. Throughput and the
+    50th, 95th and 99th latency percentiles are reported per request type.
+
+    The throttle limits are raised unless ``--throttle`` is given, since the
+    clients log in with a small set of accounts. The service logs every
+    login; send its log output elsewhere to keep the report readable.
+
+    Usage:
+
+    ::
+
+        $ python -m benchmarks.load --concurrency 8 --requests 5000 2>/dev/null
+        $ python -m benchmarks.load --mix form=1,login=1 --hash-iterations 200000 \\
+            --db-latency 0.005 --json results.json 2>/dev/null
+"""
+import argparse
+import collections
+import hashlib
+import hmac
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+
+MIX = collections.OrderedDict([('form', 50), ('login', 30), ('failed', 15), ('employee', 5)])
+
+CALLBACK = 'http://localhost/callback'
+
+PERCENTILES = (50, 95, 99)
+
+
+class FakeUsers:
+    """ In-memory stand-in for :class:`dpuser.Users`.
+
+    :param users: `dict` of email to password
+    :param hash_iterations: PBKDF2 iterations per verification
+    :param db_latency: seconds every verification waits, as for a database
+        round trip
+    """
+
+    def __init__(self, users, hash_iterations=100000, db_latency=0.0):
+        self.hash_iterations = hash_iterations
+        self.db_latency = db_latency
+        self._hashes = {
+            email.lower(): self._hash(password, email.encode('utf-8'))
+            for email, password in users.items()
+        }
+
+    def _hash(self, password, salt):
+        return hashlib.pbkdf2_hmac(
+            'sha256', password.encode('utf-8'), salt, self.hash_iterations
+        )
+
+    def verify_password(self, email, password):
+        if self.db_latency:
+            time.sleep(self.db_latency)
+        expected = self._hashes.get(email.lower())
+        if expected is None:
+            return False
+        return hmac.compare_digest(expected, self._hash(password, email.lower().encode('utf-8')))
+
+
+def _install(users, throttle):
+    """ Import ``auth.server`` with ``users`` as the user store.
+    """
+    if not throttle:
+        for name in ('EMAIL', 'ADDRESS'):
+            os.environ['THROTTLE_{}_RATE'.format(name)] = '1000000000'
+            os.environ['THROTTLE_{}_BURST'.format(name)] = '1000000000'
+    import dpuser
+    import auth.pool
+    dpuser.Users = auth.pool.PooledUsers = lambda *args, **kwargs: users
+    import auth.server
+    return auth.server.app
+
+
+def _requests(app, accounts):
+    """ :return: `dict` of request type to a callable that makes such a
+        request with a test client
+    """
+    import auth.server
+    root = '{}/idp'.format(auth.server.config['app']['root'])
+    url = '{}/login?{}'.format(root, urllib.parse.urlencode({'callback': CALLBACK}))
+    emails = list(accounts)
+
+    def form(client, rnd):
+        return client.get(url)
+
+    def login(client, rnd):
+        email = rnd.choice(emails)
+        return client.post(url, data={'email': email, 'password': accounts[email]})
+
+    def failed(client, rnd):
+        return client.post(url, data={'email': rnd.choice(emails), 'password': 'wrong'})
+
+    def employee(client, rnd):
+        return client.post(
+            url, data={'type': 'employee'}, headers={'X-Auth-Whitelist': '1'}
+        )
+
+    return {'form': form, 'login': login, 'failed': failed, 'employee': employee}
+
+
+def percentile(values, p):
+    """ :return: the ``p``-th percentile (nearest rank) of sorted ``values``
+    """
+    if not values:
+        return float('nan')
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+def run(app, requests, mix, total, concurrency, seed=42):
+    """ Make ``total`` requests from ``concurrency`` threads.
+
+    :return: ``(elapsed seconds, results)``, where ``results`` is a `dict` of
+        request type to a `list` of ``(seconds, status)``
+    """
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = collections.defaultdict(list)
+    lock = threading.Lock()
+    counter = iter(range(total))
+    barrier = threading.Barrier(concurrency + 1)
+
+    def client_thread(index):
+        rnd = random.Random(seed + index)
+        client = app.test_client()
+        address = '10.0.{}.{}'.format(index // 256, index % 256)
+        client.environ_base['REMOTE_ADDR'] = address
+        local = collections.defaultdict(list)
+        barrier.wait()
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    break
+            name = rnd.choices(names, weights)[0]
+            started = time.perf_counter()
+            response = requests[name](client, rnd)
+            local[name].append((time.perf_counter() - started, response.status_code))
+            response.close()
+        with lock:
+            for name, samples in local.items():
+                results[name].extend(samples)
+
+    threads = [
+        threading.Thread(target=client_thread, args=(i,), daemon=True)
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, dict(results)
+
+
+def report(elapsed, results):
+    """ :return: `dict` of request type (and ``all``) to its count,
+        statuses, requests per second and latency percentiles in milliseconds
+    """
+    summary = collections.OrderedDict()
+    everything = []
+    for name in sorted(results):
+        everything.extend(results[name])
+    for name, samples in sorted(results.items()) + [('all', everything)]:
+        latencies = sorted(seconds for seconds, _ in samples)
+        summary[name] = {
+            'count': len(samples),
+            'statuses': dict(collections.Counter(str(status) for _, status in samples)),
+            'throughput': len(samples) / elapsed,
+        }
+        for p in PERCENTILES:
+            summary[name]['p{}'.format(p)] = percentile(latencies, p) * 1000
+    return summary
+
+
+def _parse_mix(value):
+    mix = collections.OrderedDict()
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name not in MIX:
+            raise argparse.ArgumentTypeError('unknown request type: {}'.format(name))
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.load',
+        description='Load test the authentication service without a database.'
+    )
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads (default: 8)')
+    parser.add_argument('--requests', type=int, default=2000, help='total requests (default: 2000)')
+    parser.add_argument('--mix', type=_parse_mix, default=MIX,
+                        help='weights per request type (default: form=50,login=30,failed=15,employee=5)')
+    parser.add_argument('--accounts', type=int, default=100, help='number of user accounts (default: 100)')
+    parser.add_argument('--hash-iterations', type=int, default=100000,
+                        help='PBKDF2 iterations per verification (default: 100000)')
+    parser.add_argument('--db-latency', type=float, default=0.001,
+                        help='seconds per verification spent waiting (default: 0.001)')
+    parser.add_argument('--throttle', action='store_true', help='keep the configured throttle limits')
+    parser.add_argument('--warmup', type=int, default=50, help='requests before measuring (default: 50)')
+    parser.add_argument('--json', help='also write the report to this JSON file')
+    args = parser.parse_args(argv)
+
+    accounts = {
+        'user{}@example.com'.format(i): 'password{}'.format(i) for i in range(args.accounts)
+    }
+    users = FakeUsers(accounts, args.hash_iterations, args.db_latency)
+    app = _install(users, args.throttle)
+    requests = _requests(app, accounts)
+    if args.warmup:
+        run(app, requests, args.mix, args.warmup, min(args.concurrency, args.warmup))
+    elapsed, results = run(app, requests, args.mix, args.requests, args.concurrency)
+    summary = report(elapsed, results)
+
+    print('{} requests from {} threads in {:.2f} s'.format(args.requests, args.concurrency, elapsed))
+    print('{:<10} {:>7} {:>9} {:>9} {:>9} {:>9}  {}'.format(
+        'type', 'count', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'statuses'
+    ))
+    for name, row in summary.items():
+        print('{:<10} {:>7} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f}  {}'.format(
+            name, row['count'], row['throughput'], row['p50'], row['p95'], row['p99'],
+            ' '.join('{}={}'.format(*item) for item in sorted(row['statuses'].items()))
+        ))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'settings': {
+                    'concurrency': args.concurrency, 'requests': args.requests,
+                    'mix': args.mix, 'accounts': args.accounts,
+                    'hash_iterations': args.hash_iterations,
+                    'db_latency': args.db_latency, 'throttle': args.throttle,
+                },
+                'elapsed': elapsed,
+                'results': summary,
+            }, f, indent=2)
+            f.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+    benchmarks.suite
+    ~~~~~~~~~~~~~~~~
+
+    Runs the cases of all benchmark modules, stores the results as JSON and
+    compares them with a baseline.
+
+    Every case is one operation (e.g. encoding a token). It's run in loops of
+    at least ``--min-time`` seconds, ``--repeat`` times; the fastest loop
+    gives the time per operation, which is the least disturbed by whatever
+    else the machine is doing.
+
+    With ``--baseline``, every case that got slower than the baseline by more
+    than ``--threshold`` (a fraction, 0.25 is 25%) is reported as a
+    regression and the exit status is 1. Cases missing from either side are
+    ignored. Only compare results from the same machine.
+
+    Usage:
+
+    ::
+
+        $ python -m benchmarks.suite --output baseline.json
+        $ # ... change the code ...
+        $ python -m benchmarks.suite --baseline baseline.json --output new.json
+        $ python -m benchmarks.suite --baseline baseline.json --filter token.HS
+"""
+import argparse
+import datetime
+import json
+import platform
+import sys
+import timeit
+
+import auth.audit
+
+from . import audit, callbacks, config, token
+
+MODULES = (token, config, callbacks, audit)
+
+FORMAT_VERSION = 1
+
+
+def measure(case, min_time=0.2, repeat=5):
+    """ :return: `dict` with the fastest time per operation in ``seconds``,
+        the ``number`` of operations per loop and the ``repeat`` count
+    """
+    timer = timeit.Timer(case)
+    number, seconds = timer.autorange()
+    if seconds < min_time:
+        number = max(number, int(number * min_time / seconds) + 1)
+    loops = timer.repeat(repeat=repeat, number=number)
+    return {'seconds': min(loops) / number, 'number': number, 'repeat': repeat}
+
+
+def run(pattern=None, min_time=0.2, repeat=5, out=sys.stdout):
+    """ Run all cases whose name contains ``pattern``.
+
+    :return: the results document
+    """
+    results = {}
+    for module in MODULES:
+        for name, case in sorted(module.cases().items()):
+            if pattern and pattern not in name:
+                continue
+            results[name] = measure(case, min_time, repeat)
+            print('{:<40} {:>12.3f} us'.format(name, results[name]['seconds'] * 1e6), file=out)
+    return {
+        'version': FORMAT_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """ :return: `list` of ``(name, baseline seconds, current seconds,
+        ratio, regressed)`` for the cases in both documents
+    """
+    rows = []
+    for name, result in sorted(current['results'].items()):
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['seconds']
+        ratio = result['seconds'] / before
+        rows.append((name, before, result['seconds'], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.suite',
+        description='Run the benchmarks and compare them with a baseline.'
+    )
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='slowdown that counts as a regression (default: 0.25)')
+    parser.add_argument('--filter', help='only run cases whose name contains this')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum seconds per loop (default: 0.2)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='loops per case (default: 5)')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('version') != FORMAT_VERSION:
+            parser.error('unsupported baseline format: {}'.format(baseline.get('version')))
+    try:
+        current = run(args.filter, args.min_time, args.repeat)
+    finally:
+        # the audit cases may leave the pipeline thread running
+        auth.audit.stop_pipeline()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if baseline is None:
+        return 0
+    if (baseline['python'], baseline['machine']) != (current['python'], current['machine']):
+        print('Warning: the baseline is from Python {} on {}'.format(
+            baseline['python'], baseline['machine']
+        ), file=sys.stderr)
+    rows = compare(baseline, current, args.threshold)
+    print()
+    print('{:<40} {:>12} {:>12} {:>8}'.format('case', 'baseline us', 'current us', 'ratio'))
+    for name, before, after, ratio, regressed in rows:
+        print('{:<40} {:>12.3f} {:>12.3f} {:>7.2f}x{}'.format(
+            name, before * 1e6, after * 1e6, ratio, '  REGRESSION' if regressed else ''
+        ))
+    regressions = [row for row in rows if row[-1]]
+    if regressions:
+        print('{} of {} cases regressed by more than {:.0%}'.format(
+            len(regressions), len(rows), args.threshold
+        ), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
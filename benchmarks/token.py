@@ -0,0 +1,111 @@
+"""
+    benchmarks.token
+    ~~~~~~~~~~~~~~~~
+
+    Measures tokens per second for the precompiled encoder in
+    :class:`auth.token.TokenBuilder` versus plain `jwt.encode <jwt>`.
+
+    :func:`cases` times creating, encoding and decoding (with and without the
+    verified token cache) per algorithm, for :mod:`benchmarks.suite`.
+
+    Usage:
+
+    ::
+
+        $ python -m benchmarks.token
+"""
+import tempfile
+import timeit
+
+import jwt
+
+from auth import token
+
+ALGORITHMS = ('HS256', 'HS512')
+# Algorithms for :func:`cases`; the asymmetric ones need `cryptography`
+CASE_ALGORITHMS = ('HS256', 'HS512', 'RS256', 'ES256', 'EdDSA')
+NUMBER = 20000
+
+
+def bench(algorithm, number=NUMBER):
+    """ :return: `dict` with tokens per second for each implementation
+    """
+    builder = token.TokenBuilder('secret', 300, algorithm)
+    data = builder.create(sub='user@example.com')
+    batch = [data] * 100
+    results = {
+        'pyjwt': timeit.timeit(
+            lambda: jwt.encode(data, 'secret', algorithm=algorithm), number=number
+        ),
+        'encode': timeit.timeit(data.encode, number=number),
+        'encode_many': timeit.timeit(
+            lambda: builder.encode_many(batch), number=number // len(batch)
+        ),
+    }
+    return {name: number / seconds for name, seconds in results.items()}
+
+
+def _write_key(directory, algorithm):
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+    if algorithm.startswith('RS'):
+        private = rsa.generate_private_key(65537, 2048, default_backend())
+    elif algorithm.startswith('ES'):
+        private = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    else:
+        private = ed25519.Ed25519PrivateKey.generate()
+    path = '{}/{}.pem'.format(directory, algorithm)
+    with open(path, 'wb') as f:
+        f.write(private.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        ))
+    return path
+
+
+def _builder(algorithm, directory):
+    if algorithm.startswith('HS'):
+        return token.TokenBuilder('secret', 300, algorithm)
+    return token.TokenBuilder(lifetime=300, algorithm=algorithm, keys=[
+        {'kid': algorithm, 'private_key_file': _write_key(directory, algorithm)}
+    ])
+
+
+def cases():
+    """ :return: `dict` of case name to a callable that runs one operation
+    """
+    result = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for algorithm in CASE_ALGORITHMS:
+            try:
+                builder = _builder(algorithm, directory)
+            except ImportError:
+                continue
+            data = builder.create(sub='user@example.com')
+            encoded = data.encode()
+            builder.decode(encoded)
+            # a builder with the same keys whose cache never hits, to time
+            # verification
+            uncached = token.TokenBuilder(*builder)
+            uncached._vc = token.VerifiedTokenCache(maxsize=0)
+            uncached.decode(encoded)
+            name = 'token.{}.'.format(algorithm)
+            result[name + 'create'] = lambda builder=builder: builder.create(sub='user@example.com')
+            result[name + 'encode'] = data.encode
+            result[name + 'decode'] = lambda uncached=uncached, encoded=encoded: uncached.decode(encoded)
+            result[name + 'decode_cached'] = lambda builder=builder, encoded=encoded: builder.decode(encoded)
+    return result
+
+
+def main():
+    print('{:>6} {:>12} {:>12} {:>12}'.format('alg', 'pyjwt/s', 'encode/s', 'encode_many/s'))
+    for algorithm in ALGORITHMS:
+        result = bench(algorithm)
+        print('{:>6} {:>12.0f} {:>12.0f} {:>12.0f}'.format(
+            algorithm, result['pyjwt'], result['encode'], result['encode_many']
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -55,6 +55,9 @@ requires_extras = {
         'sphinx-rtd-theme',
     ],
     'dev': requires_test + [ 'pylint' ],
+    'asgi': ['uvicorn'],
+    'crypto': ['cryptography'],
+    'brotli': ['brotli'],
 }
 
 setup(
@@ -1,14 +1,23 @@
 import os
 import pytest
 import auth.config
+import auth.pool
 import dpuser
 
 
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'real_pool: keep auth.pool.PooledUsers (tests that fake its connections)'
+    )
+
+
 @pytest.fixture(autouse=True)
-def no_database(monkeypatch):
+def no_database(request, monkeypatch):
     def Users(*args, **kwargs):
         return object()
     monkeypatch.setattr(dpuser, 'Users', Users)
+    if request.node.get_closest_marker('real_pool') is None:
+        monkeypatch.setattr(auth.pool, 'PooledUsers', Users)
 
 
 @pytest.fixture(scope='session')
@@ -0,0 +1,96 @@
+"""
+    auth.tests.test_accesstoken
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+import types
+
+import pytest
+
+from auth import token
+
+URL = '/auth/accesstoken'
+
+
+@pytest.fixture()
+def tokenbuilder():
+    return token.TokenBuilder('refresh-secret', 10)
+
+
+@pytest.fixture()
+def accesstokenbuilder():
+    return token.TokenBuilder('access-secret', 300)
+
+
+@pytest.fixture()
+def client(tokenbuilder, accesstokenbuilder):
+    from flask import Flask
+    from auth.blueprints import accesstokenblueprint
+    app = Flask('test')
+    app.register_blueprint(
+        accesstokenblueprint(tokenbuilder, accesstokenbuilder), url_prefix='/auth'
+    )
+    return app.test_client()
+
+
+def test_accesstoken(client, tokenbuilder, accesstokenbuilder):
+    refreshtoken = tokenbuilder.create(sub='user@example.com').encode()
+    # 1. a valid refresh token gets an access token for the same subject
+    response = client.get(URL, headers={
+        'Authorization': 'Bearer ' + refreshtoken.decode(), 'Accept': 'text/plain'
+    })
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert response.headers['Cache-Control'] == 'no-store'
+    accesstoken = response.get_data()
+    claims = accesstokenbuilder.decode(accesstoken)
+    assert claims['sub'] == 'user@example.com'
+    assert claims['exp'] - claims['iat'] == accesstokenbuilder.lifetime + 60
+    # 2. signed with the access token secret only
+    with pytest.raises(Exception):
+        tokenbuilder.decode(accesstoken)
+
+
+def test_accesstoken_errors(client, tokenbuilder, accesstokenbuilder):
+    # 1. missing refresh token
+    response = client.get(URL)
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'] == 'Bearer realm="datapunt"'
+    # 2. invalid refresh token, e.g. an access token
+    accesstoken = accesstokenbuilder.create(sub='user').encode()
+    response = client.get(URL, headers={'Authorization': 'Bearer ' + accesstoken.decode()})
+    assert response.status_code == 401
+    assert 'error="invalid_token"' in response.headers['WWW-Authenticate']
+    # 3. only text/plain
+    refreshtoken = tokenbuilder.create(sub='user').encode()
+    response = client.get(URL, headers={
+        'Authorization': 'Bearer ' + refreshtoken.decode(), 'Accept': 'application/json'
+    })
+    assert response.status_code == 406
+
+
+def test_accesstoken_later(client, tokenbuilder, accesstokenbuilder, monkeypatch):
+    from auth import callbacks
+    policy = callbacks.Policy.from_config({'prefix': 'http://localhost/app', 'lifetime': 3600})
+    # refresh tokens issued five minutes ago, with the default lifetime and
+    # with the callback's policy
+    earlier = token.time.time() - 300
+    with monkeypatch.context() as m:
+        m.setattr(token, 'time', types.SimpleNamespace(time=lambda: earlier))
+        default = tokenbuilder.create(sub='user@example.com').encode()
+        longer = tokenbuilder.for_policy(policy).create(sub='user@example.com').encode()
+    headers = {'Accept': 'text/plain'}
+    # 1. the default refresh token has expired
+    response = client.get(URL, headers=dict(headers, Authorization='Bearer ' + default.decode()))
+    assert response.status_code == 401
+    # 2. the one with the longer lifetime still gets an access token
+    response = client.get(URL, headers=dict(headers, Authorization='Bearer ' + longer.decode()))
+    assert response.status_code == 200
+    claims = accesstokenbuilder.decode(response.get_data())
+    assert claims['sub'] == 'user@example.com'
+
+
+def test_not_configured(app):
+    # the accesstoken section is optional
+    import auth.server
+    assert auth.server.accesstokenbuilder is None
+    assert app.test_client().get(URL).status_code == 404
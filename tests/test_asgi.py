@@ -0,0 +1,253 @@
+"""
+    auth.tests.test_asgi
+    ~~~~~~~~~~~~~~~~~~~~
+"""
+import asyncio
+import urllib.parse
+
+import pytest
+
+from auth import asgi, components, executor, metrics, session, throttle, token
+
+
+class FakeToken(dict):
+    def encode(self):
+        return 'header.payload.mac'
+
+
+class FakeTokenBuilder:
+    def create(self, **kwargs):
+        return FakeToken(kwargs)
+
+    def for_policy(self, policy):
+        return self
+
+
+class FakeUsers:
+    def verify_password(self, email, password):
+        return (email, password) == ('user@example.com', 'secret')
+
+
+def _call(app, method, path, query=None, body=b'', headers=()):
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': urllib.parse.urlencode(query or {}).encode(),
+        'headers': [(k.encode(), v.encode()) for k, v in headers],
+    }
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(app(scope, receive, send))
+    finally:
+        loop.close()
+    headers = {k.decode(): v.decode() for k, v in sent[0]['headers']}
+    return sent[0]['status'], headers, sent[1]['body']
+
+
+def _post(app, form, headers=(), path='/auth/idp/login'):
+    return _call(
+        app, 'POST', path,
+        query={'callback': 'http://localhost/cb?a=1'},
+        body=urllib.parse.urlencode(form).encode(),
+        headers=(('Content-Type', 'application/x-www-form-urlencoded'),) + headers,
+    )
+
+
+@pytest.fixture(params=['plain', 'executor'])
+def asgiapp(request):
+    users = FakeUsers()
+    if request.param == 'executor':
+        users = executor.VerificationExecutor(FakeUsers)
+    return asgi.IdPApplication(
+        FakeTokenBuilder(), ['http://localhost'], users, root='/auth'
+    )
+
+
+def test_show_form(asgiapp):
+    # 1. missing or invalid callback
+    assert _call(asgiapp, 'GET', '/auth/idp/login')[0] == 400
+    status, _, _ = _call(asgiapp, 'GET', '/auth/idp/login', {'callback': 'http://evil'})
+    assert status == 400
+    # 2. the form
+    status, headers, body = _call(
+        asgiapp, 'GET', '/auth/idp/login', {'callback': 'http://localhost/cb'}
+    )
+    assert status == 200
+    assert headers['content-type'].startswith('text/html')
+    assert b'login?callback=http%3A%2F%2Flocalhost%2Fcb' in body
+    assert b'value="employee"' not in body
+    # 3. whitelisted clients get the employee button
+    _, _, body = _call(
+        asgiapp, 'GET', '/auth/idp/login', {'callback': 'http://localhost/cb'},
+        headers=(('X-Auth-Whitelist', '1'),)
+    )
+    assert b'value="employee"' in body
+
+
+def test_show_form_conditional(asgiapp):
+    query = {'callback': 'http://localhost/cb'}
+    _, headers, _ = _call(asgiapp, 'GET', '/auth/idp/login', query)
+    assert headers['vary'] == 'X-Auth-Whitelist'
+    status, _, body = _call(
+        asgiapp, 'GET', '/auth/idp/login', query,
+        headers=(('If-None-Match', headers['etag']),)
+    )
+    assert status == 304 and body == b''
+    # the whitelisted variant has a different entity tag
+    status, _, _ = _call(
+        asgiapp, 'GET', '/auth/idp/login', query,
+        headers=(('If-None-Match', headers['etag']), ('X-Auth-Whitelist', '1'))
+    )
+    assert status == 200
+
+
+def test_handle_login(asgiapp):
+    # 1. bad credentials
+    status, _, body = _post(asgiapp, {'email': 'user@example.com', 'password': 'x'})
+    assert status == 200
+    assert asgi.ERROR_BAD_CREDENTIALS.encode() in body
+    # 2. good credentials
+    status, headers, _ = _post(asgiapp, {'email': 'user@example.com', 'password': 'secret'})
+    assert status == 303
+    assert headers['location'] == 'http://localhost/cb?a=1&credentials=header.payload.mac'
+    # 3. employees must come from a whitelisted address
+    status, _, body = _post(asgiapp, {'type': 'employee'})
+    assert status == 200
+    assert asgi.ERROR_NOT_WHITELISTED.encode() in body
+    status, _, _ = _post(asgiapp, {'type': 'employee'}, headers=(('X-Auth-Whitelist', '1'),))
+    assert status == 303
+
+
+def test_routing(asgiapp):
+    assert _call(asgiapp, 'GET', '/auth/idp/nothing')[0] == 404
+    assert _call(asgiapp, 'PUT', '/auth/idp/login')[0] == 405
+    status, headers, _ = _call(asgiapp, 'GET', '/auth/idp/static/style.css')
+    assert status == 200
+    assert headers['content-type'] == 'text/css; charset=utf-8'
+    assert _call(asgiapp, 'GET', '/auth/idp/static/../config.yml')[0] == 404
+
+
+def test_throttle():
+    app = asgi.IdPApplication(
+        FakeTokenBuilder(), ['http://localhost'], FakeUsers(), root='/auth',
+        throttle=throttle.Throttle(email={'rate': 1, 'burst': 1}),
+    )
+    form = {'email': 'user@example.com', 'password': 'x'}
+    assert _post(app, form)[0] == 200
+    status, headers, _ = _post(app, form)
+    assert status == 429
+    assert 'retry-after' in headers
+
+
+def test_throttle_failures_only():
+    app = asgi.IdPApplication(
+        FakeTokenBuilder(), ['http://localhost'], FakeUsers(), root='/auth',
+        throttle=throttle.Throttle(email={'rate': 1, 'burst': 1}),
+    )
+    form = {'email': 'user@example.com', 'password': 'secret'}
+    for _ in range(3):
+        assert _post(app, form)[0] == 303
+
+
+def test_proxy_hops():
+    scope = {
+        'method': 'POST', 'path': '/', 'client': ('10.0.0.1', 1234),
+        'headers': [(b'x-forwarded-for', b'1.2.3.4, 5.6.7.8')],
+    }
+    assert asgi._Request(scope).remote_addr == '10.0.0.1'
+    assert asgi._Request(scope, proxy_hops=1).remote_addr == '5.6.7.8'
+    assert asgi._Request(scope, proxy_hops=2).remote_addr == '1.2.3.4'
+    # fewer addresses than proxies: the header can't be trusted
+    assert asgi._Request(scope, proxy_hops=3).remote_addr == '10.0.0.1'
+
+
+def test_sessions():
+    sessions = session.SessionStore('session-secret')
+    app = asgi.IdPApplication(
+        FakeTokenBuilder(), ['http://localhost'], FakeUsers(), root='/auth',
+        sessions=sessions
+    )
+    query = {'callback': 'http://localhost/cb'}
+    # 1. a login starts a session
+    _, headers, _ = _post(app, {'email': 'user@example.com', 'password': 'secret'})
+    cookie = headers['set-cookie'].split(';')[0]
+    assert 'Path=/auth/idp' in headers['set-cookie'] and 'HttpOnly' in headers['set-cookie']
+    # 2. ... so the next login doesn't need the form
+    status, headers, _ = _call(app, 'GET', '/auth/idp/login', query, headers=(('Cookie', cookie),))
+    assert status == 303 and headers['cache-control'] == 'no-store'
+    # 3. until the browser logs out
+    status, headers, _ = _post(app, {}, headers=(('Cookie', cookie),), path='/auth/idp/logout')
+    assert status == 204 and 'Max-Age=0' in headers['set-cookie']
+    assert _call(app, 'GET', '/auth/idp/login', query, headers=(('Cookie', cookie),))[0] == 200
+
+
+def test_metrics():
+    registry = metrics.Metrics()
+    app = asgi.IdPApplication(
+        FakeTokenBuilder(), ['http://localhost'], FakeUsers(), root='/auth',
+        metrics=registry, metrics_key='metrics-key-of-16+'
+    )
+    _post(app, {'email': 'user@example.com', 'password': 'x'})
+    # 1. only for scrapers with the key
+    status, headers, body = _call(app, 'GET', '/auth/idp/metrics')
+    assert status == 401 and headers['www-authenticate'].startswith('Bearer')
+    status, _, body = _call(
+        app, 'GET', '/auth/idp/metrics',
+        headers=(('Authorization', 'Bearer metrics-key-of-16+'),)
+    )
+    assert status == 200
+    assert b'outcome="bad_credentials"} 1' in body
+    # 2. not exposed without a key
+    app = asgi.IdPApplication(
+        FakeTokenBuilder(), ['http://localhost'], FakeUsers(), root='/auth', metrics=registry
+    )
+    assert _call(app, 'GET', '/auth/idp/metrics')[0] == 404
+
+
+def test_create_app(monkeypatch):
+    started = []
+    monkeypatch.setattr(components, 'start_worker', started.append)
+    app = asgi.create_app()
+    assert len(started) == 1
+    assert app.tokenbuilder is started[0].tokenbuilder
+    assert app.callback_index is started[0].callback_index
+    # an invalid configuration fails before anything runs in the background
+
+    def decode(self, *args, **kwargs):
+        raise ValueError('bad key')
+    monkeypatch.setattr(token.TokenBuilder, 'decode', decode)
+    with pytest.raises(ValueError):
+        asgi.create_app()
+    assert len(started) == 1
+
+
+def test_lifespan_shutdown(monkeypatch):
+    monkeypatch.setattr(components, 'start_worker', lambda parts: None)
+    app = asgi.create_app()
+    messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(app({'type': 'lifespan'}, receive, send))
+    finally:
+        loop.close()
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    # the user store was never used, so it wasn't created to shut it down
+    assert app.users.peek() is None
@@ -0,0 +1,52 @@
+"""
+    auth.tests.test_assets
+    ~~~~~~~~~~~~~~~~~~~~~~
+"""
+import gzip
+
+import pytest
+
+from auth import assets
+
+
+@pytest.fixture(scope='module')
+def store():
+    return assets.AssetStore()
+
+
+def test_versioned_names(store):
+    url = store.url('style.css')
+    assert url.startswith('static/style.') and url.endswith('.css')
+    asset, immutable = store.get(url[len('static/'):])
+    assert immutable and asset.name == 'style.css'
+    asset, immutable = store.get('style.css')
+    assert not immutable and asset.name == 'style.css'
+    assert store.get('nothing.css') == (None, False)
+    assert store.url('nothing.css') == 'static/nothing.css'
+
+
+def test_css_references_versioned_names(store):
+    css = store.get('style.css')[0].bodies['identity']
+    assert store.url('assets/images/forward.svg')[len('static/'):].encode() in css
+    assert b"'assets/images/forward.svg'" not in css
+
+
+def test_negotiate(store):
+    asset, _ = store.get('style.css')
+    encoding, body = asset.negotiate('gzip, deflate')
+    assert encoding == 'gzip'
+    assert gzip.decompress(body) == asset.bodies['identity']
+    assert asset.negotiate('gzip;q=0, deflate') == (None, asset.bodies['identity'])
+    assert asset.negotiate(None) == (None, asset.bodies['identity'])
+    # images aren't compressed
+    assert list(store.get('favicon.png')[0].bodies) == ['identity']
+
+
+def test_headers(store):
+    asset, _ = store.get('style.css')
+    headers = dict(asset.headers('gzip', True))
+    assert headers['Cache-Control'] == assets.IMMUTABLE
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Vary'] == 'Accept-Encoding'
+    assert headers['ETag'] == '"{}-gzip"'.format(asset.etag)
+    assert dict(asset.headers(None, False))['Cache-Control'] == assets.REVALIDATE
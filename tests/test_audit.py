@@ -2,6 +2,10 @@
     auth.tests.test_audit
     ~~~~~~~~~~~~~~~~~~~~~
 """
+import io
+import logging
+import threading
+
 import pytest
 from auth import audit
 
@@ -25,3 +29,88 @@ def test_log_token():
     # The I/O capturing has been incoorperated into newer versions of pytest.
     # TODO: update pytest (+dependencies) and refactor test code.
     #assert 'user' in caplog.text()
+
+
+class ListHandler(logging.Handler):
+    def __init__(self, block=None):
+        super().__init__()
+        self.records = []
+        self.block = block
+
+    def emit(self, record):
+        if self.block is not None:
+            self.block.wait(5)
+        self.records.append(record.getMessage())
+
+
+@pytest.fixture()
+def audit_handler():
+    audit.stop_pipeline()
+    handler = ListHandler()
+    logger = logging.getLogger('auditlog.authserver')
+    old_handlers, logger.handlers = logger.handlers, [handler]
+    old_level = logger.level
+    # pytest attaches its capture handler to loggers that don't propagate
+    old_propagate, logger.propagate = logger.propagate, True
+    logger.setLevel(logging.INFO)
+    yield handler
+    audit.stop_pipeline()
+    logger.handlers = old_handlers
+    logger.setLevel(old_level)
+    logger.propagate = old_propagate
+
+
+def test_pipeline(audit_handler):
+    pipeline = audit.start_pipeline(flush_interval=0.01)
+    for i in range(5):
+        audit.log_token('a.b.mac{}'.format(i), sub='user')
+    audit.stop_pipeline()
+    assert audit_handler.records == [
+        'Refreshtoken created: mac{} | sub=user'.format(i) for i in range(5)
+    ]
+    assert pipeline.stats()['written'] == 5
+    # the handlers are given back to the logger
+    assert logging.getLogger('auditlog.authserver').handlers == [audit_handler]
+
+
+def test_pipeline_stream_batch():
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    pipeline = audit.AuditPipeline([handler])
+    records = [
+        logging.LogRecord('auditlog.authserver', logging.INFO, '', 0, str(i), None, None)
+        for i in range(3)
+    ]
+    pipeline._write(records)
+    assert stream.getvalue() == '0\n1\n2\n'
+
+
+@pytest.mark.parametrize('overflow', ['sync', 'block', 'drop'])
+def test_pipeline_overflow(audit_handler, overflow):
+    audit_handler.block = threading.Event()
+    pipeline = audit.start_pipeline(
+        queue_size=1, batch_size=1, flush_interval=0.01, overflow=overflow,
+        block_timeout=0.01
+    )
+    # the writer takes the first record and blocks; the second one is queued
+    audit.log_token('a.b.1', sub='user')
+    while pipeline.queue.qsize():
+        pass
+    audit.log_token('a.b.2', sub='user')
+    if overflow == 'sync':
+        audit_handler.block.set()
+    audit.log_token('a.b.3', sub='user')
+    audit_handler.block.set()
+    audit.stop_pipeline()
+    stats = pipeline.stats()
+    if overflow == 'sync':
+        assert stats['overflowed'] == 1 and stats['dropped'] == 0
+        assert len(audit_handler.records) == 3
+    else:
+        assert stats['dropped'] == 1
+        assert len(audit_handler.records) == 2
+
+
+def test_pipeline_unknown_overflow():
+    with pytest.raises(ValueError):
+        audit.AuditPipeline([], overflow='ignore')
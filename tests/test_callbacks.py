@@ -0,0 +1,92 @@
+"""
+    auth.tests.test_callbacks
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+import urllib.parse
+
+from auth import callbacks
+
+
+PREFIXES = [
+    'https://acc.api.data.amsterdam.nl/oauth2/callback',
+    'https://api.data.amsterdam.nl/oauth2/callback',
+    'https://api.data.amsterdam.nl/oauth2/callback/v2',
+    'http://localhost',
+]
+
+
+def _linear_match(url):
+    return any(url.startswith(cb) for cb in PREFIXES)
+
+
+def _old_with_credentials(callback, jwt):
+    scheme, netloc, path, query, fragment = urllib.parse.urlsplit(callback)
+    query = {k: v[0] for k, v in urllib.parse.parse_qs(query).items()}
+    query['credentials'] = jwt
+    query = urllib.parse.urlencode(query)
+    return urllib.parse.urlunsplit((scheme, netloc, path, query, fragment))
+
+
+def test_callbackindex_match():
+    index = callbacks.CallbackIndex(PREFIXES)
+    assert len(index) == len(PREFIXES)
+    urls = [
+        'https://api.data.amsterdam.nl/oauth2/callback?x=1',
+        'https://api.data.amsterdam.nl/oauth2/callback/v2/x',
+        'https://api.data.amsterdam.nl/oauth2/call',
+        'https://api.data.amsterdam.nl/',
+        'http://localhost:8080/login',
+        'http://localhos',
+        'https://acc.api.data.amsterdam.nl/oauth2/callback',
+        'https://evil.example.com/?https://api.data.amsterdam.nl/oauth2/callback',
+        '',
+    ]
+    for url in urls:
+        assert (index.match(url) is not None) == _linear_match(url), url
+    # longest prefix wins
+    assert index.match('https://api.data.amsterdam.nl/oauth2/callback/v2/x') == PREFIXES[2]
+    assert index.match('https://api.data.amsterdam.nl/oauth2/callback/v1') == PREFIXES[1]
+
+
+def test_callbackindex_values():
+    index = callbacks.CallbackIndex()
+    index.add('https://a.example.com/', value='a')
+    index.add('https://a.example.com/b', value='b')
+    index.add('https://a.example.org', value='c')
+    index.add('https://a.example.com/', value='d')
+    assert len(index) == 3
+    assert index.match('https://a.example.com/x') == 'd'
+    assert index.match('https://a.example.com/bc') == 'b'
+    assert index.match('https://a.example.org/') == 'c'
+    assert index.match('https://a.example.net/') is None
+    # an empty prefix allows everything, like str.startswith('') does
+    index.add('')
+    assert index.match('https://a.example.net/') == ''
+
+
+def test_with_credentials():
+    urls = [
+        'http://localhost',
+        'http://localhost/cb',
+        'http://localhost/cb?a=1&b=%20x',
+        'http://localhost/cb?credentials=old&a=1#frag',
+        'http://localhost/cb?a=1&credentials=old&b=2',
+        'http://localhost/cb?a=1&a=2#',
+        'http://localhost/cb#frag?x',
+    ]
+    for url in urls:
+        for jwt in ('a.b.c', b'a+b/c.d=e'):
+            assert callbacks.with_credentials(url, jwt) == _old_with_credentials(url, jwt)
+
+
+def test_callbackindex_from_config():
+    index = callbacks.CallbackIndex.from_config([
+        'http://localhost',
+        {'prefix': 'http://localhost/batch', 'lifetime': 300, 'claims': {'aud': 'batch'}},
+    ])
+    policy = index.match('http://localhost/batch/cb')
+    assert (policy.prefix, policy.lifetime, policy.claims) == \
+        ('http://localhost/batch', 300, {'aud': 'batch'})
+    assert index.match('http://localhost/cb').is_default
+    assert sorted(p.prefix for p in index.values()) == ['http://localhost', 'http://localhost/batch']
+    assert callbacks.max_lifetime(['http://localhost', {'prefix': 'x', 'lifetime': 300}], 10) == 300
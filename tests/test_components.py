@@ -0,0 +1,39 @@
+"""
+    auth.tests.test_components
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+import os
+
+import pytest
+
+from auth import components, token
+
+
+def test_workerlocal(monkeypatch):
+    created = []
+
+    def factory():
+        created.append(object())
+        return created[-1]
+    local = components._WorkerLocal(factory)
+    assert local.peek() is None
+    assert local.get() is local.get() is created[0]
+    assert local.peek() is created[0]
+    # a forked worker creates its own
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    assert local.peek() is None
+    assert local.get() is created[1]
+
+
+def test_build(config, monkeypatch):
+    parts = components.build(config)
+    assert parts.callback_index.match('http://localhost/app') is not None
+    assert parts.tokenbuilder.revocations is None
+    assert parts.sessions is None and parts.metrics is None
+    # 2. tokens are checked before the components are returned
+
+    def decode(self, *args, **kwargs):
+        raise ValueError('bad key')
+    monkeypatch.setattr(token.TokenBuilder, 'decode', decode)
+    with pytest.raises(ValueError):
+        components.build(config)
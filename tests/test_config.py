@@ -2,6 +2,8 @@
     auth.tests.test_config
     ~~~~~~~~~~~~~~~~~~~~~~
 """
+import json
+import os
 import pathlib
 
 import pytest
@@ -53,6 +55,8 @@ def test__interpolate_environment(monkeypatch):
     assert config._interpolate_environment(data) == {'key': 'default'}
     data = {'key': '${GHOST:-/non:-alphanumeric}'}
     assert config._interpolate_environment(data) == {'key': '/non:-alphanumeric'}
+    data = {'key': '${GHOST:-0}'}
+    assert config._interpolate_environment(data) == {'key': 0}
     # 4. missing substitute
     data = {'key': '$GHOST'}
     with pytest.raises(config.ConfigError):
@@ -135,3 +139,85 @@ def test_load(tmpdir, monkeypatch):
     schemapath = schema.dirname + '/' + schema.basename
     monkeypatch.setattr(config, 'CONFIG_SCHEMA_V1_PATH', pathlib.Path(schemapath))
     assert config.load(confpath) == expected
+
+
+def test__validator(tmpdir):
+    p = tmpdir.join('testschema.json')
+    p.write('{"type": "object"}')
+    # 1. compiled once per version of the schema
+    validator = config._validator(str(p))
+    assert config._validator(str(p)) is validator
+    p.write('{"type": "array"}')
+    assert config._validator(str(p)) is not validator
+    # 2. an invalid schema is a configuration error too
+    p.write('{"type": 12}')
+    with pytest.raises(config.ConfigError):
+        config._validator(str(p))
+
+
+def test_load_snapshot(tmpdir, monkeypatch):
+    schema = tmpdir.join('testschema.json')
+    schema.write('{"type": "object", "required": ["test"]}')
+    monkeypatch.setattr(config, 'CONFIG_SCHEMA_V1_PATH', pathlib.Path(str(schema)))
+    monkeypatch.setattr(config, '_snapshots', {})
+    cachedir = tmpdir.join('cache')
+    monkeypatch.setenv(config.CACHE_DIR_ENV, str(cachedir))
+    monkeypatch.setenv('TEST_SUBSTITUTE', 'one')
+    conf = tmpdir.join('testconfig.yml')
+    conf.write('test: $TEST_SUBSTITUTE')
+    assert config.load(str(conf)) == {'test': 'one'}
+    snapshot, = cachedir.listdir()
+    assert oct(snapshot.stat().mode & 0o777) == oct(0o600)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('parsed a cached configuration')
+    # 1. another process finds the snapshot on disk
+    monkeypatch.setattr(config, '_snapshots', {})
+    monkeypatch.setattr(config.yaml, 'safe_load', fail)
+    assert config.load(str(conf)) == {'test': 'one'}
+    # 2. and then in memory
+    cachedir.remove()
+    assert config.load(str(conf)) == {'test': 'one'}
+    monkeypatch.undo()
+    # 3. changing a referenced environment variable changes the key
+    monkeypatch.setattr(config, 'CONFIG_SCHEMA_V1_PATH', pathlib.Path(str(schema)))
+    monkeypatch.setenv('TEST_SUBSTITUTE', 'two')
+    assert config.load(str(conf)) == {'test': 'two'}
+
+
+def test_unsafe_snapshots(tmpdir, monkeypatch):
+    schema = tmpdir.join('testschema.json')
+    schema.write('{"type": "object", "required": ["test"]}')
+    monkeypatch.setattr(config, 'CONFIG_SCHEMA_V1_PATH', pathlib.Path(str(schema)))
+    monkeypatch.setattr(config, '_snapshots', {})
+    cachedir = tmpdir.join('cache')
+    monkeypatch.setenv(config.CACHE_DIR_ENV, str(cachedir))
+    conf = tmpdir.join('testconfig.yml')
+    conf.write('test: one')
+    assert config.load(str(conf)) == {'test': 'one'}
+    assert oct(cachedir.stat().mode & 0o777) == oct(0o700)
+    snapshot, = cachedir.listdir()
+    key = snapshot.basename[len('config-'):-len('.json')]
+    # 1. a snapshot others can write is ignored
+    snapshot.write(json.dumps({'test': 'injected'}))
+    snapshot.chmod(0o666)
+    assert config._read_snapshot(key) is None
+    # 2. a snapshot that doesn't match the schema is ignored
+    snapshot.write(json.dumps({'other': 'injected'}))
+    snapshot.chmod(0o600)
+    assert config._read_snapshot(key) is None
+    snapshot.write(json.dumps({'test': 'valid'}))
+    assert config._read_snapshot(key) is not None
+    # 3. a directory others can access isn't used at all
+    cachedir.chmod(0o777)
+    assert config._read_snapshot(key) is None
+    assert config._snapshot_path(key) is None
+
+
+def test_revocation_needs_path():
+    settings = config.load(configpath=os.getenv('CONFIG'))
+    config._validate(
+        dict(settings, revocation={'path': '/tmp/revocations'}), config.CONFIG_SCHEMA_V1_PATH
+    )
+    with pytest.raises(config.ConfigError):
+        config._validate(dict(settings, revocation={}), config.CONFIG_SCHEMA_V1_PATH)
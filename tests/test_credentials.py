@@ -0,0 +1,100 @@
+"""
+    auth.tests.test_credentials
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+import pickle
+
+from dpuser import password_hasher
+
+from auth import credentials, metrics
+
+
+class FakeUsers:
+    """ Stand-in for :class:`auth.pool.PooledUsers`.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def password_hash(self, email):
+        return self.rows.get(email)
+
+    def replace_password_hash(self, email, old, new):
+        if self.rows.get(email) != old:
+            return False
+        self.rows[email] = new
+        return True
+
+
+def test_calibrate():
+    # 1. a fixed number of iterations, but not fewer than the minimum
+    assert credentials.calibrate(iterations=50000) == 50000
+    assert credentials.calibrate(iterations=1000) == password_hasher.ITERATIONS
+    # 2. a target time
+    fast = credentials.calibrate(target=0.001, min_iterations=1000)
+    slow = credentials.calibrate(target=0.1, min_iterations=1000)
+    assert 1000 <= fast < slow and slow % 1000 == 0
+    assert credentials.calibrate(target=10, max_iterations=100000) == 100000
+
+
+def test_verify_password():
+    rows = {'user@example.com': password_hasher.encode('secret', iterations=1000)}
+    registry = metrics.Metrics()
+    verifier = credentials.CredentialVerifier(FakeUsers(rows), 2000, registry)
+    # 1. wrong password and unknown user
+    assert not verifier.verify_password('user@example.com', 'wrong')
+    assert not verifier.verify_password('nobody@example.com', 'secret')
+    assert rows['user@example.com'].startswith('pbkdf2_sha256$1000$')
+    # 2. a successful login upgrades the hash
+    assert verifier.verify_password('User@Example.com', 'secret')
+    assert rows['user@example.com'].startswith('pbkdf2_sha256$2000$')
+    assert password_hasher.verify('secret', rows['user@example.com'])
+    # 3. ... once
+    assert verifier.verify_password('user@example.com', 'secret')
+    stats = verifier.stats()
+    assert (stats.verified, stats.failed, stats.unknown, stats.rehashed) == (2, 2, 1, 1)
+    assert stats.hash_seconds > 0
+    assert registry.collect()[0]['password_hash'][2] == 4
+
+
+def test_dummy_follows_stored_hashes():
+    rows = {'user@example.com': password_hasher.encode('secret', iterations=1000)}
+    verifier = credentials.CredentialVerifier(FakeUsers(rows), 50000)
+    # 1. before any stored hash is read: dpuser's default cost
+    verifier.verify_password('nobody@example.com', 'secret')
+    assert verifier._dummy_iterations == password_hasher.ITERATIONS
+    # 2. then the cost of the hashes that are actually stored, not the
+    # calibrated one
+    verifier.verify_password('user@example.com', 'wrong')
+    assert verifier._dummy_iterations == 1000
+    assert verifier._dummy(1000).startswith('pbkdf2_sha256$1000$')
+    assert not verifier.verify_password('nobody@example.com', 'secret')
+
+
+def test_no_downgrade():
+    encoded = password_hasher.encode('secret', iterations=3000)
+    rows = {'user@example.com': encoded}
+    verifier = credentials.CredentialVerifier(FakeUsers(rows), 2000)
+    assert verifier.verify_password('user@example.com', 'secret')
+    assert rows['user@example.com'] == encoded
+    assert verifier.stats().rehashed == 0
+
+
+def test_store_without_hashes():
+    class Users:
+        def verify_password(self, email, password):
+            return password == 'secret'
+
+    verifier = credentials.CredentialVerifier(Users(), 1000)
+    assert verifier.verify_password('user@example.com', 'secret')
+    assert not verifier.verify_password('user@example.com', 'wrong')
+    assert verifier.stats()[:2] == (1, 1)
+
+
+def test_verifier_factory():
+    factory = credentials.verifier_factory(dict, 1000, metrics.Metrics())
+    # 1. picklable, for the process executor
+    factory = pickle.loads(pickle.dumps(factory))
+    verifier = factory()
+    assert verifier.iterations == 1000 and verifier.users == {}
+    verifier.metrics.observe('password_hash', 0.01)
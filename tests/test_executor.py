@@ -0,0 +1,60 @@
+"""
+    auth.tests.test_executor
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+import threading
+
+import pytest
+
+from auth import executor
+
+
+class BlockingUsers:
+    """ User store that blocks verification until released.
+    """
+    def __init__(self):
+        self.release = threading.Event()
+
+    def verify_password(self, email, password):
+        self.release.wait(5)
+        return password == 'secret'
+
+
+def test_verify_password():
+    verifier = executor.VerificationExecutor(BlockingUsers)
+    verifier._users.release.set()
+    assert verifier.verify_password('user', 'secret')
+    assert not verifier.verify_password('user', 'wrong')
+    verifier.shutdown()
+
+
+def test_queue_full():
+    verifier = executor.VerificationExecutor(
+        BlockingUsers, workers=1, queue_size=1
+    )
+    # 1. one running and one queued verification are admitted
+    running = verifier.submit('user', 'secret')
+    queued = verifier.submit('user', 'secret')
+    # 2. the next one is rejected with a 503
+    with pytest.raises(executor.VerificationUnavailable) as excinfo:
+        verifier.submit('user', 'secret')
+    assert excinfo.value.code == 503
+    assert ('Retry-After', '1') in excinfo.value.get_headers()
+    # 3. slots are released when verifications finish
+    verifier._users.release.set()
+    assert running.result() and queued.result()
+    verifier.verify_password('user', 'secret')
+    verifier.shutdown()
+
+
+def test_timeout():
+    verifier = executor.VerificationExecutor(BlockingUsers, timeout=0.01)
+    with pytest.raises(executor.VerificationUnavailable):
+        verifier.verify_password('user', 'secret')
+    verifier._users.release.set()
+    verifier.shutdown()
+
+
+def test_unknown_executor():
+    with pytest.raises(ValueError):
+        executor.VerificationExecutor(BlockingUsers, executor='fiber')
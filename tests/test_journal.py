@@ -0,0 +1,109 @@
+"""
+    auth.tests.test_journal
+    ~~~~~~~~~~~~~~~~~~~~~~~
+"""
+import logging
+import os
+
+from auth import audit, journal
+
+
+def test_lookup_and_subject(tmpdir):
+    j = journal.Journal(str(tmpdir), segment_records=4, writable=True)
+    for i in range(10):
+        j.append('mac{}'.format(i), 'user{}@example.com'.format(i % 3), timestamp=i)
+    # 1. records are spread over segments
+    assert len(j) == 10
+    assert len(tmpdir.listdir(lambda p: p.ext == '.log')) == 3
+    # 2. lookup by MAC
+    assert j.lookup('mac7') == [journal.Entry(7, 'mac7', 'user1@example.com')]
+    assert j.lookup('unknown') == []
+    # 3. a subject's records, newest first, across segments
+    entries = j.subject('user1@example.com')
+    assert [e.mac for e in entries] == ['mac7', 'mac4', 'mac1']
+    assert len(j.subject('user1@example.com', limit=2)) == 2
+    assert j.subject('nobody@example.com') == []
+    j.close()
+    # 4. a second (reading) process sees the same records
+    reader = journal.Journal(str(tmpdir))
+    assert [e.mac for e in reader.subject('user0@example.com')] == ['mac9', 'mac6', 'mac3', 'mac0']
+    reader.close()
+
+
+def test_append_from_forked_processes(tmpdir):
+    j = journal.Journal(str(tmpdir), segment_records=64, writable=True)
+    # the parent holds an open lock file before forking, like the uwsgi master
+    j.append('parent', 'user@example.com')
+    pids = []
+    for worker in range(4):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for i in range(200):
+                    j.append('mac{}-{}'.format(worker, i), 'user{}@example.com'.format(worker))
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    for i in range(200):
+        j.append('mac-parent-{}'.format(i), 'user@example.com')
+    for pid in pids:
+        os.waitpid(pid, 0)
+    # no record was overwritten by another process
+    assert len(j) == 1 + 5 * 200
+    for worker in range(4):
+        assert len(j.subject('user{}@example.com'.format(worker))) == 200
+        assert len(j.lookup('mac{}-199'.format(worker))) == 1
+    assert len(j.subject('user@example.com')) == 201
+    j.close()
+
+
+def test_long_values_are_truncated(tmpdir):
+    j = journal.Journal(str(tmpdir), segment_records=4, writable=True)
+    mac = 'x' * 342
+    j.append(mac, 'user@example.com')
+    entry, = j.lookup(mac)
+    assert entry.mac == 'x' * 96 + '...'
+    # the full MAC is matched, not just the stored prefix
+    assert j.lookup('x' * 341) == []
+    j.close()
+
+
+def test_long_non_ascii_subject(tmpdir):
+    j = journal.Journal(str(tmpdir), segment_records=4, writable=True)
+    sub = 'a' * 255 + 'é'
+    j.append('mac', sub)
+    j.append('other', 'a' * 255 + 'è')
+    # the stored prefix ends before the character that didn't fit
+    entry, = j.lookup('mac')
+    assert entry.sub == 'a' * 255
+    # subjects are matched in full
+    assert j.subject(sub) == [journal.Entry(entry.timestamp, 'mac', sub)]
+    j.close()
+
+
+def test_handler(tmpdir):
+    handler = journal.JournalHandler(str(tmpdir), segment_records=4)
+    logger = logging.getLogger('auditlog.authserver')
+    level = logger.level
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    try:
+        audit.log_token(b'header.payload.signature', 'user@example.com')
+        logger.info('not an audit record')
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+        handler.close()
+    reader = journal.Journal(str(tmpdir))
+    assert len(reader) == 1
+    assert reader.lookup('signature')[0].sub == 'user@example.com'
+    reader.close()
+
+
+def test_main(tmpdir, capsys):
+    j = journal.Journal(str(tmpdir), writable=True)
+    j.append('signature', 'user@example.com')
+    j.close()
+    assert journal.main([str(tmpdir), 'lookup', 'signature']) == 0
+    assert 'user@example.com\tsignature' in capsys.readouterr().out
+    assert journal.main([str(tmpdir), 'subject', 'nobody@example.com']) == 1
@@ -0,0 +1,121 @@
+"""
+    auth.tests.test_keys
+    ~~~~~~~~~~~~~~~~~~~~
+"""
+import jwt
+import pytest
+from flask import Flask
+
+from auth import keys, token
+from auth.blueprints import jwksblueprint
+
+pytest.importorskip('cryptography')
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+
+def _generate(algorithm):
+    if algorithm.startswith('RS'):
+        return rsa.generate_private_key(65537, 2048, default_backend())
+    if algorithm == 'ES256':
+        return ec.generate_private_key(ec.SECP256R1(), default_backend())
+    return ed25519.Ed25519PrivateKey.generate()
+
+
+def _write_keys(tmpdir, algorithm, name):
+    private = _generate(algorithm)
+    private_file = tmpdir.join(name + '.pem')
+    private_file.write_binary(private.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ))
+    public_file = tmpdir.join(name + '.pub.pem')
+    public_file.write_binary(private.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ))
+    return str(private_file), str(public_file)
+
+
+@pytest.mark.parametrize('algorithm', ['RS256', 'ES256', 'EdDSA'])
+def test_asymmetric_tokenbuilder(tmpdir, algorithm):
+    private_file, public_file = _write_keys(tmpdir, algorithm, 'new')
+    builder = token.TokenBuilder(lifetime=300, algorithm=algorithm, keys=[
+        {'kid': 'new', 'private_key_file': private_file},
+    ])
+    encoded = builder.create(sub='user').encode()
+    assert jwt.get_unverified_header(encoded)['kid'] == 'new'
+    assert builder.decode(encoded)['sub'] == 'user'
+    # verifiers only need the public key
+    verifier = token.TokenBuilder(lifetime=300, algorithm=algorithm, keys=[
+        {'kid': 'new', 'public_key_file': public_file},
+    ])
+    assert verifier.decode(encoded)['sub'] == 'user'
+    with pytest.raises(ValueError):
+        verifier.create().encode()
+    # the key set has the public key only
+    jwk, = builder.jwks()['keys']
+    assert (jwk['kid'], jwk['alg'], jwk['use']) == ('new', algorithm, 'sig')
+    assert 'd' not in jwk
+
+
+def test_key_rotation(tmpdir):
+    old_private, old_public = _write_keys(tmpdir, 'ES256', 'old')
+    new_private, _ = _write_keys(tmpdir, 'ES256', 'new')
+    old = token.TokenBuilder(lifetime=300, algorithm='ES256', keys=[
+        {'kid': 'old', 'private_key_file': old_private},
+    ])
+    new = token.TokenBuilder(secret='legacy', lifetime=300, algorithm='HS256', keys=[
+        {'kid': 'new', 'algorithm': 'ES256', 'private_key_file': new_private},
+        {'kid': 'old', 'algorithm': 'ES256', 'public_key_file': old_public},
+        {'kid': 'hmac', 'secret': 'shared'},
+    ])
+    # 1. tokens signed with the old key still verify
+    assert new.decode(old.create(sub='a').encode())['sub'] == 'a'
+    # 2. new tokens are signed with the first private key
+    encoded = new.create(sub='b').encode()
+    assert jwt.get_unverified_header(encoded)['kid'] == 'new'
+    with pytest.raises(jwt.exceptions.InvalidTokenError):
+        old.decode(encoded)
+    # 3. tokens without a kid are verified with the secret
+    legacy = token.TokenBuilder('legacy', 300, 'HS256')
+    assert new.decode(legacy.create(sub='c').encode())['sub'] == 'c'
+    # 4. HMAC keys are never published
+    assert [k['kid'] for k in new.jwks()['keys']] == ['new', 'old']
+
+
+def test_load_errors(tmpdir):
+    private_file, _ = _write_keys(tmpdir, 'ES256', 'key')
+    with pytest.raises(ValueError):
+        keys.load([{'kid': 'a', 'private_key_file': private_file}], 'RS256')
+    with pytest.raises(ValueError):
+        keys.load([{'kid': 'a', 'secret': 'x'}], 'ES256')
+    with pytest.raises(ValueError):
+        keys.load([{'kid': 'a'}], 'HS256')
+    with pytest.raises(ValueError):
+        keys.load([{'kid': 'a', 'secret': 'x'}], 'none')
+
+
+def test_unknown_kid():
+    signer = token.TokenBuilder(lifetime=300, keys=[{'kid': 'a', 'secret': 's'}])
+    verifier = token.TokenBuilder(lifetime=300, keys=[{'kid': 'b', 'secret': 's'}])
+    with pytest.raises(jwt.exceptions.InvalidTokenError):
+        verifier.decode(signer.create().encode())
+
+
+def test_jwksblueprint(tmpdir):
+    private_file, _ = _write_keys(tmpdir, 'RS256', 'key')
+    builder = token.TokenBuilder(lifetime=300, algorithm='RS256', keys=[
+        {'kid': 'key', 'private_key_file': private_file},
+    ])
+    app = Flask('test')
+    app.register_blueprint(jwksblueprint(builder), url_prefix='/auth')
+    client = app.test_client()
+    response = client.get('/auth/.well-known/jwks.json')
+    assert response.status_code == 200
+    assert response.get_json() == builder.jwks()
+    assert 'max-age=3600' in response.headers['Cache-Control']
+    assert 'public' in response.headers['Cache-Control']
+    etag = response.headers['ETag']
+    response = client.get('/auth/.well-known/jwks.json', headers={'If-None-Match': etag})
+    assert response.status_code == 304
@@ -0,0 +1,47 @@
+"""
+    auth.tests.test_loginpage
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+import pytest
+
+from auth import loginpage
+
+
+@pytest.fixture(scope='module')
+def page():
+    return loginpage.LoginPage()
+
+
+@pytest.mark.parametrize('whitelisted', (False, True))
+@pytest.mark.parametrize('error_html', loginpage.ERRORS + ('<b>other</b>',))
+def test_render(page, whitelisted, error_html):
+    query_string = 'callback=http%3A%2F%2Flocalhost&x="<y>"'
+    expected = page.template.render(
+        query_string=query_string, whitelisted=whitelisted, error_html=error_html
+    )
+    assert page.render(query_string, whitelisted, error_html) == expected.encode('utf-8')
+
+
+def test_etag(page):
+    etag = page.etag('callback=a', False)
+    assert etag.startswith(page.version)
+    assert etag == page.etag('callback=a', False)
+    assert etag != page.etag('callback=a', True)
+    assert etag != page.etag('callback=b', False)
+
+
+def test_is_modified(page):
+    etag = page.etag('callback=a', False)
+    assert page.is_modified({}, etag)
+    assert not page.is_modified({'HTTP_IF_NONE_MATCH': '"{}"'.format(etag)}, etag)
+    assert page.is_modified({'HTTP_IF_NONE_MATCH': '"other"'}, etag)
+    last_modified = dict(page.headers(etag))['Last-Modified']
+    assert not page.is_modified({'HTTP_IF_MODIFIED_SINCE': last_modified}, etag)
+
+
+def test_not_modified_headers(page):
+    etag = page.etag('callback=a', False)
+    headers = dict(page.not_modified_headers(etag))
+    assert 'Content-Type' not in headers
+    assert headers['ETag'] == '"{}"'.format(etag)
+    assert headers['Cache-Control'] == 'no-cache' and headers['Vary'] == 'X-Auth-Whitelist'
@@ -0,0 +1,62 @@
+"""
+    auth.tests.test_metrics
+    ~~~~~~~~~~~~~~~~~~~~~~~
+"""
+import os
+
+import pytest
+
+from auth import metrics
+
+
+def test_metrics():
+    registry = metrics.Metrics(buckets=(0.1, 1), stages=('a', 'b'), outcomes=('ok',))
+    # 1. nothing recorded yet
+    stages, outcomes = registry.collect()
+    assert stages == {'a': ([0, 0, 0], 0, 0), 'b': ([0, 0, 0], 0, 0)}
+    assert outcomes == {'ok': 0}
+    # 2. buckets are cumulative, bounds are inclusive
+    for seconds in (0.05, 0.1, 0.5, 3):
+        registry.observe('a', seconds)
+    registry.inc('ok')
+    stages, outcomes = registry.collect()
+    buckets, total, count = stages['a']
+    assert buckets == [2, 3, 4] and count == 4
+    assert total == pytest.approx(3.65)
+    assert outcomes == {'ok': 1}
+    # 3. timer
+    with registry.time('b'):
+        pass
+    assert registry.collect()[0]['b'][2] == 1
+
+
+def test_metrics_shared(tmpdir):
+    registry = metrics.Metrics(directory=str(tmpdir))
+    registry.observe('token', 0.002)
+    registry.inc('success')
+    # 1. another worker's numbers are added
+    pid = os.fork()
+    if pid == 0:
+        registry.observe('token', 0.002)
+        registry.inc('success')
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert len(tmpdir.listdir()) == 2
+    stages, outcomes = registry.collect()
+    assert stages['token'][2] == 2
+    assert outcomes['success'] == 2
+    # 2. files with another layout are ignored
+    other = metrics.Metrics(directory=str(tmpdir), buckets=(1,))
+    assert other.collect()[1]['success'] == 0
+
+
+def test_exposition():
+    registry = metrics.Metrics(buckets=(0.5,), stages=('token',), outcomes=('success',))
+    registry.observe('token', 0.25)
+    registry.inc('success')
+    lines = registry.exposition().splitlines()
+    assert 'authserver_stage_seconds_bucket{stage="token",le="0.5"} 1' in lines
+    assert 'authserver_stage_seconds_bucket{stage="token",le="+Inf"} 1' in lines
+    assert 'authserver_stage_seconds_sum{stage="token"} 0.25' in lines
+    assert 'authserver_stage_seconds_count{stage="token"} 1' in lines
+    assert 'authserver_logins_total{outcome="success"} 1' in lines
@@ -0,0 +1,145 @@
+"""
+    auth.tests.test_pool
+    ~~~~~~~~~~~~~~~~~~~~
+"""
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+from auth import pool
+
+
+class FakeCursor:
+    rowcount = 0
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, args=None):
+        if self.conn.broken:
+            self.conn.closed = 2
+            raise psycopg2.OperationalError('server closed the connection')
+        self.conn.queries.append(query)
+
+    def fetchone(self):
+        return self.conn.rows.pop(0) if self.conn.rows else None
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.queries = []
+        self.rows = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def test_prewarm_and_stats():
+    p = pool.ConnectionPool(FakeConnection, min_size=2, max_size=3)
+    p.prewarm()
+    stats = p.stats()
+    assert (stats.size, stats.idle, stats.in_use, stats.created) == (2, 2, 0, 2)
+    with p.connection():
+        with p.connection():
+            with p.connection():
+                assert p.stats().in_use == 3
+    assert p.stats().idle == 3
+    p.close()
+    assert p.stats().size == 0
+
+
+def test_reuse_and_acquire_timeout():
+    p = pool.ConnectionPool(FakeConnection, min_size=0, max_size=1, acquire_timeout=0.01)
+    with p.connection() as conn1:
+        with pytest.raises(pool.PoolError):
+            with p.connection():
+                pass
+    with p.connection() as conn2:
+        assert conn1 is conn2
+    assert p.stats().timeouts == 1
+
+
+def test_broken_connections_are_discarded():
+    p = pool.ConnectionPool(FakeConnection, max_size=1, check_interval=0)
+    # 1. a connection that breaks while in use is discarded
+    with pytest.raises(psycopg2.OperationalError):
+        with p.connection() as conn:
+            conn.broken = True
+            conn.cursor().execute('SELECT 1')
+    assert p.stats().size == 0
+    # 2. an idle connection is checked before it's handed out
+    with p.connection() as conn:
+        pass
+    conn.broken = True
+    with p.connection() as conn2:
+        assert conn2 is not conn
+    assert p.stats().closed == 2
+
+
+def test_lifetime():
+    p = pool.ConnectionPool(FakeConnection, max_lifetime=0)
+    with p.connection() as conn1:
+        pass
+    with p.connection() as conn2:
+        pass
+    assert conn1 is not conn2
+    assert conn1.closed
+
+
+def test_backoff_after_failed_connect():
+    def connect():
+        raise psycopg2.OperationalError('connection refused')
+    p = pool.ConnectionPool(connect, max_backoff=60)
+    p.prewarm()
+    assert p.stats().failed == 1
+    p._retry_at = float('inf')
+    with pytest.raises(pool.PoolError):
+        with p.connection():
+            pass
+    assert p.stats().failed == 1
+
+
+@pytest.mark.real_pool
+def test_pooled_users(monkeypatch):
+    conn = FakeConnection()
+    monkeypatch.setattr(pool, '_connect', lambda dsn: conn)
+    users = pool.PooledUsers('postgresql://', min_size=1)
+    assert users.pool.stats().idle == 1
+    assert not users.verify_password('unknown@example.com', 'secret')
+    stats = users.pool.stats()
+    assert (stats.created, stats.idle) == (1, 1)
+    # password hashes, for auth.credentials
+    conn.rows.append(('pbkdf2_sha256$1000$salt$hash',))
+    assert users.password_hash('user@example.com') == 'pbkdf2_sha256$1000$salt$hash'
+    assert users.password_hash('nobody@example.com') is None
+    assert not users.replace_password_hash('user@example.com', 'old', 'new')
+    assert conn.queries[-1].startswith('UPDATE users SET password')
+
+
+def test_users_factory(monkeypatch):
+    settings = {'host': 'h', 'port': 1, 'user': 'u', 'password': 'p', 'dbname': 'd'}
+    factory = pool.users_factory(settings)
+    assert factory.args == ('postgresql://u:p@h:1/d',)
+    factory = pool.users_factory(dict(settings, pool={'max_size': 2}))
+    assert factory.func is pool.PooledUsers
+    assert factory.keywords == {'max_size': 2}
@@ -0,0 +1,119 @@
+"""
+    auth.tests.test_provision
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+import io
+import json
+
+import pytest
+from dpuser import password_hasher
+
+from auth import provision
+
+CSV = """email,password,name
+User1@Example.com,password1,One
+not-an-email,password2,Two
+user3@example.com,short,Three
+user4@example.com,password4,Four
+"""
+
+
+def test_read_users():
+    # 1. CSV, with invalid records
+    users = list(provision.read_users(io.StringIO(CSV), 'csv'))
+    assert users == [
+        ('user1@example.com', 'password1'), None, None, ('user4@example.com', 'password4')
+    ]
+    # 2. JSON Lines, blank lines are ignored
+    jsonl = '{"email": "user1@example.com", "password": "password1"}\n\n[1]\n{\n'
+    users = list(provision.read_users(io.StringIO(jsonl), 'jsonl'))
+    assert users == [('user1@example.com', 'password1'), None, None]
+    with pytest.raises(ValueError):
+        list(provision.read_users(io.StringIO(''), 'xml'))
+
+
+@pytest.mark.parametrize('workers', [0, 1])
+def test_provision(workers):
+    writer = provision.MemoryWriter({'user4@example.com': 'existing'})
+    seen = []
+    progress = provision.provision(
+        provision.read_users(io.StringIO(CSV), 'csv'), writer, iterations=1000,
+        batch_size=3, workers=workers, on_batch=seen.append
+    )
+    assert progress[:4] == (4, 2, 1, 1)
+    assert [p.records for p in seen] == [3, 4]
+    assert writer.users['user4@example.com'] == 'existing'
+    assert password_hasher.verify('password1', writer.users['user1@example.com'])
+
+
+def test_provision_update():
+    writer = provision.MemoryWriter({'user4@example.com': 'existing'}, update=True)
+    progress = provision.provision(
+        provision.read_users(io.StringIO(CSV), 'csv'), writer, iterations=1000, workers=0
+    )
+    assert progress.written == 2 and progress.existing == 0
+    assert password_hasher.verify('password4', writer.users['user4@example.com'])
+
+
+def test_resume(tmpdir):
+    path = str(tmpdir.join('state'))
+    writer = provision.MemoryWriter()
+    assert provision.load_state(path, 'users.csv') == 0
+    # 1. the first batch is done
+    provision.save_state(path, 'users.csv', provision.Progress(3, 2, 1, 0, 0.0))
+    skip = provision.load_state(path, 'users.csv')
+    # 2. only the rest is written
+    progress = provision.provision(
+        provision.read_users(io.StringIO(CSV), 'csv'), writer, iterations=1000,
+        workers=0, skip=skip
+    )
+    assert progress.records == 4 and list(writer.users) == ['user4@example.com']
+    # 3. the state is about one input
+    with pytest.raises(ValueError):
+        provision.load_state(path, 'other.csv')
+
+
+def test_main_dry_run(tmpdir, capsys):
+    path = tmpdir.join('users.jsonl')
+    path.write('\n'.join(json.dumps({
+        'email': 'user{}@example.com'.format(i), 'password': 'password{}'.format(i)
+    }) for i in range(10)))
+    state = str(tmpdir.join('state'))
+    assert provision.main([
+        str(path), '--dry-run', '--iterations', '1000', '--workers', '0',
+        '--batch-size', '4', '--state', state
+    ]) == 0
+    err = capsys.readouterr().err
+    assert '10 records' in err and '10 written' in err and 'Dry run' in err
+    # a dry run doesn't record progress
+    assert not tmpdir.join('state').check()
+
+
+def test_postgres_writer(monkeypatch):
+    import psycopg2
+
+    class Cursor:
+        rowcount = 1
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            pass
+
+        def execute(self, query):
+            executed.append(query)
+
+        def copy_expert(self, query, f):
+            executed.append(f.read())
+
+    class Connection(Cursor):
+        def cursor(self):
+            return Cursor()
+
+    executed = []
+    monkeypatch.setattr(psycopg2, 'connect', lambda dsn: Connection())
+    writer = provision.PostgresWriter('postgresql://localhost/accounts', update=True)
+    assert writer.write([('user1@example.com', 'hash1'), ('user2@example.com', 'hash2')]) == 1
+    assert executed[1] == 'user1@example.com\thash1\nuser2@example.com\thash2\n'
+    assert 'DO UPDATE SET password' in executed[2]
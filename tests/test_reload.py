@@ -0,0 +1,71 @@
+"""
+    auth.tests.test_reload
+    ~~~~~~~~~~~~~~~~~~~~~~
+"""
+import logging
+import pathlib
+
+import pytest
+
+from auth import callbacks, config as config_module, reload, token
+
+
+@pytest.fixture()
+def configfile(tmpdir):
+    source = pathlib.Path(config_module.__file__).parent.parent / 'config.yml'
+    p = tmpdir.join('config.yml')
+    p.write(source.read_text())
+    return p
+
+
+@pytest.fixture()
+def reloader(configfile):
+    config = config_module.load(str(configfile))
+    return reload.Reloader(
+        str(configfile), config,
+        reload.Swappable(token.TokenBuilder(**config['jwt'])),
+        reload.Swappable(callbacks.CallbackIndex(config['callbacks'])),
+        interval=0
+    )
+
+
+def test_swappable():
+    swappable = reload.Swappable([1])
+    assert swappable.count(1) == 1
+    assert swappable.swap([2, 2]) == [1]
+    assert swappable.count(2) == 2
+
+
+def test_reload(reloader, configfile):
+    builder = reloader.tokenbuilder.current
+    assert not reloader.check()
+    assert reloader.callback_index.match('https://example.com/cb') is None
+    configfile.write(
+        configfile.read()
+        .replace('  - http://localhost\n', '  - http://localhost\n  - https://example.com\n')
+        .replace('lifetime: ${JWT_LIFETIME:-10}', 'lifetime: 20')
+        .replace('    level: ${LOGLEVEL:-DEBUG}', '    level: WARNING')
+    )
+    level = logging.getLogger().level
+    try:
+        assert reloader.check()
+        assert logging.getLogger().level == logging.WARNING
+    finally:
+        logging.getLogger().setLevel(level)
+    assert reloader.callback_index.match('https://example.com/cb') is not None
+    assert reloader.tokenbuilder.current is not builder
+    assert reloader.tokenbuilder.lifetime == 20
+    assert reloader.reloads == 1
+
+
+def test_reject_invalid(reloader, configfile):
+    builder = reloader.tokenbuilder.current
+    # 1. not valid according to the schema
+    configfile.write(configfile.read().replace('algorithm: HS256', 'algorithm: none'))
+    assert not reloader.check()
+    # 2. an unknown log level
+    configfile.write(configfile.read().replace('algorithm: none', 'algorithm: HS256')
+                     .replace('    level: ${LOGLEVEL:-DEBUG}', '    level: LOUD'))
+    assert not reloader.check()
+    assert reloader.failures == 2
+    assert reloader.tokenbuilder.current is builder
@@ -0,0 +1,77 @@
+"""
+    auth.tests.test_revocation
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+import time
+
+import pytest
+
+from auth import revocation, token
+
+
+def test_revoke_mac_and_sub():
+    revocations = revocation.RevocationList(lifetime=60)
+    now = int(time.time())
+    claims = {'sub': 'user@example.com', 'iat': now - 60, 'exp': now + 60}
+    assert not revocations.is_revoked('mac', claims)
+    # 1. by MAC
+    revocations.revoke_mac('mac')
+    assert revocations.is_revoked('mac', claims)
+    assert not revocations.is_revoked('other', claims)
+    # 2. by subject: only tokens issued until now
+    revocations.revoke_sub('user@example.com')
+    assert revocations.is_revoked('other', claims)
+    later = dict(claims, iat=now + 10)
+    assert not revocations.is_revoked('other', later)
+    with pytest.raises(revocation.TokenRevoked):
+        revocations.check('other', claims)
+
+
+def test_prune():
+    revocations = revocation.RevocationList(lifetime=60, refresh_interval=0)
+    revocations.revoke_mac('expired', expires=time.time() - 1)
+    revocations.revoke_mac('valid')
+    revocations.revoke_sub('user@example.com')
+    revocations.refresh()
+    assert len(revocations) == 2
+    revocations.refresh(time.time() + 120)
+    assert len(revocations) == 0
+
+
+def test_shared_file(tmpdir):
+    path = str(tmpdir.join('revocations'))
+    first = revocation.RevocationList(lifetime=60, path=path, refresh_interval=0)
+    second = revocation.RevocationList(lifetime=60, path=path, refresh_interval=0)
+    first.revoke_mac('mac')
+    assert second.is_revoked('mac', {})
+    # pruning compacts the file; the other process reloads it
+    first.revoke_mac('expired', expires=time.time() - 1)
+    first.refresh()
+    assert len(tmpdir.join('revocations').readlines()) == 1
+    second.revoke_sub('user@example.com')
+    assert first.is_revoked('other', {'sub': 'user@example.com'})
+    assert first.is_revoked('mac', {})
+
+
+def test_tokenbuilder_decode():
+    revocations = revocation.RevocationList(lifetime=60)
+    builder = token.TokenBuilder('secret', 60, 'HS256', revocations=revocations)
+    encoded = builder.create(sub='user@example.com').encode()
+    builder.decode(encoded)
+    revocations.revoke_token(encoded, builder.decode(encoded))
+    # also when the verified claims are cached
+    with pytest.raises(revocation.TokenRevoked):
+        builder.decode(encoded)
+    assert builder.decode(builder.create(sub='other@example.com').encode())
+
+
+def test_refresh_interval(tmpdir):
+    path = str(tmpdir.join('revocations'))
+    first = revocation.RevocationList(lifetime=60, path=path)
+    second = revocation.RevocationList(lifetime=60, path=path, refresh_interval=60)
+    assert not second.is_revoked('mac', {})
+    first.revoke_mac('mac')
+    # the file isn't checked again within the interval
+    assert not second.is_revoked('mac', {})
+    second.refresh()
+    assert second.is_revoked('mac', {})
@@ -0,0 +1,31 @@
+"""
+    auth.tests.test_server
+    ~~~~~~~~~~~~~~~~~~~~~~
+"""
+import os
+
+import pytest
+
+
+def test_create_app(app):
+    import auth.server
+    components = app.extensions['authserver']
+    assert components.tokenbuilder is auth.server.tokenbuilder
+    assert set(app.config['STARTUP_TIMES']) == {'import', 'prepare', 'worker'}
+    # a second application doesn't share the first one's components
+    other = auth.server.create_app(os.getenv('CONFIG'))
+    assert other.extensions['authserver'].users is not components.users
+
+
+def test_metrics_need_directory(tmpdir, monkeypatch):
+    from auth import components, config, server
+    path = tmpdir.join('config.yml')
+    path.write(open(os.getenv('CONFIG') or str(config.DEFAULT_CONFIG_PATHS[1])).read() + (
+        '\nmetrics:\n  api_key: metrics-key-of-16+\n'
+    ))
+    monkeypatch.setattr(components, '_worker_count', lambda: 4)
+    with pytest.raises(config.ConfigError):
+        server.create_app(str(path))
+    path.write(path.read() + '  directory: {}\n'.format(tmpdir.join('metrics')))
+    app = server.create_app(str(path))
+    assert '/auth/idp/metrics' in [rule.rule for rule in app.url_map.iter_rules()]
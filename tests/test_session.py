@@ -0,0 +1,87 @@
+"""
+    auth.tests.test_session
+    ~~~~~~~~~~~~~~~~~~~~~~~
+"""
+import urllib.parse
+
+import pytest
+from flask import Flask
+
+from auth import session, token
+from auth.blueprints import idpblueprint
+
+
+class FakeUsers:
+    def __init__(self):
+        self.verified = 0
+
+    def verify_password(self, email, password):
+        self.verified += 1
+        return (email, password) == ('user@example.com', 'secret')
+
+
+def test_memorybackend(monkeypatch):
+    now = [1000]
+    monkeypatch.setattr(session.time, 'time', lambda: now[0])
+    backend = session.MemoryBackend(max_keys=2)
+    # 1. entries expire
+    backend.set('a', b'1', 10)
+    assert backend.get('a') == b'1'
+    now[0] += 10
+    assert backend.get('a') is None
+    # 2. expired and the oldest entries are evicted
+    backend.set('b', b'2', 10)
+    assert len(backend) == 1
+    backend.set('c', b'3', 10)
+    backend.set('d', b'4', 10)
+    assert backend.get('b') is None and backend.get('d') == b'4'
+
+
+def test_sessionstore(monkeypatch):
+    store = session.SessionStore('0123456789abcdef', ttl=60)
+    cookie = store.create('user@example.com')
+    assert store.get(cookie) == 'user@example.com'
+    # 1. forged and malformed cookies
+    session_id, expires, signature = cookie.split('.')
+    assert store.get('{}.{}.{}'.format(session_id, int(expires) + 60, signature)) is None
+    assert store.get(cookie[:-1]) is None
+    assert store.get('garbage') is None and store.get(None) is None
+    # 2. another secret
+    assert session.SessionStore('fedcba9876543210').get(cookie) is None
+    # 3. revoking the subject ends its sessions
+    store.revoke_sub('user@example.com')
+    assert store.get(cookie) is None
+    assert store.get(store.create('user@example.com')) == 'user@example.com'
+    # 4. ended sessions
+    cookie = store.create('other@example.com')
+    store.delete(cookie)
+    assert store.get(cookie) is None
+    with pytest.raises(ValueError):
+        session.SessionStore('0123456789abcdef', backend='unknown')
+
+
+def test_single_sign_on():
+    users = FakeUsers()
+    store = session.SessionStore('0123456789abcdef', ttl=60, secure=False)
+    app = Flask('test')
+    app.register_blueprint(idpblueprint(
+        token.TokenBuilder('secret', 60), ['http://localhost'], users, sessions=store
+    ), url_prefix='/auth/idp')
+    client = app.test_client()
+    url = '/auth/idp/login?' + urllib.parse.urlencode({'callback': 'http://localhost/cb'})
+    # 1. the form, before logging in
+    assert client.get(url).status_code == 200
+    # 2. a password login sets the cookie
+    response = client.post(url, data={'email': 'user@example.com', 'password': 'secret'})
+    assert response.status_code == 303
+    assert store.cookie_name + '=' in response.headers['Set-Cookie']
+    assert 'HttpOnly' in response.headers['Set-Cookie']
+    # 3. a returning browser skips the form and the password
+    response = client.get(url)
+    assert response.status_code == 303
+    assert response.headers['Location'].startswith('http://localhost/cb')
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert users.verified == 1
+    # 4. until it logs out
+    assert client.post('/auth/idp/logout').status_code == 204
+    assert client.get(url).status_code == 200
@@ -0,0 +1,180 @@
+"""
+    auth.tests.test_simpleidp
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+import pytest
+from jwt import InvalidTokenError
+
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
+
+
+def _url(app, path):
+    import auth.server
+    return '{}/idp{}'.format(auth.server.config['app']['root'], path)
+
+
+def test_introspect():
+    from flask import Flask
+    from auth import token
+    from auth.blueprints import idpblueprint
+    tokenbuilder = token.TokenBuilder('secret', 60)
+    app = Flask('test')
+    app.register_blueprint(idpblueprint(
+        tokenbuilder, ['http://localhost'], object(),
+        introspection_key='introspection-key'
+    ), url_prefix='/auth/idp')
+    client = app.test_client()
+    encoded = tokenbuilder.create(sub='user@example.com').encode()
+    auth = {'Authorization': 'Bearer introspection-key'}
+    # 1. without the key there are no claims, not even whether it's valid
+    for headers in ({}, {'Authorization': 'Bearer wrong'}):
+        response = client.post('/auth/idp/introspect', data={'token': encoded}, headers=headers)
+        assert response.status_code == 401
+        assert response.headers['WWW-Authenticate'].startswith('Bearer')
+        assert b'user@example.com' not in response.data
+    # 2. valid token
+    response = client.post('/auth/idp/introspect', data={'token': encoded}, headers=auth)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert response.get_json()['active'] is True
+    assert response.get_json()['sub'] == 'user@example.com'
+    # 3. invalid and missing token
+    for data in ({'token': encoded.decode()[:-2]}, {}):
+        response = client.post('/auth/idp/introspect', data=data, headers=auth)
+        assert response.get_json() == {'active': False}
+
+
+def test_introspect_not_configured(app, client):
+    assert client.post(_url(app, '/introspect')).status_code == 404
+
+
+def test_revoke(tmpdir):
+    from flask import Flask
+    from auth import revocation, token
+    from auth.blueprints import idpblueprint
+    tokenbuilder = token.TokenBuilder(
+        'secret', 60, revocations=revocation.RevocationList(60, path=str(tmpdir.join('revoked')))
+    )
+    app = Flask('test')
+    app.register_blueprint(idpblueprint(
+        tokenbuilder, ['http://localhost'], object(), revocation_key='revocation-key'
+    ), url_prefix='/auth/idp')
+    client = app.test_client()
+    encoded = tokenbuilder.create(sub='user@example.com').encode()
+    # 1. the holder of a token can revoke it
+    response = client.post('/auth/idp/revoke', data={'token': encoded})
+    assert response.status_code == 200
+    with pytest.raises(InvalidTokenError):
+        tokenbuilder.decode(encoded)
+    # 2. invalid tokens are ignored
+    response = client.post('/auth/idp/revoke', data={'token': 'invalid'})
+    assert response.status_code == 200
+    # 3. revoking by subject needs the revocation key
+    response = client.post('/auth/idp/revoke', data={'sub': 'user@example.com'})
+    assert response.status_code == 403
+    response = client.post(
+        '/auth/idp/revoke', data={'sub': 'user@example.com'},
+        headers={'Authorization': 'Bearer revocation-key'}
+    )
+    assert response.status_code == 200
+    response = client.post('/auth/idp/revoke')
+    assert response.status_code == 400
+
+
+def test_show_form_conditional(app, client):
+    url = _url(app, '/login?callback=http%3A%2F%2Flocalhost%2Fcb')
+    response = client.get(url)
+    assert response.status_code == 200
+    assert b'login?callback=http%3A%2F%2Flocalhost%2Fcb' in response.data
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    response = client.get(url, headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+
+
+def test_static(app, client):
+    import auth.server
+    url = auth.server.asset_store.url('style.css')
+    response = client.get(_url(app, '/login?callback=http%3A%2F%2Flocalhost%2Fcb'))
+    assert url.encode() in response.data
+    response = client.get(_url(app, '/' + url), headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'immutable' in response.headers['Cache-Control']
+    response = client.get(_url(app, '/' + url), headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']
+    })
+    assert response.status_code == 304
+    assert client.get(_url(app, '/static/nothing.css')).status_code == 404
+
+
+def test_metrics():
+    from flask import Flask
+    from auth import metrics, token
+    from auth.blueprints import idpblueprint
+    app = Flask('test')
+    app.register_blueprint(idpblueprint(
+        token.TokenBuilder('secret', 60), ['http://localhost'], object(),
+        metrics=metrics.Metrics(), metrics_key='metrics-key'
+    ), url_prefix='/auth/idp')
+    client = app.test_client()
+    client.get('/auth/idp/login?callback=http%3A%2F%2Flocalhost%2Fcb')
+    # 1. only for scrapers with the key
+    response = client.get('/auth/idp/metrics')
+    assert response.status_code == 401
+    assert b'authserver' not in response.data
+    response = client.get('/auth/idp/metrics', headers={'Authorization': 'Bearer metrics-key'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    count = [
+        line for line in response.get_data(as_text=True).splitlines()
+        if line.startswith('authserver_stage_seconds_count{stage="render"}')
+    ]
+    assert count and int(count[0].split()[-1]) >= 1
+
+
+def test_metrics_not_configured(app, client):
+    assert client.get(_url(app, '/metrics')).status_code == 404
+
+
+def test_throttle_concurrent_logins():
+    import threading
+    import time
+    from flask import Flask
+    from auth import throttle, token
+    from auth.blueprints import idpblueprint
+
+    class SlowUsers:
+        def verify_password(self, email, password):
+            time.sleep(0.05)
+            return False
+
+    app = Flask('test')
+    app.register_blueprint(idpblueprint(
+        token.TokenBuilder('secret', 60), ['http://localhost'], SlowUsers(),
+        throttle.Throttle(email={'rate': 1, 'burst': 3})
+    ), url_prefix='/auth/idp')
+    barrier = threading.Barrier(10)
+    statuses = []
+
+    def login():
+        client = app.test_client()
+        barrier.wait()
+        response = client.post(
+            '/auth/idp/login?callback=http://localhost/cb',
+            data={'email': 'user@example.com', 'password': 'guess'}
+        )
+        statuses.append(response.status_code)
+    threads = [threading.Thread(target=login) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # parallel guesses are limited to the burst, even while all of them are
+    # still being verified
+    assert sorted(statuses) == [200] * 3 + [429] * 7
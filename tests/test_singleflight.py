@@ -0,0 +1,85 @@
+"""
+    auth.tests.test_singleflight
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+import threading
+
+import pytest
+
+from auth import executor, singleflight
+
+
+class BlockingUsers:
+    """ User store that blocks verification until released, and counts calls.
+    """
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def verify_password(self, email, password):
+        self.calls += 1
+        self.release.wait(5)
+        if password == 'error':
+            raise RuntimeError(password)
+        return password == 'secret'
+
+
+def _verify_concurrently(verifier, credentials):
+    results = [None] * len(credentials)
+
+    def verify(i, email, password):
+        try:
+            results[i] = verifier.verify_password(email, password)
+        except Exception as e:
+            results[i] = e
+
+    threads = [
+        threading.Thread(target=verify, args=(i,) + c)
+        for i, c in enumerate(credentials)
+    ]
+    for t in threads:
+        t.start()
+    return threads, results
+
+
+@pytest.mark.parametrize('with_executor', [False, True])
+def test_coalescing(with_executor):
+    users = BlockingUsers()
+    wrapped = users
+    if with_executor:
+        wrapped = executor.VerificationExecutor(lambda: users, workers=4)
+    verifier = singleflight.CoalescingVerifier(wrapped)
+    credentials = [('user@example.com', 'secret')] * 3 + [('USER@example.com', 'secret'), ('user@example.com', 'wrong')]
+    threads, results = _verify_concurrently(verifier, credentials)
+    while verifier.stats()['calls'] < len(credentials):
+        pass
+    users.release.set()
+    for t in threads:
+        t.join()
+    assert results == [True, True, True, True, False]
+    assert users.calls == 2
+    assert verifier.stats() == {'calls': 5, 'coalesced': 3, 'in_flight': 0}
+    # results are not cached once the verification is done
+    assert verifier.verify_password('user@example.com', 'secret')
+    assert users.calls == 3
+    verifier.shutdown()
+
+
+def test_coalesced_exception():
+    users = BlockingUsers()
+    verifier = singleflight.CoalescingVerifier(users)
+    threads, results = _verify_concurrently(verifier, [('user', 'error')] * 2)
+    while verifier.stats()['calls'] < 2:
+        pass
+    users.release.set()
+    for t in threads:
+        t.join()
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert users.calls == 1
+
+
+def test_key():
+    verifier = singleflight.CoalescingVerifier(BlockingUsers())
+    assert verifier._key('a:b', 'c') != verifier._key('a', 'b:c')
+    assert verifier._key('A', 'b') == verifier._key('a', 'b')
+    assert singleflight.CoalescingVerifier(BlockingUsers())._key('a', 'b') != verifier._key('a', 'b')
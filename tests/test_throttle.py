@@ -0,0 +1,67 @@
+"""
+    auth.tests.test_throttle
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+import pytest
+
+from auth import throttle
+
+
+def test__take():
+    # 1. a new bucket is full
+    bucket, retry_after = throttle._take(None, rate=60, burst=2, now=0)
+    assert bucket == (1, 0) and retry_after is None
+    bucket, retry_after = throttle._take(bucket, rate=60, burst=2, now=0)
+    assert bucket == (0, 0) and retry_after is None
+    # 2. an empty bucket says when to retry
+    bucket, retry_after = throttle._take(bucket, rate=60, burst=2, now=0.5)
+    assert retry_after == pytest.approx(0.5)
+    # 3. tokens are added at `rate` per minute, up to `burst`
+    bucket, retry_after = throttle._take(bucket, rate=60, burst=2, now=1)
+    assert retry_after is None
+    bucket, retry_after = throttle._take(bucket, rate=60, burst=2, now=100)
+    assert bucket == (1, 100)
+    # 4. checking costs nothing
+    bucket, retry_after = throttle._take(bucket, rate=60, burst=2, now=100, cost=0)
+    assert bucket == (1, 100) and retry_after is None
+    # 5. tokens can be given back, also to an empty bucket, up to `burst`
+    bucket, retry_after = throttle._take((0, 100), rate=60, burst=2, now=100, cost=-1)
+    assert bucket == (1, 100) and retry_after is None
+    bucket, _ = throttle._take((2, 100), rate=60, burst=2, now=100, cost=-1)
+    assert bucket == (2, 100)
+
+
+def test_memorybackend_max_keys():
+    backend = throttle.MemoryBackend(max_keys=2)
+    for key in 'abc':
+        backend.take(key, 1, 1, now=0)
+    assert list(backend._buckets) == ['b', 'c']
+
+
+def test_throttle_check(monkeypatch):
+    monkeypatch.setattr(throttle.time, 'time', lambda: 1000)
+    limiter = throttle.Throttle(
+        email={'rate': 1, 'burst': 2}, address={'rate': 1, 'burst': 3}
+    )
+    # 1. successful logins give their token back
+    for _ in range(5):
+        limiter.check('user@example.com', '10.0.0.1')
+        limiter.record_success('user@example.com', '10.0.0.1')
+    # 2. failed ones don't, and the email limit applies case-insensitively
+    limiter.check('user@example.com', '10.0.0.1')
+    limiter.check('USER@example.com', '10.0.0.1')
+    with pytest.raises(throttle.Throttled) as excinfo:
+        limiter.check('user@example.com', '10.0.0.1')
+    assert excinfo.value.code == 429
+    assert ('Retry-After', '61') in excinfo.value.get_headers()
+    # 3. the address limit applies across email addresses; a rejected
+    # attempt didn't take a token from it
+    limiter.check('other@example.com', '10.0.0.1')
+    with pytest.raises(throttle.Throttled):
+        limiter.check('other@example.com', '10.0.0.1')
+    limiter.check('other@example.com', '10.0.0.2')
+
+
+def test_throttle_unknown_backend():
+    with pytest.raises(ValueError):
+        throttle.Throttle(backend='redis')
@@ -2,9 +2,11 @@
     auth.tests.test_token
     ~~~~~~~~~~~~~~~~~~~~~
 """
+import datetime
+
 import jwt
 import pytest
-from auth import token
+from auth import callbacks, token
 
 
 def test_tokenbuilder_success():
@@ -38,3 +40,85 @@ def test_tokenbuilder_decode_error():
     encoded = builder1.create().encode()
     with pytest.raises(jwt.exceptions.DecodeError):
         builder2.decode(encoded)
+
+
+@pytest.mark.parametrize('algorithm', ['HS256', 'HS384', 'HS512'])
+def test_tokenbuilder_encoder_matches_pyjwt(algorithm):
+    builder = token.TokenBuilder('sécret', 300, algorithm)
+    claims = [
+        builder.create(),
+        builder.create(sub='user@example.com', scopes=['A', 'B'], nested={'x': 1.5}),
+        builder.create(sub='ünïcode', iat=datetime.datetime(2017, 1, 1)),
+    ]
+    for data, encoded in zip(claims, builder.encode_many(claims)):
+        expected = jwt.encode(dict(data), 'sécret', algorithm=algorithm)
+        assert encoded == expected
+        decoded = jwt.decode(encoded, 'sécret', algorithms=[algorithm])
+        assert decoded == jwt.decode(expected, 'sécret', algorithms=[algorithm])
+
+
+def test_tokenbuilder_encode_many():
+    builder = token.TokenBuilder('secret', 300, 'HS256')
+    encoded = builder.encode_many(builder.create(sub=str(i)) for i in range(3))
+    assert [builder.decode(e)['sub'] for e in encoded] == ['0', '1', '2']
+
+
+def test_tokenbuilder_decode_cache(monkeypatch):
+    builder = token.TokenBuilder('secret', 300, 'HS256')
+    encoded = builder.create(sub='user').encode()
+    # 1. the second decode is served from the cache
+    builder.decode(encoded)
+    data = builder.decode(encoded)
+    assert data['sub'] == 'user'
+    assert (builder._cache.hits, builder._cache.misses) == (1, 1)
+    # 2. results are copies
+    data['sub'] = 'other'
+    assert builder.decode(encoded)['sub'] == 'user'
+    # 3. a different payload with the same MAC is verified, and rejected
+    header, payload, mac = encoded.decode().split('.')
+    forged = '.'.join((header, builder.create(sub='admin').encode().decode().split('.')[1], mac))
+    with pytest.raises(jwt.exceptions.DecodeError):
+        builder.decode(forged)
+    # 4. expired tokens aren't served from the cache
+    monkeypatch.setattr(token.time, 'time', lambda: data['exp'] + 1)
+    assert builder._cache.get(encoded) is None
+    assert len(builder._cache) == 0
+
+
+def test_verifiedtokencache_eviction(monkeypatch):
+    cache = token.VerifiedTokenCache(maxsize=2)
+    monkeypatch.setattr(token.time, 'time', lambda: 100)
+    cache.put('a.b.1', {'exp': 150})
+    cache.put('a.b.2', {'exp': 200})
+    cache.put('a.b.3', {})
+    # 1. least recently used is evicted when full
+    assert len(cache) == 2 and cache.get('a.b.1') is None
+    # 2. expired tokens are evicted
+    monkeypatch.setattr(token.time, 'time', lambda: 201)
+    cache.put('a.b.4', {'exp': 300})
+    assert cache.get('a.b.2') is None
+    assert cache.get('a.b.3') == {}
+    assert cache.get(b'a.b.4') == {'exp': 300}
+
+
+def test_for_policy():
+    builder = token.TokenBuilder('secret', 10, 'HS256', keys=[
+        {'kid': 'a', 'secret': 'secret-a'}, {'kid': 'b', 'secret': 'secret-b'},
+    ])
+    # 1. the default policy is the builder itself
+    assert builder.for_policy(None) is builder
+    assert builder.for_policy(callbacks.Policy('x', None, None, None)) is builder
+    # 2. derived builders are cached per policy
+    policy = callbacks.Policy('x', 300, {'aud': 'batch', 'exp': 0}, 'b')
+    derived = builder.for_policy(policy)
+    assert builder.for_policy(policy) is derived
+    data = derived.create(sub='user')
+    assert data['exp'] - data['iat'] == 300 + 60
+    assert (data['aud'], data['sub']) == ('batch', 'user')
+    encoded = data.encode()
+    assert jwt.get_unverified_header(encoded)['kid'] == 'b'
+    # 3. and verify with the same keys and cache as the builder
+    assert builder.decode(encoded)['aud'] == 'batch'
+    assert derived._cache is builder._cache
+    with pytest.raises(ValueError):
+        builder.for_policy(callbacks.Policy('x', None, None, 'unknown'))